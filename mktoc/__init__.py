@@ -68,19 +68,92 @@
       file does not contain pregaps, or if you do not wish to retain the pregap
       information.
 
+   --accuraterip=<BIN_FILE>
+
+      compute the AccurateRip v1 and v2 checksums of the audio tracks, and
+      compare them with a local AccurateRip response file (``dBAR-*.bin``),
+      without a network connection. The offset correction values within 5
+      CD frames that match the response are printed to ``STDERR``, and a
+      warning is printed when the ``-c`` value (or 0) is not matched.
+      Requires NumPy.
+
+   --buffer-size=<KB>
+
+      size of the buffer used to copy WAV data, in KiB. By default the size is
+      selected from the block size of the output file system
+
    -c <WAV_OFFSET>, --offset-correction=<WAV_OFFSET>
 
       correct reader/writer offset by creating WAV file(s) shifted by
-      WAV_OFFSET samples (original data is not modified)
+      WAV_OFFSET samples (original data is not modified). When the command
+      is run again, only missing or outdated WAV files are written.
+
+   --convert
+
+      convert WAV files that are not CD-DA audio (16-bit, 44.1 kHz, stereo)
+      to new WAV files in a ``cdda`` directory, before any offset
+      correction. The sample rate is changed with a polyphase resampler,
+      the bit depth is reduced with TPDF dither, mono audio is copied to
+      both channels and only the first two channels of multichannel audio
+      are kept. Files are converted in parallel. Without this option,
+      mktoc stops when a WAV file is not CD-DA audio. Requires NumPy.
+
+   --crc
+
+      with ``-c``, compute the CRC32 of each WAV file while the audio is
+      copied, with no extra reads. The copy CRC of each input file, the copy
+      CRC from the ExactAudioCopy log (if found) and the CRC of the offset
+      corrected output are written as comments at the top of the TOC file.
+      Input files that do not match the log are reported.
 
    -d, --debug
 
       enable debugging statements
 
+   --detect-gaps
+
+      with ``-w``, find the digital silence at the start and end of each WAV
+      file, in whole CD frames. Silence at the end of a file becomes the
+      pregap of the next track, and silence at the start of a file is marked
+      as pregap with ``START``, so hidden track gaps are kept. Requires
+      NumPy.
+
+   --fifo
+
+      with ``-c``, create named pipes (FIFOs) in place of the offset corrected
+      WAV files. The TOC file refers to the pipes, and mktoc keeps running to
+      write the shifted audio as cdrdao reads it, so no disk space is used
+      for a second copy of the audio. Start cdrdao after the TOC is written.
+
    -f <CUE_FILE>, --file=<CUE_FILE>
 
       specify the input CUE file to read
 
+   --image=<WAV_FILE>
+
+      join the WAV files into one WAV image of the disc, and write a TOC file
+      that refers to the image, so cdrdao reads a single file sequentially.
+      With ``-c``, the image holds the offset corrected audio and no other
+      WAV files are written. The audio data is copied by the kernel with
+      ``copy_file_range``. Every WAV file except the last must hold a whole
+      number of CD frames.
+
+   --in-place
+
+      with ``-c``, shift the audio of the WAV files in place instead of
+      writing new files; the original data IS modified. Only a small journal
+      file is written next to the WAV files. If the run is interrupted, run
+      the same command again to resume it, or add ``--rollback`` to restore
+      the original audio.
+
+   --io=<MODE>
+
+      page cache policy used when WAV files are copied. ``default`` only adds
+      sequential read-ahead hints. ``nocache`` drops the WAV data from the
+      page cache once it is read or written, and writes the output in the
+      background while the copy runs. ``direct`` also reads the input with
+      ``O_DIRECT``. Use ``--stats`` to see the hint and sync call counts.
+
    -m, --multi
 
       for safety, this option must be set when creating a mulit-session TOC
@@ -90,9 +163,74 @@
 
       specify the output TOC file to write
 
+   --plan=<MINUTES>
+
+      with ``-w``, split the WAV files into as few discs of ``MINUTES``
+      length as possible, and write one TOC file per disc. The disc number
+      is added to the TOC file name (``disc.toc`` is written as
+      ``disc-1.toc``, ``disc-2.toc``, ...). The tracks are separated by 2
+      second pregaps, and the 2 second lead pregap of each disc is counted.
+      The tracks keep their order unless ``--reorder`` is set
+
+   --profile=<MODE>
+
+      profile the run. ``cpu`` runs it under ``cProfile`` and writes a
+      ``pstats`` file (``mktoc.prof``, or ``--profile-file``), and a short
+      report to ``STDERR``. ``mem`` traces the memory allocations with
+      ``tracemalloc``, and reports the allocated size, the peak size and the
+      top allocating source lines of each phase (parse, lookup, offset, ...)
+      to ``STDERR``, or to ``--profile-file``
+
+   --profile-file=<FILE>
+
+      write the ``--profile`` output to ``FILE``
+
+   --progress=<MODE>
+
+      select the progress output written to ``STDERR`` while WAV files are
+      processed. ``bar`` draws a progress bar, ``json`` writes one JSON object
+      per line and ``quiet`` disables the output (default: ``bar`` when
+      ``STDERR`` is a terminal, otherwise ``quiet``)
+
+   --reorder
+
+      with ``--plan``, allow tracks to move to another disc to fit the
+      WAV files on fewer discs. The tracks of each disc stay in list order
+
+   --rollback
+
+      with ``-c`` and ``--in-place``, restore the original audio of an
+      interrupted in-place offset correction
+
+   --split=<DIR>
+
+      cut the audio into one WAV file per track (``trackNN.wav``) in
+      ``DIR``, and write a TOC file that refers to the new files. Each file
+      starts at INDEX 01 of its track and holds the pregap of the next
+      track. The audio data is copied by the kernel with
+      ``copy_file_range``, for all tracks in parallel.
+
+   --stats
+
+      print a report of the time spent in each phase (decode, parse, lookup,
+      probe, offset, ...) and of the I/O counters to ``STDERR``
+
+   --stats-json
+
+      print the phase timers and I/O counters to ``STDERR`` as a JSON object
+
    -t, --use-temp
 
-      write offset corrected WAV files to /tmp directory
+      write offset corrected or converted WAV files to /tmp directory
+
+   --validate
+
+      check that the WAV files can be written to a CD as they are, and write
+      a JSON report instead of a TOC file. Each file is checked for CD-DA
+      format (16-bit, 44.1 kHz, stereo), whole CD frames and a complete data
+      chunk, and the disc length is compared with 74, 80 and 90 minute
+      media. All arguments are CUE files, checked in parallel. The exit
+      status is 1 if any album can not be written.
 
    -w, --wave
 
@@ -146,6 +284,50 @@
 
          mktoc -c 30 -t < cue_file.cue
 
+   8. Stream offset corrected audio to cdrdao through named pipes, without
+      writing new WAV files. Run cdrdao from a second shell once the TOC file
+      is written::
+
+         mktoc -c 30 --fifo -f cue_file.cue -o disc.toc
+         cdrdao write disc.toc
+
+   9. Write a TOC file from a list of WAV files, with the silence between
+      the tracks as pregaps::
+
+         mktoc --detect-gaps -w *.wav -o disc.toc
+
+   10. Write one offset corrected WAV image of the disc, and a TOC file
+       that refers to it::
+
+          mktoc -c 30 --image disc.wav -f cue_file.cue -o disc.toc
+
+   11. Cut a single file CUE image into one WAV file per track::
+
+          mktoc --split tracks -f image.cue -o disc.toc
+
+   12. Check that an offset correction value reproduces an AccurateRip
+       verified rip, with a saved AccurateRip response file::
+
+          mktoc -c 30 --accuraterip dBAR-012-0012a5b4-00b8d2c5-a10c920c.bin \\
+                -f cue_file.cue -o disc.toc
+
+   13. Check a batch of albums before burning them, and write one JSON
+       report::
+
+          mktoc --validate */*.cue -o report.json
+
+   14. Fit a list of WAV files on as few 80 minute CDs as possible, and
+       write ``mix-1.toc``, ``mix-2.toc``, ...::
+
+          mktoc --plan 80 --reorder -w *.wav -o mix.toc
+
+   15. Find the slowest functions of a run, and read the profile with
+       ``pstats``::
+
+          mktoc --profile cpu --profile-file run.prof -f cue_file.cue \\
+                -o disc.toc
+          python -m pstats run.prof
+
    Contact
    =======
 
@@ -164,6 +346,7 @@
 
 import sys
 import mktoc.cmdline
+from mktoc.converter import Converter, TocResult
 
 if __name__ == '__main__':
    sys.exit(mktoc.cmdline.main())
@@ -16,7 +16,7 @@
 __all__        = ['__author__', '__copyright__', '__email__', '__license__',
                   'VERSION', 'MkTocError' ,'FileNotFoundError',
                   'TooManyFilesMatchError', 'ParseError', 'UnderflowError',
-                  'EmptyCueData' ]
+                  'EmptyCueData', 'FileOpenError', 'MultiSessionError' ]
 
 #: Project author string.
 __author__     = 'Patrick C. McGinty'
@@ -62,3 +62,13 @@ class EmptyCueData(MkTocError):
    exit code."""
    pass
 
+class FileOpenError(MkTocError):
+   """Exception class used when a CUE or TOC file can not be opened."""
+   pass
+
+class MultiSessionError(MkTocError):
+   """Exception class indicates that the CUE data has multi-session track
+   info, and multi-session output was not enabled or disabled by the
+   caller."""
+   pass
+
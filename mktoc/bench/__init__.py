@@ -0,0 +1,21 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   mktoc.bench
+   ~~~~~~~~~~~
+
+   Benchmark suite for mktoc.
+
+   The :mod:`~mktoc.bench.corpus` module generates synthetic albums (CUE
+   sheet, WAV files and EAC log) of any size, and the
+   :mod:`~mktoc.bench.suite` module times the main phases of mktoc against
+   them. Results are saved as JSON so runs of different versions can be
+   compared::
+
+      python -m mktoc.bench -o before.json
+      python -m mktoc.bench -o after.json --compare before.json
+"""
@@ -0,0 +1,16 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   Entry point for ``python -m mktoc.bench``.
+"""
+
+import sys
+
+from mktoc.bench import suite
+
+if __name__ == '__main__':
+   sys.exit(suite.main())
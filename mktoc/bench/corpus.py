@@ -0,0 +1,218 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   mktoc.bench.corpus
+   ~~~~~~~~~~~~~~~~~~
+
+   Generators for synthetic album rips.
+
+   An album is written as a set of per-track WAV files, an EAC style CUE sheet
+   with the gaps appended to the previous track, and optionally an EAC log
+   file. The WAV data can be *sparse* (only the header is written and the
+   file is extended with a hole, so very large albums are cheap to create) or
+   *real* (filled with pseudo-random PCM data).
+
+   The following are a list of the classes provided in this module:
+
+   * :class:`Album`
+"""
+
+import os
+import random
+import zlib
+
+from mktoc.base import *
+from mktoc import wav
+
+__all__ = ['Album', 'make_album']
+
+#: Number of PCM bytes in one CD frame (588 stereo 16-bit samples).
+FRAME_BYTES = 2352
+
+# block size used when writing 'real' PCM data.
+_BLOCK_SIZE = 1024*1024
+
+
+##############################################################################
+class Album(object):
+   """
+   Description of a generated album.
+
+   .. attribute:: cue
+
+      Path of the CUE sheet.
+
+   .. attribute:: log
+
+      Path of the EAC log, or :data:`None`.
+
+   .. attribute:: wavs
+
+      In-order list of the WAV file paths.
+
+   .. attribute:: track_frames
+
+      List with the length of each WAV file in CD frames.
+   """
+   def __init__(self, dir_, cue, wavs, track_frames, log=None):
+      self.dir_ = dir_
+      self.cue = cue
+      self.wavs = wavs
+      self.track_frames = track_frames
+      self.log = log
+
+   @property
+   def total_bytes(self):
+      """Total size of the PCM data of the album."""
+      return sum(self.track_frames) * FRAME_BYTES
+
+
+def make_album( dir_, tracks=12, track_frames=75*60*4, indexes=1,
+                pregap_frames=0, data_track=False, eac_log=False,
+                wav='sparse', seed=0 ):
+   """
+   Write a synthetic album to *dir_*.
+
+   :param dir_:   Output directory, created if needed.
+   :type  dir_:   str
+
+   :param tracks: Number of audio tracks.
+   :type  tracks: int
+
+   :param track_frames: Length of each track in CD frames.
+   :type  track_frames: int
+
+   :param indexes:   Number of INDEX entries (1 or more) in each track.
+   :type  indexes:   int
+
+   :param pregap_frames:   Length of the INDEX 00 pregap of tracks 2 and up,
+                           stored at the end of the previous WAV file.
+   :type  pregap_frames:   int
+
+   :param data_track:   Add a final data track (multi-session disc). This
+                        also forces the EAC log to be written, because mktoc
+                        reads the data track size from the log.
+   :type  data_track:   bool
+
+   :param eac_log:   Write an EAC log file next to the CUE sheet.
+   :type  eac_log:   bool
+
+   :param wav:    ``'sparse'``, ``'real'`` or :data:`None` to skip the WAV
+                  files.
+   :type  wav:    str
+
+   :param seed:   Seed of the pseudo-random PCM data.
+   :type  seed:   int
+
+   :returns: :class:`Album`
+   """
+   if not os.path.exists(dir_):
+      os.makedirs(dir_)
+   rnd = random.Random(seed)
+   names = ['%02d - Track %02d.wav' % (n,n) for n in range(1,tracks+1)]
+   wavs = [os.path.join(dir_,n) for n in names]
+   frames = [track_frames] * tracks
+   crcs = [0] * tracks
+   if wav:
+      for i,path in enumerate(wavs):
+         crcs[i] = _write_wav(path, frames[i], wav, rnd)
+   cue = os.path.join(dir_, 'album.cue')
+   with open(cue,'w') as fh:
+      fh.write( _cue_text( names, frames, indexes, pregap_frames,
+                           data_track))
+   log = None
+   if eac_log or data_track:
+      log = os.path.join(dir_, 'album.log')
+      with open(log,'w') as fh:
+         fh.write( _log_text(names, frames, crcs, data_track) )
+   return Album(dir_, cue, wavs, frames, log)
+
+
+def _msf(frames, fmt='%02d:%02d:%02d'):
+   """Format a CD frame count as MM:SS:FF."""
+   min_,fr = divmod(frames, 75*60)
+   sec,fr = divmod(fr, 75)
+   return fmt % (min_, sec, fr)
+
+
+def _cue_text(names, frames, indexes, pregap_frames, data_track):
+   """Return the text of an EAC style CUE sheet."""
+   out = ['REM GENRE Benchmark', 'REM DATE 2011', 'REM DISCID 00000000',
+          'REM COMMENT "mktoc.bench"', 'PERFORMER "Bench Artist"',
+          'TITLE "Bench Album"']
+   for i,name in enumerate(names):
+      num = i + 1
+      # the FILE command follows the INDEX 00 gap in the previous file
+      gap = i and pregap_frames
+      if not gap:
+         out += ['FILE "%s" WAVE' % name]
+      out += ['  TRACK %02d AUDIO' % num,
+              '    TITLE "Track %02d"' % num,
+              '    PERFORMER "Bench Artist"']
+      if gap:
+         out += ['    INDEX 00 %s' % _msf(frames[i-1] - pregap_frames),
+                 'FILE "%s" WAVE' % name]
+      out += ['    INDEX 01 00:00:00']
+      # evenly spaced sub-indexes
+      length = frames[i] - (pregap_frames if num < len(names) else 0)
+      for n in range(2, indexes+1):
+         out += ['    INDEX %02d %s' % (n, _msf(length*(n-1)//indexes))]
+   if data_track:
+      out += ['  TRACK %02d MODE1/2352' % (len(names)+1),
+              '    TITLE "Data"',
+              '    INDEX 01 %s' % _msf(frames[-1])]
+   return '\n'.join(out) + '\n'
+
+
+def _log_text(names, frames, crcs, data_track):
+   """Return the text of an EAC extraction log."""
+   out = ['Exact Audio Copy V0.99 prebeta 5 from 4. May 2009', '',
+          'EAC extraction logfile (mktoc.bench)', '',
+          'Bench Artist / Bench Album', '',
+          'TOC of the extracted CD', '',
+          '     Track |   Start  |  Length  | Start sector | End sector ',
+          '    ---------------------------------------------------------']
+   lengths = list(frames)
+   if data_track:
+      lengths.append(75*60)
+   start = 0
+   for i,length in enumerate(lengths):
+      if data_track and i == len(lengths)-1:
+         start += 11400    # data session lead-in gap
+      out += ['       %2d  | %s | %s |    %6d    |   %6d   ' % (
+               i+1, _msf(start,'%2d:%02d.%02d'), _msf(length,'%2d:%02d.%02d'),
+               start,
+               start + length - 1)]
+      start += length
+   out += ['']
+   for i,name in enumerate(names):
+      out += ['', 'Track %2d' % (i+1), '',
+              '     Filename C:\\rips\\Bench Album\\%s' % name, '',
+              '     Peak level 100.0 %',
+              '     Copy CRC %08X' % crcs[i],
+              '     Copy OK']
+   return '\r\n'.join(out) + '\r\n'
+
+
+def _write_wav(path, frames, mode, rnd):
+   """Write a 16-bit stereo 44.1kHz WAV file and return the CRC32 of the
+   PCM data."""
+   size = frames * FRAME_BYTES
+   crc = 0
+   with open(path,'wb') as fh:
+      fh.write( wav.wav_header(2, 2, 44100, frames*588) )
+      if mode == 'sparse':
+         fh.truncate(44 + size)
+         return 0
+      block = bytes(rnd.getrandbits(8) for i in range(FRAME_BYTES)) * \
+                  (_BLOCK_SIZE // FRAME_BYTES)
+      while size:
+         data = block[:min(size, len(block))]
+         crc = zlib.crc32(data, crc)
+         fh.write(data)
+         size -= len(data)
+   return crc
@@ -0,0 +1,217 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   mktoc.bench.suite
+   ~~~~~~~~~~~~~~~~~
+
+   Benchmarks of the main mktoc phases, run against a synthetic album from
+   :mod:`mktoc.bench.corpus`.
+
+   Each benchmark is a function that accepts the :class:`Album` and returns a
+   callable to time. Benchmarks are registered in :data:`BENCHMARKS`.
+"""
+
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from optparse import OptionParser
+
+from mktoc.base import *
+from mktoc import disc
+from mktoc import parser
+from mktoc import serial
+from mktoc import wav
+from mktoc.bench import corpus
+
+__all__ = ['BENCHMARKS', 'run', 'compare', 'main']
+
+
+def bench_parse(album):
+   """Parse the CUE sheet, including the WAV lookup and header probes."""
+   with open(album.cue) as fh:
+      lines = fh.readlines()
+   def fn():
+      parser.CueParser(album.dir_).parse(lines)
+   return fn
+
+
+def bench_lookup(album):
+   """Fuzzy WAV file name lookup in a new file cache, including the
+   directory scan."""
+   names = [os.path.basename(f).replace(' ','_') for f in album.wavs]
+   def fn():
+      cache = wav.WavFileCache(album.dir_, wav.WavScanCache())
+      for n in names:
+         cache(n)
+   return fn
+
+
+def bench_probe(album):
+   """Read the length of each WAV file, in a directory not seen before."""
+   def fn():
+      idx = [disc.TrackIndex(1, 0, f) for f in album.wavs]
+      disc.TrackIndex.lengths.clear()
+      disc.TrackIndex.resolve(idx)
+   return fn
+
+
+def bench_render(album):
+   """Convert parsed CUE data to TOC text."""
+   with open(album.cue) as fh:
+      data = parser.CueParser(album.dir_).parse(fh)
+   def fn():
+      data.getToc()
+   return fn
+
+
+def bench_load(album, fmt='binary'):
+   """Load saved parse data, including the WAV file identity check. Compare
+   with 'parse'; the loaded data has the index lengths resolved."""
+   with open(album.cue) as fh:
+      data = parser.CueParser(album.dir_).parse(fh)
+   buf = serial.dumps(data, fmt)
+   def fn():
+      serial.loads(buf)
+   return fn
+
+
+def bench_load_json(album):
+   """Same as 'load', using the JSON format."""
+   return bench_load(album, 'json')
+
+
+def bench_offset(album):
+   """Write offset corrected copies of all WAV files to a temp dir."""
+   with open(album.cue) as fh:
+      data = parser.CueParser(album.dir_).parse(fh)
+   def fn():
+      writer = wav.WavOffsetWriter(30)
+      out = writer(data.files, True)
+      shutil.rmtree(os.path.dirname(out[0]))
+   return fn
+
+
+#: Ordered list of ``(name, function)`` benchmark definitions.
+BENCHMARKS = [
+   ('parse',   bench_parse),
+   ('lookup',  bench_lookup),
+   ('probe',   bench_probe),
+   ('render',  bench_render),
+   ('load',    bench_load),
+   ('load_json', bench_load_json),
+   ('offset',  bench_offset),
+   ]
+
+
+def run(album, names=None, repeat=5):
+   """
+   Run benchmarks against *album*.
+
+   :param album:  Generated test album.
+   :type  album:  :class:`~mktoc.bench.corpus.Album`
+
+   :param names:  Names of the benchmarks to run, default is all.
+   :type  names:  list
+
+   :param repeat: Number of timed runs of each benchmark.
+   :type  repeat: int
+
+   :returns: :class:`dict` of benchmark name to timing results in seconds.
+   """
+   results = {}
+   for name,bench in BENCHMARKS:
+      if names and name not in names:
+         continue
+      fn = bench(album)
+      times = []
+      for i in range(repeat):
+         start = time.perf_counter()
+         fn()
+         times.append(time.perf_counter() - start)
+      times.sort()
+      results[name] = {
+         'min'    : times[0],
+         'median' : times[len(times)//2],
+         'max'    : times[-1],
+         'repeat' : repeat,
+         }
+   return results
+
+
+def compare(new, old):
+   """
+   Return report lines that compare the median times of two result
+   documents, as written by :func:`main`.
+   """
+   out = ['%-10s %12s %12s %8s' % ('benchmark','old','new','ratio')]
+   for name in sorted(new['results']):
+      if name not in old['results']:
+         continue
+      a = old['results'][name]['median']
+      b = new['results'][name]['median']
+      out += ['%-10s %12.6f %12.6f %7.2fx' % (name, a, b, b/a if a else 0)]
+   return out
+
+
+def main(argv=None):
+   """Command line entry point of ``python -m mktoc.bench``."""
+   p = OptionParser(usage='python -m mktoc.bench [OPTIONS] [BENCHMARK ...]')
+   p.add_option('-o', '--output', dest='output',
+         help='write the JSON results to OUTPUT')
+   p.add_option('--compare', dest='compare',
+         help='compare the results with a previous JSON results file')
+   p.add_option('-r', '--repeat', dest='repeat', type='int', default=5,
+         help='number of timed runs of each benchmark [default: %default]')
+   p.add_option('--tracks', dest='tracks', type='int', default=12,
+         help='number of tracks in the album [default: %default]')
+   p.add_option('--seconds', dest='seconds', type='int', default=30,
+         help='length of each track in seconds [default: %default]')
+   p.add_option('--indexes', dest='indexes', type='int', default=1,
+         help='number of INDEX entries per track [default: %default]')
+   p.add_option('--pregap', dest='pregap', type='int', default=2,
+         help='pregap length in seconds [default: %default]')
+   p.add_option('--data-track', dest='data_track', action='store_true',
+         default=False,
+         help='add a data track, making a multi-session album')
+   p.add_option('--wav', dest='wav', type='choice',
+         choices=['sparse','real'], default='sparse',
+         help="'sparse' or 'real' WAV data [default: %default]")
+   p.add_option('--dir', dest='dir_',
+         help='create the album in DIR_ and keep it, instead of a temp dir')
+   opt,args = p.parse_args(argv)
+
+   params = { 'tracks':opt.tracks, 'track_frames':opt.seconds*75,
+              'indexes':opt.indexes, 'pregap_frames':opt.pregap*75,
+              'data_track':opt.data_track, 'wav':opt.wav }
+   dir_ = opt.dir_ or tempfile.mkdtemp(prefix='mktoc-bench.')
+   try:
+      album = corpus.make_album(dir_, eac_log=True, **params)
+      results = run(album, args, opt.repeat)
+   finally:
+      if not opt.dir_:
+         shutil.rmtree(dir_)
+   doc = {
+      'version'   : VERSION,
+      'python'    : platform.python_version(),
+      'platform'  : platform.platform(),
+      'time'      : time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'params'    : params,
+      'results'   : results,
+      }
+   for name,bench in BENCHMARKS:
+      if name in results:
+         print('%-10s %12.6f s' % (name, results[name]['median']))
+   if opt.output:
+      with open(opt.output,'w') as fh:
+         json.dump(doc, fh, indent=2, sort_keys=True)
+   if opt.compare:
+      with open(opt.compare) as fh:
+         print('\n'.join(compare(doc, json.load(fh))))
+   return 0
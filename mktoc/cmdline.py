@@ -11,8 +11,8 @@
    Command-line interface for Mktoc.
 """
 
-import codecs
-import chardet.universaldetector
+import concurrent.futures
+import json
 import logging
 import os
 import re
@@ -23,6 +23,10 @@ from optparse import OptionParser
 
 from .base import *
 from .parser import *
+from . import converter
+from . import progress_bar
+from . import stats
+from . import wav
 
 
 # WAV file reading command-line switch
@@ -56,7 +60,13 @@ class CommandLine(object):
    def run(self,argv=sys.argv[1:]):
       """Execution entry point."""
       try:
-         self._run(argv)
+         return self._run(argv)
+      except FileOpenError as e:
+         print(e, file=sys.stderr)
+         return -1
+      except MultiSessionError as e:
+         self._error_msg_multisession(e)
+         return -1
       except TooManyFilesMatchError as e:
          self._error_msg_multi_files(e)
       except FileNotFoundError as e:
@@ -67,33 +77,158 @@ class CommandLine(object):
    def _run(self,argv):
       # parse all command line arguments, exit if there is any error
       opt,args = self._parse_args(argv)
+      if opt.no_multisession:
+         policy = 'ignore'
+      elif opt.multisession:
+         policy = 'allow'
+      else:
+         policy = 'error'
+      self.converter = converter.Converter( opt.find_wav,
+                                            multisession=policy )
       # setup logging
       if opt.debug: logging.basicConfig(level=logging.DEBUG)
+      # setup phase timers and counters
+      if opt.stats or opt.stats_json:
+         collector = stats.enable()
+      try:
+         if opt.profile:
+            with stats.Profiler( opt.profile, opt.profile_file ) as prof:
+               try:
+                  return self._dispatch(opt)
+               finally:
+                  self._profile_report(opt, prof)
+         return self._dispatch(opt)
+      finally:
+         if opt.stats or opt.stats_json:
+            stats.disable()
+            if opt.stats:
+               print(collector.report(), file=sys.stderr)
+            if opt.stats_json:
+               print(collector.to_json(), file=sys.stderr)
+
+   def _dispatch(self, opt):
+      """Run the mode selected by the options."""
+      if opt.validate:
+         return self._validate(opt)
+      if opt.plan:
+         return self._plan(opt)
+      self._convert(opt)
+
+   def _profile_report(self, opt, prof):
+      """Write the '--profile' report, when the profiled run ends."""
+      if opt.profile == 'cpu':
+         # the profile file is written on exit of the profiled block
+         print( 'CPU profile written to: %s' % opt.profile_file,
+                file=sys.stderr )
+      elif opt.profile_file:
+         with open(opt.profile_file, 'w') as fh:
+            fh.write( prof.report() + '\n' )
+      else:
+         print(prof.report(), file=sys.stderr)
+
+   def _read_input(self, opt, cue_file):
+      """Parse the CUE file *cue_file* (STDIN if :data:`None`), or the '-w'
+      WAV file list."""
       # check if using WAV list or CUE file
       if opt.wav_files is None:
-         # open CUE file
-         if opt.cue_file:
-            fh_in = self._open_file( opt.cue_file )
-            # set the working dir of the input file
-            cue_dir = os.path.dirname( fh_in.name ) or os.curdir
-         else:
-            cue_dir = os.curdir
-            fh_in = sys.stdin
-         # create CUE file parser
-         assert(cue_dir)
-         p = CueParser( cue_dir, opt.find_wav)
-         cd_obj = p.parse( fh_in)
-         fh_in.close()
+         # the CUE file, or STDIN with the WAV files in the working dir
+         cd_obj = self.converter.parse( cue_file or sys.stdin )
       else:
          wav_dir = os.path.dirname( opt.wav_files[0] ) or os.curdir
          # create WAV list parser
          assert( wav_dir)
-         p = WavParser( wav_dir, opt.find_wav)
+         p = WavParser( wav_dir, opt.find_wav, opt.detect_gaps)
          cd_obj = p.parse( opt.wav_files)
+      return cd_obj
+
+   def _validate(self, opt):
+      """Write a JSON report of :meth:`~mktoc.parser.ParseData.validate` for
+      each album, and return the exit status. Albums are checked at the same
+      time."""
+      if opt.wav_files is not None:
+         sources = [' '.join(opt.wav_files)]
+      else:
+         sources = opt.cue_files or ['-']
+      def check(src):
+         try:
+            cd_obj = self._read_input( opt, None if src == '-' else src )
+            # probe the files of one album in parallel, or the albums
+            rep = cd_obj.validate( 1 if len(sources) > 1 else None )
+         except MkTocError as e:
+            rep = { 'ok':False, 'errors':[str(e) or e.__class__.__name__],
+                    'warnings':[], 'files':[] }
+         rep['source'] = src
+         return rep
+      with concurrent.futures.ThreadPoolExecutor(
+               min(len(sources), os.cpu_count() or 1)) as pool:
+         albums = list(pool.map(check, sources))
+      report = { 'ok':all(a['ok'] for a in albums), 'albums':albums }
+      text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+      if opt.toc_file:
+         with open(opt.toc_file, 'w') as fh:
+            fh.write(text)
+      else:
+         sys.stdout.write(text)
+      return 0 if report['ok'] else 1
+
+   def _plan(self, opt):
+      """Split the '-w' WAV files into discs, and write one TOC file per
+      disc."""
+      p = WavParser( os.path.dirname(opt.wav_files[0]) or os.curdir )
+      discs = p.plan( opt.wav_files, int(opt.plan*60*75),
+                      reorder=opt.reorder )
+      base,ext = os.path.splitext(opt.toc_file)
+      for n,cd_obj in enumerate(discs):
+         name = '%s-%d%s' % (base, n+1, ext or '.toc')
+         fh_out = self._open_file( name,'wb','utf-8' )
+         fh_out.write( self._banner_msg())
+         for l in cd_obj.getToc():
+            fh_out.write("%s\n" % l)
+         fh_out.close()
+         print( '%s: %d tracks, %d:%02d' % ((name, len(cd_obj.files)) +
+                                            divmod(cd_obj.length // 75, 60)),
+                file=sys.stderr )
+
+   def _convert(self,opt):
+      """Read the input data, and write the TOC file."""
+      cd_obj = self._read_input( opt, opt.cue_file )
       # warn user when TOC is multi-session
       self._check_multisession_opt( cd_obj, opt)
-      if opt.wav_offset:
-         cd_obj.modWavOffset( opt.wav_offset, opt.write_tmp )
+      if opt.accuraterip:
+         self._accuraterip_report( cd_obj, opt)
+      mode = opt.progress or progress_bar.default_renderer()
+      renderer = progress_bar.RENDERERS[mode]
+      buf_size = opt.buf_size and opt.buf_size * 1024
+      not_cdda = cd_obj.nonCddaFiles()
+      if not_cdda and not opt.convert:
+         raise MkTocError( "'%s' is not CD-DA audio (16-bit, 44.1 kHz, "
+                           "stereo); use the '--convert' option" %
+                           not_cdda[0] )
+      if not_cdda:
+         progress = progress_bar.Progress( renderer('converting WAV files:'))
+         cd_obj.convertCdda( opt.write_tmp, progress=progress,
+                             buf_size=buf_size )
+      if opt.split:
+         progress = progress_bar.Progress( renderer('splitting WAV files:'))
+         cd_obj.splitTracks( opt.split, progress=progress,
+                             buf_size=buf_size )
+      elif opt.image:
+         progress = progress_bar.Progress( renderer('writing WAV image:'))
+         cd_obj.writeImage( opt.image, opt.wav_offset or 0,
+                            progress=progress, buf_size=buf_size )
+      elif opt.wav_offset:
+         progress = progress_bar.Progress( renderer('processing WAV files:'))
+         if opt.rollback:
+            # undo an interrupted in-place correction, the TOC refers to the
+            # original audio
+            wav.InPlaceOffsetWriter( opt.wav_offset, progress, buf_size
+                                   ).rollback( cd_obj.files )
+         else:
+            cd_obj.modWavOffset( opt.wav_offset, opt.write_tmp,
+                                 progress=progress, buf_size=buf_size,
+                                 policy=wav.IoPolicy(opt.io_mode),
+                                 fifo=opt.fifo, in_place=opt.in_place,
+                                 checksum=opt.crc )
       toc = cd_obj.getToc()
       # open TOC file
       if opt.toc_file:
@@ -126,42 +261,46 @@ class CommandLine(object):
          #########################################################
          """ % (cd_obj.last_index.len_.frames-2)), file=sys.stderr)    # see note for '-2'
 
+      if opt.fifo:
+         # the TOC is complete, stream the audio while cdrdao reads it
+         print( 'Waiting for cdrdao to read the offset corrected WAV '
+                'FIFOs...', file=sys.stderr )
+         cd_obj.serveFifos()
+
+   def _accuraterip_report(self, cd, opt):
+      """Print the AccurateRip results of each track to STDERR."""
+      offset = opt.wav_offset or 0
+      results = cd.verifyAccurateRip( opt.accuraterip, offset )
+      print('AccurateRip (%s):' % opt.accuraterip, file=sys.stderr)
+      bad = False
+      for res in results:
+         line = '   track %02d: v1 %08X, v2 %08X' % (
+                  res['track'], res['v1'], res['v2'])
+         found = [m for m in res['matches'] if m[0] == offset]
+         if found:
+            line += ', matches at %s %+d (v%d, confidence %d)' % (
+                  (_OPT_OFFSET_CORRECT,) + found[0])
+         elif res['matches']:
+            bad = True
+            line += ', NO MATCH at %s %+d; matches at %s' % (
+                  _OPT_OFFSET_CORRECT, offset,
+                  ', '.join('%+d' % m[0] for m in res['matches']))
+         else:
+            bad = True
+            line += ', NOT FOUND'
+         print(line, file=sys.stderr)
+      if bad:
+         print('   WARNING! - offset correction %+d is not verified by '
+               'AccurateRip' % offset, file=sys.stderr)
+
    @staticmethod
    def _open_file(name,mode='rb',encoding=None):
       """Wrapper for opening files. Ensures correct encoding is selected."""
-      try:
-         if encoding is None:
-            # detect file character encoding
-            with open(name,mode) as fh:
-               d = chardet.universaldetector.UniversalDetector()
-               for line in fh.readlines():
-                  d.feed(line)
-               d.close()
-               encoding = d.result['encoding']
-         return codecs.open(name, mode, encoding=encoding)
-      except:
-         print(sys.exc_info()[1], file=sys.stderr)
-         exit(-1)
+      return converter.open_file(name, mode, encoding)
 
    def _check_multisession_opt(self, cd, opt):
       """Check multi-session run-time options match track info."""
-      if not cd.disc.is_multisession:
-         return
-      if opt.no_multisession:
-         # disable multi-session
-         cd.disc.is_multisession = False
-      elif not opt.multisession:
-         # multisesssion option must be set to prevent usage error
-         print(textwrap.dedent("""
-            WARNING! - Detected multi-session track info.
-
-            For safety, '%s' option must be specified when creating a TOC
-            for a multi-session disc.
-
-            If you want to ignore this check, and disable multi-session
-            features, use the '%s' argument.""" %
-               (_OPT_MULTI_SESSION,_OPT_IGNORE_MULTI_SESSION)), file=sys.stderr)
-         sys.exit(-1)
+      self.converter.check_multisession(cd)
 
    def _banner_msg(self):
       """Returns a TOC comment header that is placed at the top of the
@@ -183,24 +322,105 @@ class CommandLine(object):
       parser.add_option( _OPT_ALLOW_WAV_FNF, '--allow-missing-wav',
             dest='find_wav', action="store_false", default=True,
             help='do not abort when WAV file(s) are missing, (experts only)')
+      parser.add_option('--accuraterip', dest='accuraterip',
+            metavar='BIN_FILE',
+            help='compare the AccurateRip checksums of the WAV files with a '
+                 'local AccurateRip response file, and search for the '
+                 'matching offset correction' )
+      parser.add_option('--buffer-size', dest='buf_size', type='int',
+            metavar='KB',
+            help='size of the WAV copy buffer in KiB; by default the size is '
+                 'selected for the output storage' )
       parser.add_option( _OPT_OFFSET_CORRECT, '--offset-correction',
             dest='wav_offset', type='int',
             help='correct reader/writer offset by creating WAV file(s) '
                  'shifted by WAV_OFFSET samples (original data is '
                  'not modified)' )
+      parser.add_option('--convert', dest='convert', action='store_true',
+            default=False,
+            help='convert WAV files that are not CD-DA audio (16-bit, '
+                 '44.1 kHz, stereo) to new WAV files' )
+      parser.add_option('--crc', dest='crc', action='store_true',
+            default=False,
+            help='with offset correction, compute the CRC32 of the WAV data '
+                 'while it is copied, and compare it to the EAC log' )
       parser.add_option('-d', '--debug', dest='debug', action="store_true",
             default=False, help='enable debugging statements' )
+      parser.add_option('--detect-gaps', dest='detect_gaps',
+            action='store_true', default=False,
+            help="with '%s', set track pregaps from the digital silence "
+                 "between the WAV files" % _OPT_WAV_LIST )
       parser.add_option( _OPT_CUE_FILE, '--file', dest='cue_file',
             help='specify the input CUE file to read')
+      parser.add_option('--fifo', dest='fifo', action='store_true',
+            default=False,
+            help='with offset correction, create named pipes instead of '
+                 'new WAV files, and stream the audio to cdrdao on demand' )
+      parser.add_option('--image', dest='image', metavar='WAV_FILE',
+            help='join the WAV files (offset corrected with %s) into one '
+                 'WAV image, and write a TOC that refers to the image'
+                 % _OPT_OFFSET_CORRECT )
+      parser.add_option('--in-place', dest='in_place', action='store_true',
+            default=False,
+            help='with offset correction, modify the WAV files in place '
+                 'instead of writing new files (original data IS modified)' )
+      parser.add_option('--io', dest='io_mode', type='choice',
+            choices=list(wav.IoPolicy.MODES), default='default',
+            metavar='MODE',
+            help="page cache policy when WAV files are copied; 'default', "
+                 "'nocache' or 'direct' [default: %default]" )
       parser.add_option( _OPT_MULTI_SESSION, '--multi', dest='multisession',
             action='store_true', default=False,
             help='for safety, this option must be set when creating a '
                  'mulit-session TOC file' )
       parser.add_option('-o', '--output', dest='toc_file',
             help='specify the output TOC file to write')
+      parser.add_option('--plan', dest='plan', type='float',
+            metavar='MINUTES',
+            help="with '%s', split the WAV files into discs of MINUTES "
+                 "length, and write one TOC file per disc" % _OPT_WAV_LIST )
+      parser.add_option('--profile', dest='profile', type='choice',
+            choices=stats.Profiler.MODES, metavar='MODE',
+            help="profile the run; 'cpu' writes a pstats file, 'mem' "
+                 "reports the memory allocations of each phase to STDERR" )
+      parser.add_option('--profile-file', dest='profile_file',
+            metavar='FILE',
+            help="write the '--profile' output to FILE [default: "
+                 "'mktoc.prof' for 'cpu']" )
+      parser.add_option('--progress', dest='progress',
+            type='choice', choices=sorted(progress_bar.RENDERERS),
+            metavar='MODE',
+            help="select the progress output written to STDERR while WAV "
+                 "files are processed; 'bar', 'json' or 'quiet' "
+                 "[default: 'bar' on a terminal, else 'quiet']" )
+      parser.add_option('--reorder', dest='reorder', action='store_true',
+            default=False,
+            help="with '--plan', allow tracks to move between discs to use "
+                 "fewer discs" )
+      parser.add_option('--rollback', dest='rollback', action='store_true',
+            default=False,
+            help="restore the WAV files of an interrupted '--in-place' "
+                 "offset correction" )
+      parser.add_option('--split', dest='split', metavar='DIR',
+            help='cut the audio into one WAV file per track in DIR, and '
+                 'write a TOC that refers to the new files' )
+      parser.add_option('--stats', dest='stats', action='store_true',
+            default=False,
+            help='print a report of the time spent in each phase and of '
+                 'the I/O counters to STDERR' )
+      parser.add_option('--stats-json', dest='stats_json',
+            action='store_true', default=False,
+            help='print the phase timers and I/O counters to STDERR as a '
+                 'JSON object' )
       parser.add_option( _OPT_TEMP_WAV, '--use-temp', dest='write_tmp',
             action='store_true', default=False,
-            help='write offset corrected WAV files to /tmp directory' )
+            help='write offset corrected or converted WAV files to /tmp '
+                 'directory' )
+      parser.add_option('--validate', dest='validate', action='store_true',
+            default=False,
+            help='check that the WAV files can be written to a CD, and '
+                 'write a JSON report instead of a TOC file; all '
+                 'arguments are CUE files, checked in parallel' )
       parser.add_option( _OPT_WAV_LIST, '--wave', dest='wav_files',
             action='callback', callback=self._parse_wav,
             help='write a TOC file using list of WAV files' )
@@ -215,10 +435,41 @@ class CommandLine(object):
       if opt.wav_offset and not opt.find_wav:
          parser.error("Can not combine '%s' and '%s' options!" % \
                         (_OPT_ALLOW_WAV_FNF,_OPT_OFFSET_CORRECT) )
+      if opt.rollback and not opt.in_place:
+         parser.error("Can not use '--rollback' without '--in-place' option!")
+      if opt.in_place and (opt.fifo or opt.write_tmp):
+         parser.error("Can not combine '--in-place' and '%s' or '--fifo' "
+                      "options!" % _OPT_TEMP_WAV )
+      if opt.in_place and not opt.wav_offset:
+         parser.error("Can not use '--in-place' without '%s' option!" % \
+                        _OPT_OFFSET_CORRECT )
+      if opt.crc and (not opt.wav_offset or opt.fifo or opt.in_place):
+         parser.error("'--crc' requires '%s', and can not be combined with "
+                      "'--fifo' or '--in-place'!" % _OPT_OFFSET_CORRECT )
+      if opt.fifo and not opt.wav_offset:
+         parser.error("Can not use '--fifo' without '%s' option!" % \
+                        _OPT_OFFSET_CORRECT )
+      if opt.detect_gaps and (opt.wav_files is None or not opt.find_wav):
+         parser.error("'--detect-gaps' requires '%s', and can not be "
+                      "combined with '%s'!" % (_OPT_WAV_LIST, _OPT_ALLOW_WAV_FNF))
+      if opt.buf_size is not None and opt.buf_size <= 0:
+         parser.error("'--buffer-size' must be greater than zero!")
+      if opt.image and (opt.fifo or opt.in_place or opt.crc or
+                        opt.write_tmp or not opt.find_wav):
+         parser.error("Can not combine '--image' and '--fifo', '--in-place', "
+                      "'--crc', '%s' or '%s' options!" %
+                      (_OPT_TEMP_WAV, _OPT_ALLOW_WAV_FNF) )
+      if opt.split and (opt.wav_offset or opt.image or not opt.find_wav):
+         parser.error("Can not combine '--split' and '%s', '--image' or "
+                      "'%s' options!" % (_OPT_OFFSET_CORRECT,
+                                         _OPT_ALLOW_WAV_FNF) )
+      if opt.convert and opt.in_place:
+         parser.error("Can not combine '--convert' and '--in-place' "
+                      "options!")
       # test "offset correction" and "temp WAV" argument combination
-      if opt.write_tmp and not opt.wav_offset:
-         parser.error("Can not use '%s' without '%s' option!" % \
-                        (_OPT_TEMP_WAV, _OPT_OFFSET_CORRECT) )
+      if opt.write_tmp and not (opt.wav_offset or opt.convert):
+         parser.error("Can not use '%s' without '%s' or '--convert' option!"
+                      % (_OPT_TEMP_WAV, _OPT_OFFSET_CORRECT) )
       # test "CUE File" and "-w" argument combination
       if opt.cue_file is not None and opt.wav_files is not None:
          parser.error("Can not combine '%s' and '%s' options!" % \
@@ -227,6 +478,31 @@ class CommandLine(object):
       if opt.multisession and opt.no_multisession:
          parser.error("Can not combine '%s' and '%s' options!" % \
                         (_OPT_MULTI_SESSION, _OPT_IGNORE_MULTI_SESSION) )
+      if opt.validate and (opt.wav_offset or opt.convert or opt.image or
+                           opt.split or opt.accuraterip or opt.rollback):
+         parser.error("Can not combine '--validate' and '%s', '--convert', "
+                      "'--image', '--split', '--accuraterip' or '--rollback' "
+                      "options!" % _OPT_OFFSET_CORRECT )
+      if opt.plan is not None and (opt.wav_files is None or
+            opt.plan <= 0 or opt.wav_offset or opt.convert or opt.image or
+            opt.split or opt.detect_gaps or opt.validate or
+            opt.accuraterip or not opt.find_wav):
+         parser.error("'--plan' requires '%s' and a length, and can not be "
+                      "combined with '%s', '%s', '--convert', '--image', "
+                      "'--split', '--detect-gaps', '--validate' or "
+                      "'--accuraterip' options!" % (_OPT_WAV_LIST,
+                      _OPT_ALLOW_WAV_FNF, _OPT_OFFSET_CORRECT) )
+      if opt.profile_file and not opt.profile:
+         parser.error("Can not use '--profile-file' without '--profile' "
+                      "option!")
+      if opt.profile == 'cpu' and not opt.profile_file:
+         opt.profile_file = 'mktoc.prof'
+      if opt.reorder and opt.plan is None:
+         parser.error("Can not use '--reorder' without '--plan' option!")
+      if opt.validate and opt.wav_files is None:
+         # every argument is a CUE file, '-o' names the report file
+         opt.cue_files = [opt.cue_file] * bool(opt.cue_file) + args
+         return opt,args
       # The '-w' option is used to create a TOC file using a list of WAV files.
       # The default mode is to convert a CUE file. The 'if' checks for the
       # default mode.
@@ -249,6 +525,9 @@ class CommandLine(object):
          else:
             # set file names if 'args' list is not empty
             if len(args)>=1: opt.toc_file = args[0]
+         if opt.plan and not opt.toc_file:
+            parser.error("'--plan' requires a TOC file name, the disc "
+                         "number is added to it!")
       return opt,args
 
    def _parse_full_help(self, option, opt_str, value, parser):
@@ -288,6 +567,19 @@ class CommandLine(object):
       ---> %s
       """ % (__email__,e))), file=sys.stderr)
 
+   def _error_msg_multisession(self, e):
+      """Print error when multi-session output was not selected."""
+      # multisesssion option must be set to prevent usage error
+      print(textwrap.dedent("""
+         WARNING! - Detected multi-session track info.
+
+         For safety, '%s' option must be specified when creating a TOC
+         for a multi-session disc.
+
+         If you want to ignore this check, and disable multi-session
+         features, use the '%s' argument.""" %
+            (_OPT_MULTI_SESSION,_OPT_IGNORE_MULTI_SESSION)), file=sys.stderr)
+
    def _error_msg_multi_files(self, e):
       """Print error when duplicate WAV files are found."""
       print(textwrap.dedent( ("""
@@ -324,10 +616,10 @@ def main():
    global progName
    progName = os.path.basename(sys.argv[0])
    try:
-      CommandLine().run()
+      status = CommandLine().run()
    except EmptyCueData: pass     # ignore NULL data input (Ctrl-C)
    except Exception:
       traceback.print_exc()
    except: pass      # ignore base exceptions (exit,key-int)
-   else: return 0    # no exception, exit success
+   else: return status or 0      # no exception, exit success
    return 1          # exit with failure
@@ -0,0 +1,217 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   mktoc.converter
+   ~~~~~~~~~~~~~~~
+
+   Library interface to convert CUE sheets to TOC data in-process, without
+   the command-line option parsing.
+
+   A :class:`Converter` is configured once, and can then convert any number
+   of CUE sheets, from several threads at the same time. Errors are raised as
+   :exc:`~mktoc.base.MkTocError` subclasses, and the process is never
+   exited::
+
+      conv = mktoc.Converter(multisession='ignore')
+      for cue in cue_files:
+         try:
+            res = conv.convert(cue)
+         except FileNotFoundError as e:
+            ...
+         write(res.toc)
+
+   The following are a list of the classes provided in this module:
+
+   * :class:`Converter`
+   * :class:`TocResult`
+"""
+
+import codecs
+import collections
+import io
+import os
+
+import chardet.universaldetector
+
+from mktoc.base import *
+from mktoc import parser
+from mktoc import stats
+from mktoc import wav
+
+__all__ = ['Converter', 'TocResult', 'open_file']
+
+
+##############################################################################
+class TocResult(collections.namedtuple( 'TocResult',
+      'toc data session_frames' )):
+   """
+   Result of :meth:`Converter.convert`.
+
+   .. attribute:: toc
+
+      TOC file text, without a comment header.
+
+   .. attribute:: data
+
+      :class:`~mktoc.parser.ParseData` of the CUE sheet.
+
+   .. attribute:: session_frames
+
+      For a multi-session disc, the size in CD frames of the data session
+      that finalizes the disc (``cdrecord --tsize=<N>s``), otherwise
+      :data:`None`.
+   """
+   __slots__ = ()
+
+   @property
+   def files(self):
+      """In-order list of the WAV files referenced by the TOC."""
+      return self.data.files
+
+
+class Converter(object):
+   """
+   Converts CUE sheets to TOC data.
+
+   The options are set once, when the object is created. The object keeps
+   its own cache of WAV directory scans, so a long running process that
+   converts many CUE sheets only scans each directory once (a directory is
+   scanned again when it changes). :meth:`convert` and :meth:`parse` are
+   thread-safe.
+   """
+   #: Multi-session policies, see :meth:`check_multisession`.
+   MULTISESSION = ('error', 'allow', 'ignore')
+
+   def __init__(self, find_wav=True, offset=0, use_temp=False,
+                multisession='error', scans=None):
+      """
+      :param find_wav:  :data:`True`/:data:`False`, :data:`True` causes
+                        exceptions to be raised if a WAV file can not be found
+                        in the FS.
+      :type  find_wav:  bool
+
+      :param offset:    Number of samples to shift the audio by. If not zero,
+                        :meth:`convert` writes offset corrected WAV files,
+                        and the TOC refers to the new files.
+      :type  offset:    int
+
+      :param use_temp:  :data:`True` writes the offset corrected WAV files to
+                        the temp directory.
+      :type  use_temp:  bool
+
+      :param multisession: ``'error'`` raises
+                           :exc:`~mktoc.base.MultiSessionError` for
+                           multi-session CUE data, ``'allow'`` writes a
+                           multi-session TOC, and ``'ignore'`` writes a
+                           single-session TOC of the audio tracks.
+      :type  multisession: str
+
+      :param scans:     Cache of directory scans, by default a new cache
+                        for this object.
+      :type  scans:     :class:`~mktoc.wav.WavScanCache`
+      """
+      if multisession not in self.MULTISESSION:
+         raise ValueError('unknown multi-session policy: %r' %
+                          (multisession,))
+      self.find_wav = find_wav
+      self.offset = offset
+      self.use_temp = use_temp
+      self.multisession = multisession
+      self.scans = scans if scans is not None else wav.WavScanCache()
+
+   def parse(self, source, dir_=None):
+      """
+      Parse a CUE sheet.
+
+      :param source: CUE file name, CUE text (any string with a line
+                     break), or an open text file object.
+      :type  source: str, :data:`file`
+
+      :param dir_:   Directory of the WAV files. The default is the directory
+                     of the CUE file, or the current directory for CUE text.
+      :type  dir_:   str
+
+      :returns: :class:`~mktoc.parser.ParseData` of the CUE sheet.
+      """
+      if isinstance(source, str) and '\n' not in source:
+         with open_file(source) as fh:
+            return self._parse( fh,
+                        dir_ or os.path.dirname(source) or os.curdir )
+      if isinstance(source, str):
+         source = io.StringIO(source)
+      return self._parse( source, dir_ or os.curdir )
+
+   def _parse(self, fh, dir_):
+      """Parse the CUE lines of *fh* with the WAV files in *dir_*."""
+      p = parser.CueParser( dir_, self.find_wav, scans=self.scans )
+      return p.parse( fh )
+
+   def convert(self, source, dir_=None):
+      """
+      Convert a CUE sheet to a TOC. See :meth:`parse` for the arguments.
+
+      :returns: :class:`TocResult` of the CUE sheet.
+      """
+      data = self.parse( source, dir_ )
+      self.check_multisession( data )
+      if self.offset:
+         data.modWavOffset( self.offset, self.use_temp )
+      toc = ''.join( '%s\n' % l for l in data.getToc() )
+      frames = None
+      if data.disc.is_multisession:
+         # the data session is the length of the last index minus 2 frames,
+         # verified with cdrecord
+         frames = data.last_index.len_.frames - 2
+      return TocResult( toc, data, frames )
+
+   def check_multisession(self, data):
+      """
+      Apply the multi-session policy to *data*. Multi-session output is
+      disabled with the ``'ignore'`` policy, and
+      :exc:`~mktoc.base.MultiSessionError` is raised with the ``'error'``
+      policy.
+
+      :param data:   Parsed CUE data.
+      :type  data:   :class:`~mktoc.parser.ParseData`
+      """
+      if not data.disc.is_multisession:
+         return
+      if self.multisession == 'ignore':
+         data.disc.is_multisession = False
+      elif self.multisession == 'error':
+         raise MultiSessionError('multi-session track info found')
+
+
+##############################################################################
+def open_file(name, mode='rb', encoding=None):
+   """
+   Open a text file. The character encoding is detected from the file data
+   if *encoding* is not set.
+
+   :param name:      File name.
+   :type  name:      str
+
+   :param mode:      File mode.
+   :type  mode:      str
+
+   :param encoding:  Character encoding of the file.
+   :type  encoding:  str
+
+   :raises: :exc:`~mktoc.base.FileOpenError` if the file can not be opened.
+   """
+   try:
+      if encoding is None:
+         # detect file character encoding
+         with open(name,mode) as fh, stats.timer('decode'):
+            d = chardet.universaldetector.UniversalDetector()
+            for line in fh.readlines():
+               d.feed(line)
+            d.close()
+            encoding = d.result['encoding']
+      return codecs.open(name, mode, encoding=encoding)
+   except (EnvironmentError, LookupError) as e:
+      raise FileOpenError(str(e))
@@ -19,11 +19,12 @@
 
 import os
 import re
-import wave
 import logging
 import itertools as itr
 
 from mktoc.base import *
+from mktoc import stats
+from mktoc import wav
 
 __all__ = [ 'Disc', 'Track', 'TrackIndex' ]
 
@@ -265,7 +266,8 @@ class TrackIndex(object):
       Empty string or :class:`_TrackTime` value that specifies the number of
       audio frames associated with the :class:`TrackIndex`. By default, this
       value will equal the total length of the WAV data, but might be truncated
-      if the track starts after, or ends before the WAV data.
+      if the track starts after, or ends before the WAV data. The WAV data is
+      only read when the value is first needed.
 
    .. attribute:: num
 
@@ -286,10 +288,21 @@ class TrackIndex(object):
    #: :const:`START`. Indicate the mode of :class:`TrackIndex` object.
    cmd = AUDIO
 
-   def __init__(self, num, time, file_, len_=None):
+   #: Process wide :class:`~mktoc.wav.WavLengthResolver` that reads the WAV
+   #: headers.
+   lengths = wav.WavLengthResolver()
+
+   # files that were reported as not CD-DA audio
+   _not_cdda = set()
+
+   # length value; None until resolved from the WAV file, False once deleted
+   _len = None
+
+   def __init__(self, num, time, file_, len_=None, resolve=True):
       """
       If possible the sample count of the :class:`TrackIndex` is calculated by
-      reading the WAV audio data.
+      reading the WAV audio data. The WAV file is not read until :attr:`len_`
+      is first accessed, see :meth:`resolve`.
 
       :param num:    Index number position in the :class:`Track`, starting
                      at 0.
@@ -304,19 +317,59 @@ class TrackIndex(object):
 
       :param len_:   Track length in format supported by :class:`_TrackTime`.
       :type  len_:   str, tuple, int (see :class:`_TrackTime`)
+
+      :param resolve:   :data:`False` never reads *file_*, the length is
+                        left empty unless *len_* is given.
+      :type  resolve:   bool
       """
       self.file_  = file_
       self.num    = int(num)
       self.time   = _TrackTime(time)
       if len_:
-         self.len_ = _TrackTime(len_)
-      else:
-         # set length to maximum possible for now (total - start)
-         file_len = self._file_len(self.file_)
-         if file_len: self.len_ = file_len - self.time
-         else:        self.len_ = ''
+         self._len = _TrackTime(len_)
+      elif not resolve:
+         self._len = ''
       log.debug( 'creating index %s' % repr(self) )
 
+   @property
+   def len_(self):
+      """Length of the index, read from the WAV file on first access."""
+      if self._len is None:
+         # set length to maximum possible for now (total - start)
+         self._set_file_len( self._file_len(self.file_) )
+      elif self._len is False:
+         raise AttributeError('len_')
+      return self._len
+
+   @len_.setter
+   def len_(self, value):
+      self._len = value
+
+   @len_.deleter
+   def len_(self):
+      self._len = False
+
+   def _set_file_len(self, file_len):
+      """Set the unresolved length from the length of the WAV file."""
+      if file_len: self._len = file_len - self.time
+      else:        self._len = ''
+
+   @classmethod
+   def resolve(cls, indexes):
+      """
+      Read the lengths of all unresolved *indexes* in bulk, probing each WAV
+      file only once.
+
+      :param indexes:   :class:`TrackIndex` objects to resolve.
+      :type  indexes:   iterable
+      """
+      todo = [idx for idx in indexes if idx._len is None]
+      if not todo:
+         return
+      lens = cls._file_lens( dict.fromkeys(idx.file_ for idx in todo) )
+      for idx in todo:
+         idx._set_file_len( lens[idx.file_] )
+
    def __repr__(self):
       """Return a string used for debug logging."""
       return ("'%s, %s'" % (self.file_, self.time))
@@ -331,20 +384,37 @@ class TrackIndex(object):
       if self.cmd == self.DATA:
          return ''     # do not output to TOC
       if self.cmd in [self.AUDIO, self.PREAUDIO]:
-         out += ['\tAUDIOFILE "%(file_)s" %(time)s %(len_)s' % self.__dict__]
+         out += ['\tAUDIOFILE "%s" %s %s' % (self.file_, self.time, self.len_)]
       elif self.cmd == self.INDEX:
-         out += ['\tINDEX %(time)s' % self.__dict__]
+         out += ['\tINDEX %s' % self.time]
       elif self.cmd == self.START:
-         out += ['\tSTART %(len_)s' % self.__dict__]
+         out += ['\tSTART %s' % self.len_]
       else: raise Exception
       # add start command for pregap audio
       if self.cmd == self.PREAUDIO:
          out += ['\tSTART']
       return '\n'.join(out)
 
+   def move(self, file_, frames):
+      """
+      Point the index at the same audio in another file, that starts
+      *frames* CD frames into *file_*.
+
+      :param file_:  New WAV file name.
+      :type  file_:  str
+
+      :param frames: Start of the old file in *file_*, in CD frames.
+      :type  frames: int
+      """
+      if self._len is None:
+         self.len_      # resolve against the old file before moving
+      self.file_ = file_
+      if self.cmd in [self.AUDIO, self.PREAUDIO]:
+         self.time = _TrackTime( self.time.frames + frames )
+
    def _file_len(self,file_):
       """Returns the number of audio samples in the WAV file, *file_*.
-      Called during __init__. If *file_* can not be opened, :data:`None`
+      Called when :attr:`len_` is resolved. If *file_* can not be opened, :data:`None`
       is returned.
 
       :param file_:  a file name string relative to the cwd referencing
@@ -353,13 +423,29 @@ class TrackIndex(object):
 
       :rtype:        :class:`_TrackTime` of audio samples or
                      :data:`None`"""
-
-      if not (file_ and os.path.exists(file_)):
-         return None
-      w = wave.open(file_)
-      frames = w.getnframes() / (w.getframerate()/75)
-      w.close()
-      return _TrackTime(frames)
+      return self._file_lens([file_])[file_]
+
+   @classmethod
+   @stats.timed('probe')
+   def _file_lens(cls, files):
+      """Return a :class:`dict` of the :meth:`_file_len` of each file in
+      *files*. The headers are read by :attr:`lengths`."""
+      hdrs = cls.lengths.headers( f for f in files if f )
+      lens = {}
+      for file_ in files:
+         hdr = hdrs.get(file_)
+         if hdr is None:
+            lens[file_] = None
+            continue
+         if not wav.CddaConverter.is_cdda(hdr) and file_ not in cls._not_cdda:
+            # the length is the duration of the audio; the file must be
+            # converted before it is written by cdrdao
+            cls._not_cdda.add(file_)
+            log.warning( "'%s' is not CD-DA audio (%d-bit, %d Hz, %d "
+                         "channels)", file_, hdr.sampwidth*8, hdr.framerate,
+                         hdr.nchannels )
+         lens[file_] = _TrackTime( hdr.nframes * 75 // hdr.framerate )
+      return lens
 
 
 class _TrackTime(object):
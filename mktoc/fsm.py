@@ -13,6 +13,8 @@
 
 import operator as op
 
+from mktoc import stats
+
 
 class NullStateException(Exception):
    """
@@ -57,6 +59,7 @@ class StateMachine(object):
       :param lines: Input data consumed by state machine
       :type  lines: list
       """
+      stats.incr('regex_lookups', len(lines))
       for l in lines:
          match = self.__regex_obj.match(l)
          if match:
@@ -22,18 +22,23 @@
 
 
 from itertools import *
+import bisect
+import concurrent.futures
+import difflib
+import heapq
 import logging
 import operator as op
 import os
 import re
+import struct
 
 from .base import *
 from . import disc
 from . import wav
 from . import fsm
-from . import progress_bar
+from . import stats
 
-__all__ = ['CueParser','WavParser']
+__all__ = ['CueParser','WavParser','eac_copy_crcs']
 
 log = logging.getLogger('mktoc.parser')
 
@@ -45,7 +50,7 @@ class ParseData(object):
    Automatically generated by invoking the :meth:`parse` method defined in one
    of the :class:`_Parser` classes.
    """
-   def __init__(self, disc, tracks, files):
+   def __init__(self, disc, tracks, files, dir_=None):
       """
       Initialize data structures.
 
@@ -58,6 +63,10 @@ class ParseData(object):
 
       :param files:  in-order list of WAV files associated with 'tracks'
       :type  files:  :func:`list` of file name str\s
+
+      :param dir_:   directory of the CUE file, searched for ExactAudioCopy
+                     log files.
+      :type  dir_:   str
       """
       if len(tracks) == 0:
          raise ParseError()
@@ -65,6 +74,14 @@ class ParseData(object):
       self._tracks = tracks # track object that stores track info.
       self._files  = files  # in-order list of WAV files that apply to the CD
                             # audio.
+      self._dir    = dir_   # directory of the CUE file, or None
+      self._fifo_writer = None   # WavOffsetWriter with pipes to serve
+      self._checksums = None     # (file, (input crc, output crc)) list
+
+   @property
+   def files(self):
+      """In-order list of the WAV files of the CD audio."""
+      return list(self._files)
 
    @property
    def last_index(self):
@@ -72,11 +89,14 @@ class ParseData(object):
       assert self.disc.is_multisession
       return self._tracks[-1].indexes[-1]
 
+   @stats.timed('render')
    def getToc(self):
       """
       Access method to return a text stream of the CUE data in TOC format.
       """
-      toc = []
+      toc = self._crc_comments()
+      disc.TrackIndex.resolve( idx for trk in self._tracks
+                                   for idx in trk.indexes )
       toc.extend( str(self.disc).split('\n') )
       for trk in self._tracks:
          toc.extend( str(trk).split('\n') )
@@ -84,7 +104,31 @@ class ParseData(object):
       toc = [line.expandtabs(4).rstrip() for line in toc]
       return toc
 
-   def modWavOffset(self,samples,tmp=False):
+   def _crc_comments(self):
+      """Return TOC comment lines with the checksums computed by
+      :meth:`modWavOffset`, compared to the ExactAudioCopy log."""
+      if not self._checksums:
+         return []
+      eac = eac_copy_crcs(self._dir) if self._dir else {}
+      fmt = lambda crc: '--------' if crc is None else '%08X' % crc
+      out = ['// CRC32 of the WAV data: copy (input), EAC log, offset '
+             'corrected output']
+      for f,(in_crc,out_crc) in self._checksums:
+         name = os.path.basename(f)
+         log_crc = eac.get(name.lower())
+         status = ''
+         if in_crc is not None and log_crc is not None:
+            status = ' OK' if in_crc == log_crc else ' MISMATCH'
+            if in_crc != log_crc:
+               log.warning( "copy CRC of '%s' does not match the EAC log",
+                            name )
+         out.append( '//   %s: copy %s, EAC %s%s, output %s' % (
+                        name, fmt(in_crc), fmt(log_crc), status,
+                        fmt(out_crc)) )
+      return out
+
+   def modWavOffset(self,samples,tmp=False,progress=None,buf_size=None,
+                    policy=None,fifo=False,in_place=False,checksum=False):
       """
       Optional method to correct the audio WAV data by shifting the samples by
       a positive or negative offset.
@@ -100,12 +144,255 @@ class ParseData(object):
       :param tmp:    :data:`True` or :data:`False`; when :data:`True` any
                      new WAV files will be created in :file:`/tmp`.
       :type tmp:     bool
+
+      :param progress:  Receives progress counters while the WAV files are
+                        written. By default no progress is displayed.
+      :type  progress:  :class:`~mktoc.progress_bar.Progress`
+
+      :param buf_size:  Size of the copy buffer in bytes, by default the size
+                        is selected for the output storage.
+      :type  buf_size:  int
+
+      :param policy:    Page cache policy of the WAV files, by default only
+                        read-ahead hints are given.
+      :type  policy:    :class:`~mktoc.wav.IoPolicy`
+
+      :param fifo:      Create named pipes in place of the new WAV files.
+                        The TOC refers to the pipes, and the audio is
+                        written on demand by :meth:`serveFifos`.
+      :type  fifo:      bool
+
+      :param in_place:  Modify the WAV files in place with
+                        :class:`~mktoc.wav.InPlaceOffsetWriter`, instead of
+                        writing new files. An interrupted run is resumed.
+      :type  in_place:  bool
+
+      :param checksum:  Compute the CRC32 of the input and output WAV data
+                        while it is copied. The values, and the copy CRCs
+                        of an ExactAudioCopy log, are written to the TOC as
+                        comments.
+      :type  checksum:  bool
       """
+      if in_place:
+         wo = wav.InPlaceOffsetWriter( samples, progress, buf_size )
+         wo( self._files )
+         return
       # create WavOffset object, initialize sample offset and progress output
-      wo = wav.WavOffsetWriter( samples, progress_bar.ProgressBar,
-                                   ('processing WAV files:',))
+      wo = wav.WavOffsetWriter( samples, progress, buf_size, policy, fifo,
+                                checksum=checksum )
       new_files = wo( self._files, tmp )
+      if checksum:
+         self._checksums = list(zip(self._files, wo.checksums))
+      if fifo:
+         self._fifo_writer = wo
+      self._replace_files( new_files )
+
+   def nonCddaFiles(self):
+      """
+      Return the WAV files that are not CD-DA audio (16-bit, 44.1 kHz,
+      stereo), and must be converted by :meth:`convertCdda` before they are
+      written to a CD. Missing files are not included.
+      """
+      return [ f for f in self._files if os.path.exists(f) and
+               not wav.CddaConverter.is_cdda(wav.read_header(f)) ]
+
+   def convertCdda(self, tmp=False, progress=None, buf_size=None,
+                   workers=None):
+      """
+      Convert the WAV files that are not CD-DA audio with
+      :class:`~mktoc.wav.CddaConverter`, and use the new files in the TOC.
+      This is called before :meth:`modWavOffset`.
+
+      :param tmp:       :data:`True` to create the new WAV files in
+                        :file:`/tmp`.
+      :type  tmp:       bool
+
+      :param progress:  Receives progress counters while the WAV files are
+                        written.
+      :type  progress:  :class:`~mktoc.progress_bar.Progress`
+
+      :param buf_size:  Size of the copy buffer in bytes.
+      :type  buf_size:  int
+
+      :param workers:   Number of files converted at the same time, by
+                        default the number of CPUs.
+      :type  workers:   int
+      """
+      conv = wav.CddaConverter( progress, buf_size, workers )
+      self._replace_files( conv(self._files, tmp) )
+
+   @property
+   def length(self):
+      """Length of the audio session in CD frames, including the 2 second
+      pregap of the first track. Missing files are not counted."""
+      disc.TrackIndex.resolve( idx for trk in self._tracks
+                                   for idx in trk.indexes )
+      frames = 150
+      for trk in self._tracks:
+         if trk.is_data:
+            continue
+         if trk.pregap:
+            frames += disc._TrackTime(trk.pregap).frames
+         for idx in trk.indexes:
+            if (idx.cmd in (disc.TrackIndex.AUDIO, disc.TrackIndex.PREAUDIO)
+                  and idx.len_):
+               frames += idx.len_.frames
+      return frames
+
+   #: Disc capacities checked by :meth:`validate`, as (minutes, CD frames).
+   CAPACITIES = ((74, 74*60*75), (80, 80*60*75), (90, 90*60*75))
+
+   @stats.timed('validate')
+   def validate(self, workers=None):
+      """
+      Check that the WAV files can be written to a CD as they are. All files
+      are probed at the same time. A file is an error if it is missing or
+      unreadable, if it is not CD-DA audio, if its data chunk is truncated,
+      or, unless it is the last file, if it is not a whole number of CD
+      frames. The disc is an error if it is longer than the largest
+      capacity in :data:`CAPACITIES`.
+
+      :param workers:   Number of files probed at the same time, by default
+                        the number of CPUs.
+      :type  workers:   int
+
+      :returns: :class:`dict` report that can be written as JSON, with the
+                keys ``ok``, ``errors``, ``warnings``, ``frames`` (length
+                of the disc in CD frames, including the 2 second pregap of
+                the first track), ``length``, ``capacity`` (minutes to
+                :data:`True` if the disc fits) and ``files`` (a report of
+                each WAV file, see :func:`_check_wav`).
+      """
+      last = len(self._files) - 1
+      with concurrent.futures.ThreadPoolExecutor(
+               workers or os.cpu_count() or 1) as pool:
+         files = list(pool.map( _check_wav, self._files,
+                                [i == last for i in range(last+1)] ))
+      errors, warnings = [], []
+      frames = self.length
+      capacity = dict( (str(m), frames <= n) for m,n in self.CAPACITIES )
+      fits = [m for m,n in self.CAPACITIES if frames <= n]
+      length = str(disc._TrackTime(frames))
+      if not fits:
+         errors.append( 'disc length %s is longer than %d minutes' %
+                        (length, self.CAPACITIES[-1][0]) )
+      elif fits[0] != self.CAPACITIES[0][0]:
+         warnings.append( 'disc length %s needs %d minute media' %
+                          (length, fits[0]) )
+      return {
+         'ok'        : not errors and all(f['ok'] for f in files),
+         'errors'    : errors,
+         'warnings'  : warnings,
+         'frames'    : frames,
+         'length'    : length,
+         'capacity'  : capacity,
+         'files'     : files,
+         }
+
+   def writeImage(self, path, samples=0, progress=None, buf_size=None):
+      """
+      Join the WAV files into one WAV image with
+      :class:`~mktoc.wav.ImageWriter`, and point every index at its
+      position in the image.
+
+      :param path:      Name of the WAV image.
+      :type  path:      str
+
+      :param samples:   Number of samples to shift the audio data by, see
+                        :meth:`modWavOffset`.
+      :type  samples:   int
 
+      :param progress:  Receives progress counters while the image is
+                        written.
+      :type  progress:  :class:`~mktoc.progress_bar.Progress`
+
+      :param buf_size:  Size of the copy buffer in bytes.
+      :type  buf_size:  int
+      """
+      # the TOC positions are in CD frames, so every file except the last
+      # must hold whole CD frames
+      for f in self._files[:-1]:
+         if wav.read_header(f).nframes % 588:
+            raise MkTocError( "'%s' is not a whole number of CD frames, it "
+                              "can not be joined to an image" % f )
+      writer = wav.ImageWriter( samples, progress, buf_size )
+      starts = dict( zip(self._files, writer(self._files, path)) )
+      for idx in chain(*map(op.attrgetter('indexes'), self._tracks)):
+         if idx.file_: # data tracks do not have valid files
+            idx.move( path, starts[idx.file_] // 588 )
+      self._files = [path]
+
+   def splitTracks(self, dir_, progress=None, buf_size=None, workers=None):
+      """
+      Cut the audio into one WAV file per track, named
+      :file:`track{NN}.wav`, with :class:`~mktoc.wav.TrackSplitter`, and
+      point the indexes at the new files.
+
+      Each file starts at INDEX 01 of its track and holds the pregap of the
+      next track, as ExactAudioCopy writes track files. The first file also
+      holds any audio before track 1.
+
+      :param dir_:      Directory of the new WAV files, created if needed.
+      :type  dir_:      str
+
+      :param progress:  Receives progress counters while the WAV files are
+                        written.
+      :type  progress:  :class:`~mktoc.progress_bar.Progress`
+
+      :param buf_size:  Size of the copy buffer in bytes.
+      :type  buf_size:  int
+
+      :param workers:   Number of files written at the same time, by
+                        default the number of CPUs.
+      :type  workers:   int
+      """
+      for f in self._files[:-1]:
+         if wav.read_header(f).nframes % 588:
+            raise MkTocError( "'%s' is not a whole number of CD frames, it "
+                              "can not be split into tracks" % f )
+      tracks = [t for t in self._tracks if not t.is_data]
+      file_pos,total = {},0
+      for f in self._files:
+         file_pos[f] = total
+         total += wav.read_header(f).nframes
+      bounds = [0] + self._track_starts(tracks)[1:] + [total]
+      if not os.path.exists(dir_):
+         os.makedirs(dir_)
+      paths = [ os.path.join(dir_, 'track%02d.wav' % t.num) for t in tracks ]
+      wav.TrackSplitter( progress, buf_size, workers )(
+            self._files, list(zip(bounds[:-1], bounds[1:])), paths )
+      START,INDEX = disc.TrackIndex.START, disc.TrackIndex.INDEX
+      PREAUDIO = disc.TrackIndex.PREAUDIO
+      for trk in tracks:
+         indexes, pregap = [], 0
+         for idx in trk.indexes:
+            if idx.cmd == START:
+               pregap += idx.len_.frames
+            elif idx.cmd != INDEX:
+               if idx.cmd == PREAUDIO:
+                  pregap += idx.len_.frames
+               # cut the audio of the index at the new file boundaries
+               pos = file_pos[idx.file_] // 588 + idx.time.frames
+               end = pos + idx.len_.frames
+               for k in range(len(paths)):
+                  lo = max(pos, bounds[k] // 588)
+                  hi = min(end, bounds[k+1] // 588)
+                  if lo < hi:
+                     indexes.append( disc.TrackIndex( 1, lo - bounds[k]//588,
+                                                      paths[k], hi - lo ))
+         if pregap:
+            start = disc.TrackIndex( 1, 0, indexes[-1].file_, pregap )
+            start.cmd = START
+            del start.time # the length from the track start is used
+            indexes.append( start )
+         # INDEX entries do not refer to the audio files, they are kept
+         indexes.extend( idx for idx in trk.indexes if idx.cmd == INDEX )
+         trk.indexes = indexes
+      self._files = paths
+
+   def _replace_files(self, new_files):
+      """Change the WAV files of the disc to 'new_files', in the same
+      order."""
       # change all index file names to newly generated files
       file_map = dict( list(zip(self._files,new_files)) )
       indexes = map(op.attrgetter('indexes'), self._tracks);
@@ -113,6 +400,77 @@ class ParseData(object):
          if idx.file_: # data tracks do not have valid files
             log.debug( "updating index file '%s'", idx.file_ )
             idx.file_ = file_map[idx.file_]
+      self._files = list(new_files)
+
+   def verifyAccurateRip(self, path, offset=0, window=wav.AccurateRip.SKIP):
+      """
+      Compare the AccurateRip checksums of the audio tracks with a local
+      AccurateRip response file (:file:`dBAR-*.bin`).
+
+      The original WAV files are read, so this is called before
+      :meth:`modWavOffset`. The offsets in the result are offset correction
+      values, in samples, as used by :meth:`modWavOffset`.
+
+      :param path:      AccurateRip response file.
+      :type  path:      str
+
+      :param offset:    Offset correction of the reported checksums, and of
+                        the v2 checksum search.
+      :type  offset:    int
+
+      :param window:    Offset correction values from *-window* to *window*
+                        samples are searched.
+      :type  window:    int
+
+      :returns: :class:`list` with a :class:`dict` for each audio track, with
+                the keys ``track`` (track number), ``v1``, ``v2``
+                (checksums with *offset* correction) and ``matches`` (a list of
+                ``(offset, version, confidence)`` tuples).
+      """
+      entries = wav.read_accuraterip(path)
+      tracks = [t for t in self._tracks if not t.is_data]
+      with wav.AccurateRip( self._files, self._track_starts(tracks) ) as ar:
+         out = ar.verify( entries, window, -offset )
+      for trk,res in zip(tracks, out):
+         res['track'] = trk.num
+         # a read at sample offset 'd' is the audio corrected by '-d'
+         res['matches'] = [(-d,ver,conf) for d,ver,conf in res['matches']]
+      return out
+
+   def _track_starts(self, tracks):
+      """Return the sample position of INDEX 01 of each track in 'tracks',
+      from the start of the WAV data."""
+      pos,file_pos = 0,{}
+      for f in self._files:
+         file_pos[f] = pos
+         pos += wav.read_header(f).nframes
+      START,PREAUDIO = disc.TrackIndex.START, disc.TrackIndex.PREAUDIO
+      starts = []
+      for trk in tracks:
+         first = trk.indexes[0]
+         # the track starts after the pregap, which is set by a START index
+         # or by pregap audio in the previous file
+         frames = first.time.frames
+         if first.cmd == PREAUDIO:
+            frames += first.len_.frames
+         for idx in trk.indexes:
+            if idx.cmd == START:
+               frames += idx.len_.frames
+         starts.append( file_pos[first.file_] + frames * 588 )
+      return starts
+
+   def serveFifos(self):
+      """
+      Write the offset corrected audio to the named pipes created by
+      :meth:`modWavOffset`, as the reader (i.e. cdrdao) requests it. Returns
+      when all of the pipes were read, and removes them.
+      """
+      if self._fifo_writer is None:
+         raise MkTocError('no WAV FIFOs were created')
+      try:
+         self._fifo_writer.serve()
+      finally:
+         self._fifo_writer = None
 
 
 class _FileLookup(object):
@@ -121,7 +479,8 @@ class _FileLookup(object):
    :param:`file_` value.
 
    If the WAV file can not be found and :param:`_find_wav` is :data:`True`,
-   then an exception is raised.
+   then an exception is raised. :meth:`resolve` finds the files of a whole
+   CUE sheet at once.
    """
    # Dictionary to map input WAV files to actual files on the system. The map
    # is for use in cases where the defined file name does not exactly match the
@@ -136,7 +495,11 @@ class _FileLookup(object):
    # system.
    _wav_file_cache   = None
 
-   def __init__(self, dir_, find_wav):
+   #: Weight of the WAV duration difference against the name similarity in
+   #: the cost of a file assignment, see :meth:`resolve`.
+   DURATION_WEIGHT   = 0.5
+
+   def __init__(self, dir_, find_wav, scans=None):
       """
       :param dir_:      Path location of the working directory
       :type  dir_:      string
@@ -146,6 +509,10 @@ class _FileLookup(object):
                         in the FS.
       :type  find_wav:  bool
 
+      :param scans:     Cache of directory scans, see
+                        :class:`~mktoc.wav.WavFileCache`.
+      :type  scans:     :class:`~mktoc.wav.WavScanCache`
+
       .. Document private members
       .. automethod:: __call__
       """
@@ -154,7 +521,7 @@ class _FileLookup(object):
       self._find_wav       = find_wav
       self._file_map       = {}
       assert(dir_)
-      self._wav_file_cache = wav.WavFileCache(dir_)
+      self._wav_file_cache = wav.WavFileCache(dir_, scans)
 
    def __call__(self,file_):
       """
@@ -162,8 +529,10 @@ class _FileLookup(object):
       :type  file:   string
       """
       if file_ in self._file_map:
+         stats.incr('lookup_cache_hits')
          return self._file_map[file_]
       else:
+         stats.incr('lookup_cache_misses')
          try:  # attempt to find the WAV file
             file_on_disk = self._wav_file_cache(file_)
          except FileNotFoundError:
@@ -173,6 +542,62 @@ class _FileLookup(object):
          self._file_map[file_] = file_on_disk
          return file_on_disk
 
+   @stats.timed('assign')
+   def resolve(self, names, tracks=None):
+      """
+      Find the WAV files of all *names* together, so that each name gets a
+      different file. Names that match more than one file are assigned by
+      solving a minimum cost one-to-one assignment. The cost of a file is
+      the dissimilarity of its name, plus the difference of its duration
+      and the track lengths in the ExactAudioCopy log. Names that can not
+      be assigned are left to :meth:`__call__`.
+
+      :param names:  File names parsed from the CUE text.
+      :type  names:  list
+
+      :param tracks: Maps a file name to the numbers of its tracks, used to
+                     compare durations with the log.
+      :type  tracks: dict
+      """
+      names = [n for n in dict.fromkeys(names) if n not in self._file_map]
+      cands = {}
+      for n in names:
+         matches = self._wav_file_cache.candidates(n)
+         if matches:
+            cands[n] = matches
+      if not any(len(c) > 1 for c in cands.values()):
+         return      # nothing to choose
+      lengths = {}
+      if tracks:
+         eac = _eac_track_lengths(self._dir)
+         for n in cands:
+            trks = tracks.get(n)
+            if len(cands[n]) > 1 and trks and all(t in eac for t in trks):
+               lengths[n] = sum(eac[t] for t in trks)
+      names = list(cands)
+      rows = [self._costs(n, cands[n], lengths.get(n)) for n in names]
+      for n,f in zip(names, _assign(rows)):
+         if f is not None:
+            self._file_map[n] = f
+      stats.incr('lookup_assigned', len(names))
+
+   def _costs(self, name, files, length=None):
+      """Return :class:`dict` of file to the cost of assigning it to the CUE
+      file *name*."""
+      stem = lambda f: re.split(r'[\\/]', os.path.splitext(f)[0])[-1] \
+                           .replace('_',' ').strip().lower()
+      sm = difflib.SequenceMatcher(None, b=stem(name))
+      costs = {}
+      for f in files:
+         sm.set_seq1( stem(f) )
+         cost = 1 - sm.ratio()
+         if length:
+            hdr = wav.read_header(f)
+            frames = hdr.nframes * 75 // hdr.framerate
+            cost += self.DURATION_WEIGHT * min(1, abs(frames-length) / length)
+         costs[f] = cost
+      return costs
+
 
 class _CueStateMachine(fsm.StateMachine):
    """
@@ -225,7 +650,7 @@ class _CueStateMachine(fsm.StateMachine):
          \s*(.*))             # remaining text
       """, re.VERBOSE)
 
-   def __init__(self, file_lookup, dir_):
+   def __init__(self, file_lookup, dir_, resolve_audio=True):
       """
       :param file_lookup:  Callable instance for quickly correlating files in the
                            local file system from file names in CUE commands.
@@ -234,6 +659,11 @@ class _CueStateMachine(fsm.StateMachine):
       :param dir_:   Path location of the working directory.
       :type  dir_:   str
 
+      :param resolve_audio:   :data:`False` does not read WAV files or log
+                              files, index and data track lengths are left
+                              empty.
+      :type  resolve_audio:   bool
+
       .. Document private members
       .. automethod:: __call__
       """
@@ -272,6 +702,7 @@ class _CueStateMachine(fsm.StateMachine):
       self.file_  = None
       self.file_lookup = file_lookup
       self.dir_   = dir_
+      self.resolve_audio = resolve_audio
       # initialize beginning state
       self.change_state( self.CUE_CMDS, self.disc_handlers )
 
@@ -284,7 +715,7 @@ class _CueStateMachine(fsm.StateMachine):
          super(_CueStateMachine,self).__call__(*a,**kw)
       except (fsm.NullStateException,) as e:
          raise ParseError( 'Unknown/invalid command: ' + str(e) )
-      return ParseData(self.disc, self.tracks, self.files)
+      return ParseData(self.disc, self.tracks, self.files, self.dir_)
 
    def cmd_noop( self, match_name, cmd, *args ):
       """Ignored commands"""
@@ -328,7 +759,11 @@ class _CueStateMachine(fsm.StateMachine):
       previous data structures.
       """
       if not self.track.is_data:
-         idx = disc.TrackIndex( idx_num, time, self.file_)
+         idx = disc.TrackIndex( idx_num, time, self.file_,
+                                resolve=self.resolve_audio )
+      elif not self.resolve_audio:
+         idx = disc.TrackIndex( idx_num, time, None, resolve=False )
+         idx.cmd = disc.TrackIndex.DATA
       else:
          # if data track, the length is not defined in the CUE and must be
          # sourced from another method to create a 100% accurate TOC
@@ -405,6 +840,7 @@ class _CueStateMachine(fsm.StateMachine):
          if f == '4CH': f = 'four_ch'     # change '4CH' flag name
          self.track.set_field(f,True)
 
+   @stats.timed('log_scan')
    def data_trk_size(self, trk_idx):
       """
       Use an ExactAudioCopy log file to determine the length of the track at
@@ -413,24 +849,9 @@ class _CueStateMachine(fsm.StateMachine):
       :param trk_idx: Track index of data
       :type  trk_idx: int
       """
-      import codecs
-      import chardet.universaldetector
       size = None
-      files = os.listdir(self.dir_)
-      logs = [f for f in files if os.path.splitext(f)[1] == '.log']
-      logs.sort()
-      for f in logs:
-         # detect file character encoding
-         with open(os.path.join(self.dir_,f),'rb') as fh:
-            d = chardet.universaldetector.UniversalDetector()
-            for line in fh.readlines():
-               d.feed(line)
-            d.close()
-            encoding = d.result['encoding']
-         with codecs.open( os.path.join(self.dir_,f),
-                           'rb', encoding=encoding) as fh:
-            lines = fh.readlines()
-         regex = re.compile(r'^\s+%d\s+\|.+\|\s+(.+)\s+\|.+\|.+$' % (trk_idx,))
+      regex = re.compile(r'^\s+%d\s+\|.+\|\s+(.+)\s+\|.+\|.+$' % (trk_idx,))
+      for lines in _read_logs(self.dir_):
          matches = [_f for _f in map(regex.match,lines) if _f]
          if matches:
             # convert first match from '1:11.11' to '1:11:11'
@@ -440,6 +861,258 @@ class _CueStateMachine(fsm.StateMachine):
       return size
 
 
+def _read_logs(dir_):
+   """
+   Yield the lines of each ExactAudioCopy log file in *dir_*, in file name
+   order.
+   """
+   import codecs
+   import chardet.universaldetector
+   files = os.listdir(dir_)
+   logs = [f for f in files if os.path.splitext(f)[1] == '.log']
+   logs.sort()
+   for f in logs:
+      stats.incr('logs_scanned')
+      # detect file character encoding
+      with open(os.path.join(dir_,f),'rb') as fh:
+         d = chardet.universaldetector.UniversalDetector()
+         for line in fh.readlines():
+            d.feed(line)
+         d.close()
+         encoding = d.result['encoding']
+      with codecs.open( os.path.join(dir_,f),
+                        'rb', encoding=encoding) as fh:
+         yield fh.readlines()
+
+
+@stats.timed('log_scan')
+def eac_copy_crcs(dir_):
+   """
+   Return the ExactAudioCopy copy CRC of each track found in the log files
+   in *dir_*.
+
+   :returns: :class:`dict` of lower case WAV file base name to CRC32 value.
+   """
+   crcs = {}
+   name_re = re.compile(r'^\s+Filename\s+(.+?)\s*$')
+   crc_re = re.compile(r'^\s+Copy CRC\s+([0-9A-Fa-f]{8})\s*$')
+   for lines in _read_logs(dir_):
+      name = None
+      for line in lines:
+         m = name_re.match(line)
+         if m:
+            name = re.split(r'[\\/]', m.group(1))[-1].lower()
+            continue
+         m = crc_re.match(line)
+         if m and name:
+            crcs.setdefault( name, int(m.group(1), 16) )
+            name = None
+   return crcs
+
+
+def _check_wav(file_, last=False):
+   """
+   Check that the WAV file *file_* can be written to a CD as it is.
+
+   :param last:   :data:`True` if *file_* is the last file of the disc, which
+                  does not need to hold whole CD frames.
+   :type  last:   bool
+
+   :returns: :class:`dict` with the keys ``file``, ``ok``, ``errors``,
+             ``warnings``, ``format`` (channels, bits and rate, or
+             :data:`None`), ``samples`` and ``file_size``.
+   """
+   stats.incr('files_probed')
+   errors, warnings = [], []
+   out = { 'file':file_, 'errors':errors, 'warnings':warnings, 'format':None,
+           'samples':None, 'file_size':None }
+   try:
+      out['file_size'] = size = os.path.getsize(file_)
+      with open(file_,'rb') as fh:
+         riff = struct.unpack('<4sI', fh.read(8))[1] if size >= 8 else 0
+         fh.seek(0)
+         hdr = wav.read_header(fh)
+   except (OSError, MkTocError) as e:
+      errors.append( str(e) )
+      out['ok'] = False
+      return out
+   out['format'] = { 'channels':hdr.nchannels, 'bits':hdr.sampwidth*8,
+                     'rate':hdr.framerate }
+   out['samples'] = hdr.nframes
+   if not wav.CddaConverter.is_cdda(hdr):
+      errors.append( 'not CD-DA audio (%d-bit, %d Hz, %d channels)' %
+                     (hdr.sampwidth*8, hdr.framerate, hdr.nchannels) )
+   end = hdr.data_offset + hdr.data_size
+   if end > size:
+      errors.append( 'data chunk is truncated, %d of %d bytes' %
+                     (size - hdr.data_offset, hdr.data_size) )
+   elif size > end + (hdr.data_size & 1):
+      warnings.append( '%d bytes after the data chunk' % (size - end) )
+   if riff + 8 != size:
+      warnings.append( 'RIFF size %d does not match the file size' %
+                       (riff + 8) )
+   if hdr.data_size % hdr.frame_size:
+      errors.append( 'data chunk is not a whole number of audio frames' )
+   if wav.CddaConverter.is_cdda(hdr) and hdr.nframes % 588:
+      msg = 'not a whole number of CD frames, %d samples are left over' % \
+               (hdr.nframes % 588)
+      if last: warnings.append(msg)
+      else:    errors.append(msg)
+   out['ok'] = not errors
+   return out
+
+
+@stats.timed('log_scan')
+def _eac_track_lengths(dir_):
+   """
+   Return the track lengths of the TOC in the ExactAudioCopy log files in
+   *dir_*.
+
+   :returns: :class:`dict` of track number to length in CD frames.
+   """
+   lengths = {}
+   regex = re.compile(r'^\s+(\d+)\s+\|\s*[\d:.]+\s*\|'  # track, start
+                      r'\s*(\d+):(\d+)\.(\d+)\s*\|')          # length
+   for lines in _read_logs(dir_):
+      for line in lines:
+         m = regex.match(line)
+         if m:
+            mn,sc,fr = [int(x) for x in m.groups()[1:]]
+            lengths.setdefault( int(m.group(1)), (mn*60 + sc)*75 + fr )
+   return lengths
+
+
+def _sheet_files(cue):
+   """
+   Return the WAV file names of the CUE lines *cue*, and a :class:`dict` of
+   each file name to the numbers of the audio tracks that start in it.
+   """
+   file_re = re.compile(r'^FILE\s+"(.*)"\s+WAVE$')
+   track_re = re.compile(r'^TRACK\s+(\d+)\s+AUDIO$')
+   names, tracks, name = [], {}, None
+   for line in cue:
+      m = file_re.match(line)
+      if m:
+         name = m.group(1)
+         names.append(name)
+         tracks.setdefault(name, [])
+         continue
+      m = track_re.match(line)
+      if m and name is not None:
+         tracks[name].append( int(m.group(1)) )
+   return names, tracks
+
+
+def _bin_pack(sizes, capacity, reorder=False):
+   """
+   Pack items into the fewest bins of *capacity*.
+
+   In order, this is 'next fit': a bin is closed when the next item does not
+   fit, which is optimal when the order is kept. Reordered, this is 'best fit
+   decreasing': the largest items are placed first, each into the bin with
+   the least space left that can hold it. Both run in O(n log n).
+
+   :param sizes:     Size of each item.
+   :type  sizes:     list
+
+   :param capacity:  Size of a bin.
+   :type  capacity:  int
+
+   :param reorder:   :data:`True` to allow items in any bin.
+   :type  reorder:   bool
+
+   :returns: :class:`list` of bins, each a sorted :class:`list` of item
+             positions in *sizes*.
+   """
+   for i,size in enumerate(sizes):
+      if size > capacity:
+         raise MkTocError('item %d is larger than the capacity' % (i+1))
+   bins = []
+   if not reorder:
+      free = 0
+      for i,size in enumerate(sizes):
+         if not bins or size > free:
+            bins.append([])
+            free = capacity
+         bins[-1].append(i)
+         free -= size
+      return bins
+   space = []     # sorted (free space, bin number)
+   for i in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+      k = bisect.bisect_left(space, (sizes[i], -1))
+      if k < len(space):
+         free,b = space.pop(k)
+      else:
+         free,b = capacity, len(bins)
+         bins.append([])
+      bins[b].append(i)
+      bisect.insort(space, (free - sizes[i], b))
+   return [sorted(b) for b in bins]
+
+
+def _assign(rows):
+   """
+   Solve the assignment problem of *rows* to columns with the Hungarian
+   method, as successive shortest augmenting paths (Dijkstra with row and
+   column potentials). The cost matrix is sparse: a row can only be
+   assigned to the columns in its :class:`dict`. The number of assigned
+   rows is maximal, and their total cost minimal.
+
+   :param rows:   :class:`dict` of column to non-negative cost, per row.
+   :type  rows:   list
+
+   :returns: :class:`list` of the column assigned to each row, or
+             :data:`None`.
+   """
+   # a private dummy column per row, costlier than any assignment of real
+   # columns, stands for 'unassigned' and makes every row assignable
+   skip = 1.0 + sum(max(r.values(), default=0.0) for r in rows)
+   dummy = [object() for r in rows]
+   rows = [dict(r) for r in rows]
+   for r,c in zip(rows, dummy):
+      r[c] = skip
+   u = [0.0] * len(rows)      # row potentials
+   v = {}                     # column potentials
+   col_of = [None] * len(rows)
+   row_of = {}
+   for r0 in range(len(rows)):
+      dist, prev, done, row_dist = {}, {}, [], {r0:0.0}
+      heap, seq = [], count()
+      r, free = r0, None
+      while True:
+         # relax the edges of row 'r'
+         for c,w in rows[r].items():
+            d = row_dist[r] + w - u[r] - v.get(c,0.0)
+            if c not in dist or d < dist[c]:
+               dist[c], prev[c] = d, r
+               heapq.heappush(heap, (d, next(seq), c))
+         # next closest column
+         while heap[0][0] > dist[heap[0][2]]:
+            heapq.heappop(heap)
+         d,i,c = heapq.heappop(heap)
+         dist[c] = -1.0          # mark as done, it is never relaxed again
+         done.append( (c,d) )
+         if c not in row_of:
+            free = c
+            break
+         r = row_of[c]
+         row_dist[r] = d
+      # update the potentials, keeping the reduced costs non-negative
+      top = done[-1][1]
+      for c,d in done:
+         v[c] = v.get(c,0.0) - (top - d)
+      for r,d in row_dist.items():
+         u[r] += top - d
+      # flip the matching along the path
+      c = free
+      while c is not None:
+         r = prev[c]
+         c, col_of[r] = col_of[r], c
+         row_of[col_of[r]] = r
+   dummy = set(dummy)
+   return [None if c in dummy else c for c in col_of]
+
+
 class CueParser(object):
    """
    An audio CUE sheet text file parsing class.
@@ -450,7 +1123,8 @@ class CueParser(object):
    TrackIndex objects. With the data, the CUE file can be re-created or
    converted into a new format.
    """
-   def __init__(self, dir_=os.curdir, find_wav=True):
+   def __init__(self, dir_=os.curdir, find_wav=True, resolve_audio=True,
+                scans=None):
       """
       :param dir_:  Path location of the CUE file's directory.
       :type  dir_:  str
@@ -459,10 +1133,24 @@ class CueParser(object):
                         exceptions to be raised if a WAV file can not be found
                         in the FS.
       :type  find_wav:  bool
+
+      :param resolve_audio:   :data:`False` parses the CUE metadata only. The
+                              file system is never touched: file names are
+                              used as written and lengths are left empty.
+      :type  resolve_audio:   bool
+
+      :param scans:  Cache of directory scans, default is the shared
+                     :attr:`~mktoc.wav.WavFileCache.scans` cache.
+      :type  scans:  :class:`~mktoc.wav.WavScanCache`
       """
       self.dir_ = dir_
-      self.file_lookup = _FileLookup(dir_,find_wav)
+      self.resolve_audio = resolve_audio
+      if resolve_audio:
+         self.file_lookup = _FileLookup(dir_,find_wav,scans)
+      else:
+         self.file_lookup = lambda file_: file_
 
+   @stats.timed('parse')
    def parse(self, fh):
       """
       Parses CUE file text data.
@@ -476,8 +1164,11 @@ class CueParser(object):
       cue = [line.strip() for line in fh]
       if not len(cue):
          raise EmptyCueData
+      if self.resolve_audio:
+         # assign the WAV files of the whole sheet at once
+         self.file_lookup.resolve( *_sheet_files(cue) )
       # begin state machine in 'Init' state
-      csm = _CueStateMachine(self.file_lookup, self.dir_)
+      csm = _CueStateMachine(self.file_lookup, self.dir_, self.resolve_audio)
       return csm( cue )
 
 
@@ -488,7 +1179,7 @@ class WavParser(object):
    The class assumes that each WAV file is an individual track, in ascending
    order.
    """
-   def __init__(self, dir_=os.curdir, find_wav=True):
+   def __init__(self, dir_=os.curdir, find_wav=True, detect_gaps=False):
       """
       :param dir_:  Path location of the CUE file's directory.
       :type  dir_:  str
@@ -497,10 +1188,19 @@ class WavParser(object):
                         exceptions to be raised if a WAV file can not be found
                         in the FS.
       :type find_wav: bool
+
+      :param detect_gaps:  :data:`True` to set the pregap of each track from
+                           the digital silence at the end of the previous WAV
+                           file and at the start of the track WAV file (see
+                           :func:`~mktoc.wav.find_silence`).
+      :type  detect_gaps:  bool
       """
       # init class options
+      self.dir_ = dir_
       self.file_lookup = _FileLookup(dir_,find_wav)
+      self._detect_gaps = detect_gaps
 
+   @stats.timed('parse')
    def parse( self, wav_files):
       """
       Parses a list of WAV files.
@@ -510,7 +1210,7 @@ class WavParser(object):
 
       :returns: :class:`ParseData` instance that mirrors the WAV data.
       """
-      files = list(map(self.file_lookup, wav_files))
+      files = self._lookup(wav_files)
       # return a new Track object with a single Index using 'file_'
       def mk_track(tuple):
          (idx,file_) = tuple
@@ -519,7 +1219,104 @@ class WavParser(object):
          # add the WAV file to the first index in the track
          trk.indexes.append( disc.TrackIndex(1,0,file_) )
          return trk
+      tracks = list(map( mk_track, enumerate(files)))
+      if self._detect_gaps:
+         self._add_gaps( tracks, files)
       # return a new ParseData object with empy Disc and complete Track list
-      return ParseData( disc.Disc(),
-                        list(map( mk_track, enumerate(files))), files )
+      return ParseData( disc.Disc(), tracks, files, self.dir_ )
+
+   @stats.timed('plan')
+   def plan(self, wav_files, capacity=80*60*75, gap=150, reorder=False,
+            workers=None):
+      """
+      Split a list of WAV files into the fewest discs. The WAV files are
+      probed at the same time. Every track after the first on a disc gets a
+      *gap* pregap, and the first track the 2 second (150 frame) pregap at
+      the start of every disc.
+
+      :param wav_files: WAV files to add to the TOCs.
+      :type  wav_files: list
+
+      :param capacity:  Length of the media in CD frames, default is 80
+                        minutes.
+      :type  capacity:  int
+
+      :param gap:       Pregap between the tracks in CD frames.
+      :type  gap:       int
 
+      :param reorder:   :data:`False` keeps the tracks in order and starts a
+                        new disc when the next track does not fit.
+                        :data:`True` packs the longest tracks first into the
+                        disc with the least space left, and keeps the list
+                        order on each disc.
+      :type  reorder:   bool
+
+      :param workers:   Number of files probed at the same time, by default
+                        the number of CPUs.
+      :type  workers:   int
+
+      :returns: :class:`list` of :class:`ParseData`, one per disc.
+      """
+      files = self._lookup(wav_files)
+      indexes = [disc.TrackIndex(1,0,f) for f in files]
+      with concurrent.futures.ThreadPoolExecutor(
+               workers or os.cpu_count() or 1) as pool:
+         lens = list(pool.map(op.attrgetter('len_'), indexes))
+      # n tracks use n-1 gaps, so count one gap per track and one more as
+      # free space
+      size = capacity - 150 + gap
+      for f,len_ in zip(files, lens):
+         if not len_:
+            raise MkTocError("length of '%s' is unknown" % f)
+         if len_.frames + gap > size:
+            raise MkTocError("'%s' does not fit on one disc" % f)
+      bins = _bin_pack( [l.frames + gap for l in lens], size, reorder )
+      discs = []
+      for b in bins:
+         tracks = []
+         for n,i in enumerate(b):
+            trk = disc.Track(n+1)
+            if n and gap:
+               trk.pregap = str(disc._TrackTime(gap))
+            trk.indexes.append( indexes[i] )
+            tracks.append( trk )
+         discs.append( ParseData( disc.Disc(), tracks,
+                                  [files[i] for i in b], self.dir_ ) )
+      return discs
+
+   def _lookup(self, wav_files):
+      """Return the WAV files found for the names *wav_files*."""
+      self.file_lookup.resolve( wav_files,
+                  dict((f,[i+1]) for i,f in enumerate(wav_files)) )
+      return list(map(self.file_lookup, wav_files))
+
+   @stats.timed('gaps')
+   def _add_gaps(self, tracks, files):
+      """Move the silence between each pair of tracks to the pregap of the
+      second track. Silence at the end of the previous file becomes pregap
+      audio in that file, and silence at the start of the track file is
+      marked with a START index."""
+      silence = [wav.find_silence(f) for f in files]
+      audio = [trk.indexes[0] for trk in tracks]
+      for i in range(1, len(tracks)):
+         trail = silence[i-1][1]
+         lead = silence[i][0]
+         if not (trail or lead):
+            continue
+         indexes = []
+         if trail:
+            # end the previous track before its silence
+            prev_idx = audio[i-1]
+            gap = disc.TrackIndex( 0, prev_idx.len_.frames - trail,
+                                   files[i-1], trail )
+            prev_idx.len_ = prev_idx.len_ - gap.len_
+            if not lead:
+               gap.cmd = disc.TrackIndex.PREAUDIO
+            indexes.append( gap )
+         indexes.append( audio[i] )
+         if lead:
+            start = disc.TrackIndex( 1, lead, files[i], trail + lead )
+            start.cmd = disc.TrackIndex.START
+            del start.time # the length from the track start is used
+            indexes.append( start )
+         tracks[i].indexes = indexes
@@ -8,75 +8,235 @@
    mktoc.progress_bar
    ~~~~~~~~~~~~~~~~~~
 
-   Module for mktoc that prints a progress indication.
-
-   The default usage is to prompt the user when an operation is running that
-   the user must wait for. The following object classes are:
+   Module for mktoc that reports the progress of long running operations.
+
+   Workers only report counters (frames and bytes done) to a :class:`Progress`
+   object. The counters are coalesced, and a renderer is called at most once
+   per update interval to display the state to the user. The following object
+   classes are:
+
+   * :class:`Progress`
+   * :class:`ProgressEvent`
+   * :class:`BarRenderer`
+   * :class:`JsonRenderer`
+   * :class:`QuietRenderer`
 """
 
+import collections
+import json
+import sys
+import threading
 import time
 
 from mktoc.base import *
 
-__all__ = ['ProgressBar']
+__all__ = ['Progress', 'ProgressEvent', 'BarRenderer', 'JsonRenderer',
+           'QuietRenderer', 'RENDERERS', 'default_renderer']
+
+
+#: Snapshot of the progress counters passed to a renderer. The *kind* field is
+#: one of ``'start'``, ``'update'``, ``'file'`` (a file was completed) or
+#: ``'finish'``.
+ProgressEvent = collections.namedtuple( 'ProgressEvent',
+      'kind name file_done file_total done total bytes_done elapsed' )
 
 
 ##############################################################################
-class ProgressBar( object ):
+class Progress( object ):
    """
-   Creates a progress bar string to be printed by the calling function.
+   Thread-safe collector of progress counters.
+
+   Any number of threads can call :meth:`update`; the counters are summed
+   under a lock and the renderer only sees a new :class:`ProgressEvent` when
+   :attr:`interval` seconds have passed since the last one. File start/end
+   and finish events are never dropped.
    """
 
-   #: The maximum input input value expected by the progress bar. This value
-   #: should be set before trying to print the progress bar. All percentage
-   #: calculations are based from this value. It is OK to update this value as
-   #: many times as needed, however it might confuse the user.
-   bar_max = None
+   #: Minimum number of seconds between two *update* events.
+   interval = 0.25
+
+   def __init__(self, renderer=None, interval=None, clock=time.time):
+      """
+      :param renderer:  Callable that receives each :class:`ProgressEvent`.
+                        Defaults to a :class:`QuietRenderer`.
+      :type  renderer:  callable
 
-   # String to contain a message printed alongside the progress bar.
-   _notice_text = None
+      :param interval:  Override the default update :attr:`interval`.
+      :type  interval:  float
 
-   # The total integer count of the 'progress'. This value is modified by the
-   # overloaded '+=' operator. This value can never go above 'bar_max'.
-   _size = None
+      :param clock:     Time source, in seconds.
+      :type  clock:     callable
+      """
+      self._renderer = renderer or QuietRenderer()
+      if interval is not None:
+         self.interval = interval
+      self._clock = clock
+      self._lock = threading.Lock()
+      self._name = None
+      self._file_done = self._file_total = 0
+      self._done = self._total = self._bytes = 0
+      self._start_time = self._next_time = None
+
+   def set_total(self, frames):
+      """
+      Set the total number of frames expected over all files.
 
-   def __init__(self, notice_txt, bar_max=0):
+      :param frames: Total frame count.
+      :type  frames: int
       """
-      Initialize object defaults.
+      with self._lock:
+         self._total = frames
+         self._start_time = self._clock()
+         self._next_time = self._start_time + self.interval
+         event = self._event('start')
+      self._renderer(event)
+
+   def start_file(self, name, frames):
+      """
+      Signal the start of work on a new file.
+
+      :param name:   Name of the file being processed.
+      :type  name:   str
+
+      :param frames: Number of frames expected in the file.
+      :type  frames: int
+      """
+      with self._lock:
+         self._name = name
+         self._file_done = 0
+         self._file_total = frames
+
+   def update(self, frames, nbytes=0):
+      """
+      Add to the frame and byte counters. This is the hot path, it only takes
+      the lock and compares the clock against the next render time.
+
+      :param frames: Number of frames completed since the last update.
+      :type  frames: int
+
+      :param nbytes: Number of bytes completed since the last update.
+      :type  nbytes: int
+      """
+      with self._lock:
+         self._file_done += frames
+         self._done += frames
+         self._bytes += nbytes
+         now = self._clock()
+         if self._next_time is None or now < self._next_time:
+            return
+         self._next_time = now + self.interval
+         event = self._event('update', now)
+      self._renderer(event)
+
+   def end_file(self):
+      """Signal that the current file is complete."""
+      with self._lock:
+         event = self._event('file')
+      self._renderer(event)
+
+   def finish(self):
+      """Signal that all of the work is complete."""
+      with self._lock:
+         event = self._event('finish')
+      self._renderer(event)
+
+   def _event(self, kind, now=None):
+      """Create a :class:`ProgressEvent` from the current counters. The
+      caller must hold the lock."""
+      if now is None:
+         now = self._clock()
+      elapsed = now - self._start_time if self._start_time else 0
+      return ProgressEvent( kind, self._name, self._file_done,
+                            self._file_total, self._done, self._total,
+                            self._bytes, elapsed )
+
+
+##############################################################################
+class QuietRenderer( object ):
+   """Renderer that discards all events."""
+   def __call__(self, event):
+      pass
+
 
+##############################################################################
+class BarRenderer( object ):
+   """
+   Renderer that draws a single line progress bar with a completion percent
+   and time estimate, intended for a terminal.
+   """
+   def __init__(self, notice_txt='', stream=None):
+      """
       :param notice_txt:   Message printed alongside the progress bar.
       :type notice_txt:    str
 
-      :param bar_max:   Maximum size of the progress bar class.
-      :type bar_max:    int
+      :param stream:       Output stream, defaults to :data:`sys.stderr`.
+      :type  stream:       file
       """
       self._notice_txt = notice_txt
-      self._size = 0
-      self.bar_max = bar_max
-
-   def __iadd__(self, other):
-      """+= operator that increments the current state of the progress bar. The
-      input value can be of any range, but the progress bar value will be fixed
-      at 'bar_max'."""
-      self._size += min(other, self.bar_max - self._size)
-      return self
-
-   def __str__(self):
-      """Returns a progress bar string."""
-      if not self.bar_max:
-         raise Exception("You must initialize ProgressBar.bar_max first")
-      if not hasattr(self,'_start_time'):
-         self._start_time = time.time()
-         time_dif = 0
+      self._stream = stream
+
+   def __call__(self, event):
+      stream = self._stream or sys.stderr
+      if event.kind == 'file':
+         return                  # the next update will redraw the bar
+      stream.write(self.format(event))
+      if event.kind == 'finish':
+         stream.write('\n')
+      stream.flush()
+
+   def format(self, event):
+      """Returns a progress bar string for *event*."""
+      if event.total:
+         percent = event.done * 100 // event.total
       else:
-         time_dif = time.time() - self._start_time    # compute time from start
-      percent = float(self._size) / self.bar_max * 100
-      if time_dif:
-         rate = self._size / time_dif      # calculate sample/sec
-         # estimate time left
-         remain_time = (self.bar_max - self._size) / rate
-         remain_str = '\tETA [%d:%02d]' % divmod(remain_time,60)
+         percent = 0
+      if event.elapsed and event.done:
+         # estimate time left from the average rate
+         remain_time = int( (event.total - event.done) * event.elapsed
+                              / event.done )
+         remain_str = '\tETA [%d:%02d]' % divmod(max(remain_time,0),60)
       else:
          remain_str = '\tETA [?:??]'
       return '%s %3d%% %s\r' % (self._notice_txt, percent, remain_str)
 
+
+##############################################################################
+class JsonRenderer( object ):
+   """
+   Renderer that writes one JSON object per event, one event per line. The
+   keys match the field names of :class:`ProgressEvent`.
+   """
+   def __init__(self, stream=None):
+      """
+      :param stream: Output stream, defaults to :data:`sys.stderr`.
+      :type  stream: file
+      """
+      self._stream = stream
+
+   def __call__(self, event):
+      stream = self._stream or sys.stderr
+      data = event._asdict()
+      data['elapsed'] = round(data['elapsed'], 3)
+      stream.write(json.dumps(data, sort_keys=True) + '\n')
+      stream.flush()
+
+
+#: Map of renderer names, as used on the command line, to a factory function
+#: that accepts the notice text.
+RENDERERS = {
+   'bar'    : BarRenderer,
+   'json'   : lambda notice_txt: JsonRenderer(),
+   'quiet'  : lambda notice_txt: QuietRenderer(),
+}
+
+
+def default_renderer(stream=None):
+   """
+   Return the name of the :data:`RENDERERS` entry to use when none was
+   selected: ``'bar'`` when *stream* (default :data:`sys.stderr`) is a
+   terminal, and ``'quiet'`` otherwise, so that redirected output is not
+   filled with bar redraws.
+   """
+   stream = stream or sys.stderr
+   isatty = getattr(stream, 'isatty', None)
+   return 'bar' if isatty and isatty() else 'quiet'
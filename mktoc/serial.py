@@ -0,0 +1,303 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   mktoc.serial
+   ~~~~~~~~~~~~
+
+   Save and load parsed CUE data, so an album is parsed once and reused by
+   other tools without reading the CUE sheet or the WAV files again.
+
+   A :class:`~mktoc.parser.ParseData` object is stored with its
+   :class:`~mktoc.disc.Disc`, :class:`~mktoc.disc.Track` and
+   :class:`~mktoc.disc.TrackIndex` objects in one of two formats:
+
+   * ``'binary'``, a compact struct packed format (the default).
+   * ``'json'``, the same fields as a JSON document.
+
+   Both formats record :data:`FORMAT_VERSION`, and the size and modification
+   time of each WAV file. :func:`load` raises :exc:`StaleDataError` if a file
+   changed since it was saved.
+
+   Example::
+
+      data = CueParser(dir_).parse(fh)
+      serial.save(data, 'album.mktoc')
+      ...
+      data = serial.load('album.mktoc')
+"""
+
+import json
+import os
+import struct
+from itertools import islice
+
+from mktoc.base import *
+from mktoc import disc
+from mktoc import parser
+from mktoc import stats
+
+__all__ = ['FORMAT_VERSION', 'SerialError', 'StaleDataError', 'dumps',
+           'loads', 'save', 'load']
+
+#: Version of the saved data layout, increased on incompatible changes.
+FORMAT_VERSION = 1
+
+# first bytes of the binary format
+_MAGIC = b'MKTC'
+
+_DISC_FIELDS = ('catalog', 'date', 'discid', 'genre', 'performer', 'title')
+_TRACK_FIELDS = ('isrc', 'performer', 'title', 'pregap')
+_TRACK_FLAGS = ('is_data', 'dcp', 'four_ch', 'pre')
+
+# special values of an index 'time' or 'len_' in the binary format
+_NONE, _EMPTY, _DELETED = -1, -2, -3
+
+# The binary format is a header, a string table of NUL separated UTF-8
+# strings, and arrays of fixed size records. Strings are stored once and
+# referenced by their position in the table, starting at 1. Reference 0 is
+# None.
+_HEAD = struct.Struct('<4sHBHHHI')  # magic, version, multisession, files,
+                                    # tracks, indexes, string table size
+_DISC = struct.Struct('<%dH' % (1+len(_DISC_FIELDS)))    # dir, fields
+_FILE = struct.Struct('<Hqq')       # name, size, mtime_ns
+_TRACK = struct.Struct('<HBH%dH' % len(_TRACK_FIELDS))   # num, flags,
+                                                         # indexes, fields
+_INDEX = struct.Struct('<BHiiH')    # cmd, num, time, len_, file
+
+
+class SerialError(MkTocError):
+   """Exception class used when saved data can not be read, or was written
+   by an incompatible version."""
+   pass
+
+class StaleDataError(SerialError):
+   """Exception class used when a WAV file of the saved data was changed or
+   removed since the data was saved.
+
+   .. attribute:: files
+
+      List of the changed file names.
+   """
+   def __init__(self, files):
+      SerialError.__init__(self, 'changed since saved: %s' % ', '.join(files))
+      self.files = files
+
+
+##############################################################################
+def dumps(data, fmt='binary'):
+   """
+   Serialize *data* to :class:`bytes`. Unresolved index lengths are read
+   from the WAV files first, so that :func:`loads` never needs to.
+
+   :param data:   Parsed CUE data.
+   :type  data:   :class:`~mktoc.parser.ParseData`
+
+   :param fmt:    ``'binary'`` or ``'json'``.
+   :type  fmt:    str
+   """
+   doc = _to_doc(data)
+   if fmt == 'json':
+      return json.dumps(doc, sort_keys=True).encode('utf-8')
+   elif fmt == 'binary':
+      return _pack(doc)
+   raise ValueError('unknown format: %r' % (fmt,))
+
+@stats.timed('load')
+def loads(buf, check=True):
+   """
+   Create a :class:`~mktoc.parser.ParseData` object from the output of
+   :func:`dumps`. The format is detected from the data.
+
+   :param buf:    Serialized data.
+   :type  buf:    bytes
+
+   :param check:  :data:`True` raises :exc:`StaleDataError` if a WAV file
+                  size or modification time changed since the data was saved.
+   :type  check:  bool
+   """
+   if buf[:len(_MAGIC)] == _MAGIC:
+      doc = _unpack(buf)
+   else:
+      try:
+         doc = json.loads(buf.decode('utf-8'))
+      except ValueError as e:
+         raise SerialError('not mktoc data: %s' % e)
+      if not isinstance(doc, dict) or doc.get('version') != FORMAT_VERSION:
+         raise SerialError('unsupported format version')
+   if check:
+      stale = [f for f,size,mtime in doc['files']
+                     if _identity(f) != (size,mtime)]
+      if stale:
+         raise StaleDataError(stale)
+   return _from_doc(doc)
+
+def save(data, path, fmt=None):
+   """
+   Write *data* to the file *path*. The format defaults to ``'json'`` for a
+   ``.json`` file name and ``'binary'`` otherwise.
+   """
+   if fmt is None:
+      fmt = 'json' if path.lower().endswith('.json') else 'binary'
+   buf = dumps(data, fmt)
+   with open(path + '.part', 'wb') as fh:
+      fh.write(buf)
+   os.replace(path + '.part', path)
+
+def load(path, check=True):
+   """
+   Read a file written by :func:`save`. See :func:`loads`.
+   """
+   with open(path, 'rb') as fh:
+      return loads(fh.read(), check)
+
+
+##############################################################################
+def _identity(file_):
+   """Return the (size, mtime_ns) of *file_*, or (-1, -1) if missing."""
+   try:
+      st = os.stat(file_)
+   except OSError:
+      return (-1, -1)
+   return (st.st_size, st.st_mtime_ns)
+
+def _time(idx, name):
+   """Return the frame count of an index time attribute, or a special
+   value."""
+   try:
+      val = getattr(idx, name)
+   except AttributeError:
+      return _DELETED
+   if val is None:            return _NONE
+   elif isinstance(val,str):  return _EMPTY
+   return val.frames
+
+def _set_time(idx, name, val):
+   """Inverse of :func:`_time`."""
+   if val == _DELETED:
+      if name == 'len_': del idx.len_
+      return
+   if val == _NONE:     val = None
+   elif val == _EMPTY:  val = ''
+   else:                val = disc._TrackTime(val)
+   setattr(idx, name, val)
+
+def _to_doc(data):
+   """Convert *data* to a document of plain types."""
+   tracks = data._tracks
+   disc.TrackIndex.resolve( idx for trk in tracks for idx in trk.indexes )
+   d = data.disc
+   return {
+      'version'      : FORMAT_VERSION,
+      'dir'          : data._dir,
+      'multisession' : d.is_multisession,
+      'disc'         : [getattr(d,k) for k in _DISC_FIELDS],
+      'files'        : [[f] + list(_identity(f)) for f in data._files],
+      'tracks'       : [{
+         'num'       : trk.num,
+         'flags'     : [getattr(trk,k) for k in _TRACK_FLAGS],
+         'fields'    : [getattr(trk,k) for k in _TRACK_FIELDS],
+         'indexes'   : [[idx.cmd, idx.num, idx.file_,
+                         _time(idx,'time'), _time(idx,'len_')]
+                           for idx in trk.indexes],
+         } for trk in tracks],
+      }
+
+def _from_doc(doc):
+   """Create a :class:`~mktoc.parser.ParseData` from a document."""
+   d = disc.Disc()
+   d.is_multisession = doc['multisession']
+   for k,v in zip(_DISC_FIELDS, doc['disc']):
+      setattr(d, k, v)
+   tracks = []
+   for t in doc['tracks']:
+      trk = disc.Track(t['num'])
+      for k,v in zip(_TRACK_FLAGS, t['flags']):
+         setattr(trk, k, bool(v))
+      for k,v in zip(_TRACK_FIELDS, t['fields']):
+         setattr(trk, k, v)
+      for cmd,num,file_,time,len_ in t['indexes']:
+         # bypass __init__, the lengths are already known
+         idx = disc.TrackIndex.__new__(disc.TrackIndex)
+         idx.cmd, idx.num, idx.file_ = cmd, num, file_
+         _set_time(idx, 'time', time)
+         _set_time(idx, 'len_', len_)
+         trk.indexes.append(idx)
+      tracks.append(trk)
+   files = [f[0] for f in doc['files']]
+   return parser.ParseData(d, tracks, files, doc['dir'])
+
+
+##############################################################################
+def _pack(doc):
+   """Return the binary format of a document."""
+   strings = {}
+   def ref(s):
+      if s is None:
+         return 0
+      return strings.setdefault(s, len(strings)+1)
+   tracks, indexes = doc['tracks'], []
+   for t in tracks:
+      indexes.extend( t['indexes'] )
+   out = [_DISC.pack( ref(doc['dir']), *map(ref, doc['disc']) )]
+   out += [_FILE.pack(ref(f), size, mtime)
+               for f,size,mtime in doc['files']]
+   out += [_TRACK.pack( t['num'],
+                        sum(1<<i for i,v in enumerate(t['flags']) if v),
+                        len(t['indexes']), *map(ref, t['fields']) )
+               for t in tracks]
+   out += [_INDEX.pack(cmd, num, time, len_, ref(file_))
+               for cmd,num,file_,time,len_ in indexes]
+   if len(strings) > 0xFFFF:
+      raise SerialError('too many strings')
+   table = '\0'.join(strings).encode('utf-8')
+   head = _HEAD.pack( _MAGIC, doc['version'], doc['multisession'],
+                      len(doc['files']), len(tracks), len(indexes),
+                      len(table) )
+   return b''.join([head, table] + out)
+
+def _unpack(buf):
+   """Return the document of the binary format *buf*."""
+   buf = memoryview(buf)
+   try:
+      (magic,version,multi,nfiles,ntracks,nindexes,
+         size) = _HEAD.unpack_from(buf)
+      if version != FORMAT_VERSION:
+         raise SerialError('unsupported format version: %d' % version)
+      pos = _HEAD.size + size
+      strings = [None] + str(buf[_HEAD.size:pos], 'utf-8').split('\0')
+      def records(st, n):
+         nonlocal pos
+         end = pos + st.size*n
+         if end > len(buf):
+            raise SerialError('truncated mktoc data')
+         rec = st.iter_unpack(buf[pos:end])
+         pos = end
+         return rec
+      refs = _DISC.unpack_from(buf, pos)
+      pos += _DISC.size
+      files = [[strings[f], size, mtime]
+                  for f,size,mtime in records(_FILE, nfiles)]
+      tracks = list(records(_TRACK, ntracks))
+      indexes = iter(records(_INDEX, nindexes))
+      nflags = len(_TRACK_FLAGS)
+      return {
+         'version'      : version,
+         'multisession' : bool(multi),
+         'dir'          : strings[refs[0]],
+         'disc'         : [strings[r] for r in refs[1:]],
+         'files'        : files,
+         'tracks'       : [{
+            'num'       : t[0],
+            'flags'     : [t[1] & (1<<b) for b in range(nflags)],
+            'fields'    : [strings[r] for r in t[3:]],
+            'indexes'   : [[cmd, num, strings[f], time, len_]
+                              for cmd,num,time,len_,f
+                                 in islice(indexes, t[2])],
+            } for t in tracks],
+         }
+   except (struct.error, UnicodeDecodeError, IndexError) as e:
+      raise SerialError('invalid mktoc data: %s' % e)
@@ -0,0 +1,389 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   mktoc.stats
+   ~~~~~~~~~~~
+
+   Lightweight timers and counters for the phases of a mktoc run.
+
+   Collection is disabled by default. In that state the module level
+   :func:`incr` and :func:`timer` functions only test a global value, so the
+   instrumentation points can stay in the hot paths of the other modules.
+   Collection is started with :func:`enable`, or for a block of code with
+   :func:`collect`::
+
+      with mktoc.stats.collect() as st:
+         CueParser(dir_).parse(fh)
+      print(st.report())
+
+   :class:`Profiler` uses the same phases to profile a block of code with
+   :mod:`cProfile` or :mod:`tracemalloc`::
+
+      with mktoc.stats.Profiler('mem') as prof:
+         CueParser(dir_).parse(fh)
+      print(prof.report())
+
+   The following are a list of the classes provided in this module:
+
+   * :class:`Stats`
+   * :class:`Profiler`
+"""
+
+import collections
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+from mktoc.base import *
+
+__all__ = ['Stats', 'Profiler', 'enable', 'disable', 'collect', 'incr',
+           'timer', 'timed']
+
+# the active Stats instance, or None when collection is disabled
+_active = None
+
+
+##############################################################################
+class Stats(object):
+   """
+   Holds the counters and phase timers of one collection run.
+
+   Counters are integers keyed by name, for example ``files_probed`` or
+   ``bytes_written``. Phase timers store the number of calls and the total
+   number of seconds spent in a phase. Timers may be nested, so the time of
+   an outer phase includes the time of the inner phases.
+   """
+   def __init__(self):
+      self.counters = collections.Counter()
+      # phase name -> [call count, total seconds]
+      self.timers = collections.OrderedDict()
+      self._hooks = []
+      self._lock = threading.Lock()
+
+   def add_hook(self, fn):
+      """
+      Register a callback for phase changes. The callback is called as
+      ``fn(event, phase, elapsed)``, where *event* is ``'enter'`` or
+      ``'exit'`` and *elapsed* is the phase time in seconds (:data:`None` for
+      ``'enter'``).
+
+      :param fn:  Hook function.
+      :type  fn:  callable
+      """
+      self._hooks.append(fn)
+
+   def remove_hook(self, fn):
+      """Unregister a callback added by :meth:`add_hook`."""
+      self._hooks.remove(fn)
+
+   def incr(self, name, n=1):
+      """
+      Add *n* to the counter *name*.
+
+      :param name:   Counter name.
+      :type  name:   str
+
+      :param n:      Increment value.
+      :type  n:      int
+      """
+      with self._lock:
+         self.counters[name] += n
+
+   @contextlib.contextmanager
+   def timer(self, phase):
+      """
+      Context manager that adds the run time of the enclosed block to
+      *phase*.
+
+      :param phase:  Phase name.
+      :type  phase:  str
+      """
+      for fn in self._hooks:
+         fn('enter', phase, None)
+      start = time.time()
+      try:
+         yield self
+      finally:
+         elapsed = time.time() - start
+         with self._lock:
+            entry = self.timers.setdefault(phase, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+         for fn in self._hooks:
+            fn('exit', phase, elapsed)
+
+   def as_dict(self):
+      """Return the counters and timers as a JSON compatible :class:`dict`."""
+      with self._lock:
+         return {
+            'counters': dict(self.counters),
+            'timers'  : dict( (k, {'calls':c, 'seconds':round(t,6)})
+                              for k,(c,t) in self.timers.items() ),
+            }
+
+   def report(self):
+      """Return a human readable report of the timers and counters."""
+      data = self.as_dict()
+      out = ['%-20s %8s %10s' % ('phase', 'calls', 'seconds')]
+      for k,v in data['timers'].items():
+         out += ['%-20s %8d %10.3f' % (k, v['calls'], v['seconds'])]
+      out += ['', '%-20s %19s' % ('counter', 'value')]
+      for k in sorted(data['counters']):
+         out += ['%-20s %19d' % (k, data['counters'][k])]
+      return '\n'.join(out)
+
+   def to_json(self):
+      """Return the :meth:`as_dict` data as a JSON string."""
+      return json.dumps(self.as_dict(), sort_keys=True)
+
+
+class Profiler(object):
+   """
+   Context manager that profiles the enclosed block.
+
+   In ``'cpu'`` mode the block runs under :mod:`cProfile`, and so do the
+   threads started inside the block (threads started earlier are not
+   profiled). The merged :class:`pstats.Stats` are written to *path*, if
+   set, and stored in :attr:`stats`.
+
+   In ``'mem'`` mode the memory allocations are traced with
+   :mod:`tracemalloc`. For each phase of :func:`timer`, the allocated size
+   and peak size are recorded, and the source lines that allocated the most
+   memory are found by comparing snapshots taken at the start and the end of
+   the phase. Nested calls of the same phase count as one call. Phases that
+   run at the same time in several threads share their snapshots, so their
+   sizes are an approximation.
+
+   Collection of phases is enabled for the block if it is not already.
+
+   .. attribute:: stats
+
+      :class:`pstats.Stats` of a ``'cpu'`` profile.
+
+   .. attribute:: phases
+
+      ``'mem'`` results, phase name -> :class:`dict` with ``calls``,
+      ``size``, ``peak`` (bytes) and ``lines`` (``'file:line'`` ->
+      allocated bytes).
+   """
+   MODES = ('cpu', 'mem')
+
+   def __init__(self, mode='cpu', path=None, phases=None, top=10):
+      """
+      :param mode:   ``'cpu'`` or ``'mem'``.
+      :type  mode:   str
+
+      :param path:   File of the ``'cpu'`` profile, in :mod:`pstats` format.
+      :type  path:   str
+
+      :param phases: Phase names traced in ``'mem'`` mode, all by default.
+      :type  phases: list
+
+      :param top:    Number of functions or source lines in :meth:`report`.
+      :type  top:    int
+      """
+      if mode not in self.MODES:
+         raise ValueError('unknown profile mode: %r' % (mode,))
+      self.mode = mode
+      self.path = path
+      self.top = top
+      self._phases = phases and frozenset(phases)
+      self._lock = threading.Lock()
+      self.stats = None
+      self.phases = collections.OrderedDict()
+      self.peak = 0
+
+   def __enter__(self):
+      global _active
+      self._prev = _active
+      if _active is None:
+         enable()
+      if self.mode == 'cpu':
+         self._threads = []
+         threading.setprofile(self._thread_start)
+         self._prof = cProfile.Profile()
+         self._prof.enable()
+      else:
+         self._tracing = tracemalloc.is_tracing()
+         if not self._tracing:
+            tracemalloc.start()
+         tracemalloc.reset_peak()
+         self._depth = collections.Counter()
+         self._open = {}      # phase -> [snapshot, start size, peak]
+         _active.add_hook(self._hook)
+      return self
+
+   def __exit__(self, *exc_info):
+      global _active
+      if self.mode == 'cpu':
+         self._prof.disable()
+         threading.setprofile(None)
+         self.stats = pstats.Stats(self._prof)
+         for prof in self._threads:
+            if prof.getstats():
+               self.stats.add(prof)
+         if self.path:
+            self.stats.dump_stats(self.path)
+      else:
+         _active.remove_hook(self._hook)
+         self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+         if not self._tracing:
+            tracemalloc.stop()
+      _active = self._prev
+      return False
+
+   def _thread_start(self, frame, event, arg):
+      """Profile function of the new threads. Replaced by a profiler of the
+      thread on its first event."""
+      prof = cProfile.Profile()
+      with self._lock:
+         self._threads.append(prof)
+      prof.enable()
+
+   def _hook(self, event, phase, elapsed):
+      """:meth:`Stats.add_hook` callback of ``'mem'`` mode."""
+      if self._phases is not None and phase not in self._phases:
+         return
+      with self._lock:
+         # the peak since the last event belongs to every open phase
+         size,peak = tracemalloc.get_traced_memory()
+         tracemalloc.reset_peak()
+         self.peak = max(self.peak, peak)
+         for entry in self._open.values():
+            entry[2] = max(entry[2], peak)
+         if event == 'enter':
+            self._depth[phase] += 1
+            if self._depth[phase] == 1:
+               self._open[phase] = [self._snapshot(), size, size]
+         elif self._depth[phase]:
+            self._depth[phase] -= 1
+            if self._depth[phase] == 0:
+               snap,start,top = self._open.pop(phase)
+               entry = self.phases.setdefault( phase,
+                     {'calls':0, 'size':0, 'peak':0,
+                      'lines':collections.Counter()} )
+               entry['calls'] += 1
+               entry['size'] += size - start
+               entry['peak'] = max(entry['peak'], top - start)
+               for st in self._snapshot().compare_to(snap, 'lineno'):
+                  if st.size_diff > 0:
+                     frame = st.traceback[0]
+                     entry['lines']['%s:%d' % (frame.filename,
+                                               frame.lineno)] += st.size_diff
+
+   @staticmethod
+   def _snapshot():
+      """Return a snapshot without the allocations of :mod:`tracemalloc`
+      and of the profiler itself."""
+      return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__),
+             tracemalloc.Filter(False, __file__)] )
+
+   def report(self):
+      """Return a human readable report of the profile."""
+      if self.mode == 'cpu':
+         out = io.StringIO()
+         if self.stats is not None:
+            self.stats.stream = out
+            self.stats.sort_stats('cumulative').print_stats(self.top)
+         return out.getvalue()
+      out = ['%-20s %8s %12s %12s' % ('phase', 'calls', 'KiB', 'peak KiB')]
+      for k,v in self.phases.items():
+         out += ['%-20s %8d %12.1f %12.1f' % (k, v['calls'], v['size']/1024.,
+                                               v['peak']/1024.)]
+      out += ['', 'peak: %.1f KiB' % (self.peak/1024.)]
+      for k,v in self.phases.items():
+         out += ['', 'top allocations of %s:' % k]
+         for line,size in v['lines'].most_common(self.top):
+            out += ['%12.1f KiB  %s' % (size/1024., line)]
+      return '\n'.join(out)
+
+
+class _NullTimer(object):
+   """Reusable no-op context manager returned by :func:`timer` when
+   collection is disabled."""
+   def __enter__(self):
+      return None
+   def __exit__(self, *exc_info):
+      return False
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable(stats=None):
+   """
+   Start collection into *stats*, or into a new :class:`Stats` object.
+
+   :returns: The active :class:`Stats` object.
+   """
+   global _active
+   _active = stats if stats is not None else Stats()
+   return _active
+
+
+def disable():
+   """Stop collection. Returns the previously active :class:`Stats`."""
+   global _active
+   stats, _active = _active, None
+   return stats
+
+
+@contextlib.contextmanager
+def collect(stats=None):
+   """
+   Context manager that enables collection for the enclosed block and yields
+   the :class:`Stats` object. The previous collection state is restored on
+   exit.
+   """
+   global _active
+   prev = _active
+   try:
+      yield enable(stats)
+   finally:
+      _active = prev
+
+
+def incr(name, n=1):
+   """Add *n* to counter *name* of the active :class:`Stats`, if any."""
+   stats = _active
+   if stats is not None:
+      stats.incr(name, n)
+
+
+def timer(phase):
+   """Return a context manager that times *phase* in the active
+   :class:`Stats`, or a no-op context manager when disabled."""
+   stats = _active
+   if stats is None:
+      return _NULL_TIMER
+   return stats.timer(phase)
+
+
+def timed(phase):
+   """
+   Decorator that runs each call of the decorated function inside
+   :func:`timer`.
+
+   :param phase:  Phase name.
+   :type  phase:  str
+   """
+   def decorator(fn):
+      @functools.wraps(fn)
+      def wrapper(*args, **kwargs):
+         stats = _active
+         if stats is None:
+            return fn(*args, **kwargs)
+         with stats.timer(phase):
+            return fn(*args, **kwargs)
+      return wrapper
+   return decorator
@@ -0,0 +1,72 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   Unit testing framework for mktoc.bench package.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mktoc.base import *
+from mktoc.parser import *
+from mktoc.bench import corpus
+from mktoc.bench import suite
+
+
+##############################################################################
+class CorpusTests(unittest.TestCase):
+   """Unit tests for the synthetic album generator."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def testAlbumParses(self):
+      """A generated album must be parsed with the WAV files found."""
+      album = corpus.make_album( self.dir_, tracks=3, track_frames=300,
+                                 indexes=2, pregap_frames=75)
+      with open(album.cue) as fh:
+         data = CueParser(self.dir_).parse(fh)
+      self.assertEqual( data.files, album.wavs )
+      for f in album.wavs:
+         self.assertEqual( os.path.getsize(f), 44 + 300*corpus.FRAME_BYTES )
+
+   def testDataTrack(self):
+      """The size of a generated data track must be read from the log."""
+      album = corpus.make_album( self.dir_, tracks=2, track_frames=300,
+                                 data_track=True, wav='real')
+      with open(album.cue) as fh:
+         data = CueParser(self.dir_).parse(fh)
+      self.assertTrue( data.disc.is_multisession )
+      self.assertEqual( data.last_index.len_.frames, 75*60 )
+
+   def testSuiteRun(self):
+      """All benchmarks must run and report a time."""
+      album = corpus.make_album( self.dir_, tracks=2, track_frames=150)
+      results = suite.run(album, repeat=1)
+      self.assertEqual( sorted(results), sorted(n for n,f in
+                                                suite.BENCHMARKS) )
+
+   def testMainDataTrack(self):
+      """The command line must benchmark a multi-session album."""
+      out = os.path.join(self.dir_, 'out.json')
+      suite.main(['-r', '1', '--tracks', '2', '--seconds', '2', '--pregap',
+                  '0', '--data-track', '-o', out, 'parse'])
+      with open(out) as fh:
+         doc = json.load(fh)
+      self.assertTrue( doc['params']['data_track'] )
+      self.assertEqual( sorted(doc['results']), ['parse'] )
+
+
+##############################################################################
+if __name__ == '__main__':
+   """Execute all test cases define in this file."""
+   unittest.main()
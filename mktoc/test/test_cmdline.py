@@ -8,11 +8,17 @@
    Unit testing framework for mktoc.cmdline module.
 """
 
+import io
+import json
+import os
+import shutil
+import tempfile
 import unittest
 from mock import patch
 
 from mktoc.cmdline import *
 from mktoc.base import *
+from mktoc.bench import corpus
 
 class TestCmdLine( unittest.TestCase):
 
@@ -43,3 +49,62 @@ class TestCmdLine( unittest.TestCase):
          self.assertEqual( err_method.call_args[0][0],
                             run_method.side_effect )
 
+   def testValidate(self):
+      """'--validate' must report every CUE file, and fail if one album can
+      not be written."""
+      dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      try:
+         good = corpus.make_album( os.path.join(dir_,'a'), tracks=2,
+                                   track_frames=75, wav='real' )
+         bad = corpus.make_album( os.path.join(dir_,'b'), tracks=2,
+                                  track_frames=75, wav='real' )
+         with open(bad.wavs[0], 'r+b') as fh:
+            fh.truncate(1000)
+         with patch('sys.stdout', new_callable=io.StringIO) as out:
+            status = self.cl.run(['--validate', good.cue, bad.cue])
+         report = json.loads(out.getvalue())
+         self.assertEqual( status, 1 )
+         self.assertEqual( [a['source'] for a in report['albums']],
+                           [good.cue, bad.cue] )
+         self.assertEqual( [a['ok'] for a in report['albums']],
+                           [True, False] )
+         with patch('sys.stdout', new_callable=io.StringIO) as out:
+            self.assertEqual( self.cl.run(['--validate', good.cue]), 0 )
+      finally:
+         shutil.rmtree(dir_)
+
+   def testNoExit(self):
+      """Open errors and multi-session data must return an error status,
+      and not exit the process."""
+      dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      try:
+         self.assertRaises( FileOpenError, self.cl._open_file,
+                            os.path.join(dir_, 'missing.cue') )
+         album = corpus.make_album( dir_, tracks=2, track_frames=75,
+                                    data_track=True )
+         with patch('sys.stderr', new_callable=io.StringIO) as err:
+            self.assertEqual( self.cl.run(['-f', os.path.join(dir_, 'x.cue')]),
+                              -1 )
+            self.assertEqual( self.cl.run(['-f', album.cue]), -1 )
+         self.assertTrue( 'multi-session' in err.getvalue() )
+      finally:
+         shutil.rmtree(dir_)
+
+   def testPlan(self):
+      """'--plan' must write one TOC file per disc."""
+      dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      try:
+         album = corpus.make_album( dir_, tracks=3, track_frames=75*60,
+                                    wav='real' )
+         toc = os.path.join(dir_, 'disc.toc')
+         # 'progName' is set by main()
+         with patch('sys.stderr', new_callable=io.StringIO), patch(
+               'mktoc.cmdline.progName', 'mktoc', create=True):
+            self.cl.run(['--plan', '2.5', '-w'] + album.wavs + ['-o', toc])
+         self.assertEqual( sorted(f for f in os.listdir(dir_)
+                                    if f.endswith('.toc')),
+                           ['disc-1.toc', 'disc-2.toc'] )
+         with open(os.path.join(dir_, 'disc-2.toc')) as fh:
+            self.assertEqual( fh.read().count('TRACK AUDIO'), 1 )
+      finally:
+         shutil.rmtree(dir_)
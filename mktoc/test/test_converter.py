@@ -0,0 +1,93 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   Unit testing framework for mktoc.converter module.
+"""
+
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import unittest
+
+import mktoc
+from mktoc.base import *
+from mktoc.bench import corpus
+from mktoc.converter import *
+
+
+##############################################################################
+class ConverterTests(unittest.TestCase):
+   """Unit tests for the Converter class."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def _album(self, name='a', **kwargs):
+      return corpus.make_album( os.path.join(self.dir_, name), tracks=3,
+                                track_frames=75, **kwargs )
+
+   def testConvert(self):
+      """A CUE file must be converted to TOC text."""
+      album = self._album()
+      res = mktoc.Converter().convert(album.cue)
+      self.assertTrue( isinstance(res, TocResult) )
+      self.assertEqual( res.files, album.wavs )
+      self.assertEqual( res.toc.count('TRACK AUDIO'), 3 )
+      self.assertTrue( res.toc.startswith('CD_DA\n') )
+      self.assertTrue( res.session_frames is None )
+
+   def testConvertText(self):
+      """CUE text must be read with the WAV files of *dir_*."""
+      album = self._album()
+      with open(album.cue) as fh:
+         text = fh.read()
+      res = Converter().convert(text, album.dir_)
+      self.assertEqual( res.files, album.wavs )
+      self.assertEqual( res.toc, Converter().convert(album.cue).toc )
+
+   def testErrors(self):
+      """Errors must be raised as MkTocError exceptions."""
+      conv = Converter()
+      self.assertRaises( FileOpenError, conv.convert,
+                         os.path.join(self.dir_, 'missing.cue') )
+      album = self._album()
+      os.remove(album.wavs[1])
+      self.assertRaises( FileNotFoundError, conv.convert, album.cue )
+      self.assertEqual( len(Converter(find_wav=False).convert(
+                              album.cue).files), 3 )
+      self.assertRaises( ValueError, Converter, multisession='yes' )
+
+   def testMultiSession(self):
+      """The multi-session policy must be applied to data tracks."""
+      album = self._album(data_track=True)
+      self.assertRaises( MultiSessionError, Converter().convert, album.cue )
+      res = Converter(multisession='allow').convert(album.cue)
+      self.assertTrue( res.data.disc.is_multisession )
+      self.assertTrue( res.session_frames > 0 )
+      res = Converter(multisession='ignore').convert(album.cue)
+      self.assertFalse( res.data.disc.is_multisession )
+      self.assertTrue( res.session_frames is None )
+
+   def testThreads(self):
+      """One converter must convert albums from several threads, and scan
+      each directory once."""
+      albums = [self._album(str(i)) for i in range(8)]
+      conv = Converter()
+      with concurrent.futures.ThreadPoolExecutor(4) as pool:
+         results = list(pool.map(conv.convert, [a.cue for a in albums]*2))
+      self.assertEqual( [r.files for r in results],
+                        [a.wavs for a in albums]*2 )
+      self.assertEqual( len(conv.scans), 8 )
+
+
+##############################################################################
+if __name__ == '__main__':
+   """Execute all test cases define in this file."""
+   unittest.main()
@@ -8,11 +8,16 @@
    Unit testing framework for mktoc_disc module.
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 
 from mktoc.base import *
 from mktoc.disc import *
 from mktoc.disc import _TrackTime
+from mktoc.wav import wav_header
+from mktoc import stats
 
 
 ##############################################################################
@@ -73,6 +78,60 @@ class TrackTimeTests(unittest.TestCase):
                         str(_TrackTime(s[2])) )
 
 
+##############################################################################
+class TrackIndexTests(unittest.TestCase):
+   """Unit tests for the TrackIndex class."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def testWavLength(self):
+      """The index length must be read from the WAV file."""
+      path = os.path.join(self.dir_, 'a.wav')
+      samples = 588 * (75*61 + 12)     # 01:01:12
+      with open(path, 'wb') as fh:
+         fh.write( wav_header(2, 2, 44100, samples) )
+         fh.write( b'\0' * samples * 4 )
+      idx = TrackIndex(1, '00:00:12', path)
+      self.assertEqual( str(idx.len_), '01:01:00' )
+
+
+   def testNotCddaLength(self):
+      """The index length of a file that is not CD-DA audio must be its
+      duration in CD frames."""
+      path = os.path.join(self.dir_, 'b.wav')
+      samples = 640 * (75*2 + 3) + 1           # 00:02:03 at 48 kHz
+      with open(path, 'wb') as fh:
+         fh.write( wav_header(1, 3, 48000, samples) )
+         fh.write( b'\0' * samples * 3 )
+      idx = TrackIndex(1, 0, path)
+      self.assertEqual( str(idx.len_), '00:02:03' )
+
+   def testLazyLength(self):
+      """The WAV file must not be read until the index length is used, and
+      only once per file when resolved in bulk."""
+      path = os.path.join(self.dir_, 'c.wav')
+      with open(path, 'wb') as fh:
+         fh.write( wav_header(2, 2, 44100, 588*75) )
+         fh.write( b'\0' * 588*75*4 )
+      with stats.collect() as st:
+         idx = [TrackIndex(1, t, path) for t in (0, 15, 30)]
+         self.assertFalse( 'files_probed' in st.counters )
+         TrackIndex.resolve(idx)
+      self.assertEqual( st.counters['files_probed'], 1 )
+      self.assertEqual( [str(i.len_) for i in idx],
+                        ['00:01:00', '00:00:60', '00:00:45'] )
+
+   def testNoResolve(self):
+      """An index created with resolve=False must never read its file."""
+      idx = TrackIndex(1, 0, os.path.join(self.dir_, 'missing.wav'),
+                       resolve=False)
+      self.assertEqual( idx.len_, '' )
+      del idx.len_
+      self.assertRaises( AttributeError, getattr, idx, 'len_' )
+
 ##############################################################################
 if __name__ == '__main__':
    """Execute all test cases define in this file."""
@@ -10,13 +10,22 @@
 
 import inspect
 import os
+import shutil
 import sys
+import struct
+import tempfile
 import unittest
+import wave
+import zlib
 
 from mktoc.base import *
 from mktoc.parser import *
 from mktoc.disc import *
 from mktoc.cmdline import CommandLine
+from mktoc.bench import corpus
+from mktoc import parser
+from mktoc import stats
+from mktoc import wav
 
 uopen = CommandLine._open_file
 
@@ -176,6 +185,122 @@ class CueParserTests(unittest.TestCase):
          TRACK 01 AUDIO""".split('\n')
       self.assertTrue( cp.parse(file_) )
 
+   def testNoResolveAudio(self):
+      """A metadata only parse must not touch the file system, even for
+      missing files, directories and data tracks."""
+      cp = CueParser('/nonexistent', resolve_audio=False)
+      file_ = """TITLE "album"
+         FILE "track1.wav" WAVE
+         TRACK 01 AUDIO
+         INDEX 01 00:00:00
+         TRACK 02 AUDIO
+         INDEX 01 02:00:00
+         FILE "track3.wav" WAVE
+         TRACK 03 MODE1/2352
+         INDEX 01 00:00:00""".split('\n')
+      with stats.collect() as st:
+         data = cp.parse(file_)
+         toc = data.getToc()
+      self.assertFalse( 'files_probed' in st.counters )
+      self.assertFalse( 'logs_scanned' in st.counters )
+      self.assertEqual( data.files, ['track1.wav', 'track3.wav'] )
+      self.assertTrue( '    AUDIOFILE "track1.wav" 00:00:00 02:00:00' in toc )
+
+
+class FileAssignTests(unittest.TestCase):
+   """Unit tests of the sheet level WAV file assignment."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def _wav(self, name, frames=75):
+      path = os.path.join(self.dir_, name)
+      with open(path, 'wb') as fh:
+         fh.write( wav.wav_header(2, 2, 44100, frames*588) )
+         fh.truncate( 44 + frames*588*4 )
+      return path
+
+   def _cue(self, names):
+      cue = []
+      for i,n in enumerate(names):
+         cue += ['FILE "%s" WAVE' % n, 'TRACK %02d AUDIO' % (i+1),
+                 'INDEX 01 00:00:00']
+      return CueParser(self.dir_).parse(cue)
+
+   def testOneToOne(self):
+      """A name that matches several files must get the file not used by
+      the other names."""
+      a, b = self._wav('Intro-1.wav'), self._wav('Intro-2.wav')
+      self.assertEqual( self._cue(['intro.wav', 'Intro-1.wav']).files,
+                        [b, a] )
+
+   def testDuration(self):
+      """The track length in the EAC log must choose between equally
+      similar names."""
+      a, b = self._wav('Intro-1.wav', 600), self._wav('Intro-2.wav', 300)
+      with open(os.path.join(self.dir_, 'album.log'), 'w') as fh:
+         fh.write('     Track |   Start  |  Length  | Start sector | '
+                  'End sector \n'
+                  '        1  |  0:00.00 |  0:04.00 |         0    |'
+                  '      299   \n')
+      self.assertEqual( self._cue(['intro.wav']).files, [b] )
+
+   def testManyTracks(self):
+      """Names that each match many files must be assigned in one step."""
+      wavs = [self._wav('Track %d.wav' % i) for i in range(1,121)]
+      names = ['Track_%d.wav' % i for i in range(1,121)]
+      self.assertEqual( self._cue(names).files, wavs )
+
+   def testAssign(self):
+      """The assignment must maximize the number of assigned rows, then
+      minimize the cost."""
+      rows = [{0:0.5}, {1:0.5}, {0:0.2}, {0:0.1, 1:0.7}, {0:0.3, 1:0.4}]
+      self.assertEqual( parser._assign(rows), [None, None, None, 0, 1] )
+      rows = [{'a':0.1, 'b':0.2}, {'a':0.1, 'b':0.9}]
+      self.assertEqual( parser._assign(rows), ['b', 'a'] )
+
+
+class WavPlanTests(unittest.TestCase):
+   """Unit tests of the multi-disc planner."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def _wav(self, name, frames):
+      path = os.path.join(self.dir_, name)
+      with open(path, 'wb') as fh:
+         fh.write( wav.wav_header(2, 2, 44100, frames*588) )
+         fh.truncate( 44 + frames*588*4 )
+      return path
+
+   def testBinPack(self):
+      """Bins must keep the item order, unless reordering is allowed to use
+      fewer bins."""
+      sizes = [6, 5, 4, 5]
+      self.assertEqual( parser._bin_pack(sizes, 10),
+                        [[0], [1,2], [3]] )
+      self.assertEqual( parser._bin_pack(sizes, 10, reorder=True),
+                        [[0,2], [1,3]] )
+      self.assertEqual( parser._bin_pack([], 10), [] )
+      self.assertRaises( MkTocError, parser._bin_pack, [4, 11], 10 )
+
+   def testPlan(self):
+      """Each disc must fit the capacity with the lead and track pregaps."""
+      files = [self._wav('t%d.wav' % i, 1000) for i in range(5)]
+      # 150 + 1000 + 2*(150+1000) = 3450 frames per disc at most
+      discs = WavParser(self.dir_).plan(files, capacity=3500)
+      self.assertEqual( [d.files for d in discs],
+                        [files[:3], files[3:]] )
+      self.assertEqual( [t.pregap for t in discs[0]._tracks],
+                        [None, '00:02:00', '00:02:00'] )
+      self.assertEqual( [d.length for d in discs], [3450, 2300] )
+      self.assertRaises( MkTocError, WavParser(self.dir_).plan, files,
+                         capacity=1000 )
+
 
 class WavParserTests(unittest.TestCase):
    def testWavFiles(self):
@@ -187,6 +312,222 @@ class WavParserTests(unittest.TestCase):
       self.assertTrue( data )
 
 
+class WavParserGapTests(unittest.TestCase):
+   """Unit tests of the WavParser pregap detection."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      sound, silence = b'\x10\x00\xf0\xff', b'\x00' * 4
+      # (leading silence, sound, trailing silence) of each file in samples
+      layout = [(0, 200*588, 10*588), (0, 200*588, 0),
+                (5*588 + 300, 200*588, 0), (75*588, 200*588, 0)]
+      self.files = []
+      for i,(lead,n,trail) in enumerate(layout):
+         f = os.path.join(self.dir_, 'track%d.wav' % i)
+         w = wave.open(f, 'w')
+         w.setparams((2, 2, 44100, 0, 'NONE', 'not compressed'))
+         w.writeframes( silence*lead + sound*n + silence*trail )
+         w.close()
+         self.files.append(f)
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def testNoGaps(self):
+      """By default the silence must not change the tracks."""
+      toc = WavParser(self.dir_).parse(self.files).getToc()
+      self.assertFalse( [l for l in toc if 'START' in l] )
+
+   def testGaps(self):
+      """Trailing silence must become pregap audio of the next track, and
+      leading silence must be marked with START."""
+      data = WavParser(self.dir_, detect_gaps=True).parse(self.files)
+      toc = [l.strip() for l in data.getToc()
+             if 'AUDIOFILE' in l or 'START' in l]
+      self.assertEqual( toc, [
+         'AUDIOFILE "%s" 00:00:00 00:02:50' % self.files[0],
+         'AUDIOFILE "%s" 00:02:50 00:00:10' % self.files[0],
+         'START',
+         'AUDIOFILE "%s" 00:00:00 00:02:50' % self.files[1],
+         'AUDIOFILE "%s" 00:00:00 00:02:55' % self.files[2],
+         'START 00:00:05',
+         'AUDIOFILE "%s" 00:00:00 00:03:50' % self.files[3],
+         'START 00:01:00'] )
+      self.assertEqual( data._track_starts(data._tracks),
+                        [0, 210*588, 415*588, 690*588 + 300] )
+
+
+class ParseDataTests(unittest.TestCase):
+   """Unit tests of ParseData, using a generated album."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      self.album = corpus.make_album( self.dir_, tracks=3, track_frames=300,
+                                      wav='real', eac_log=True )
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def _parse(self, **kwargs):
+      with open(self.album.cue) as fh:
+         return CueParser(self.dir_, **kwargs).parse(fh)
+
+   def testChecksums(self):
+      """Copy CRCs must match the EAC log, and be reported in the TOC."""
+      data = self._parse()
+      data.modWavOffset(30, checksum=True)
+      toc = data.getToc()
+      crcs = [l for l in toc if l.startswith('//   ')]
+      self.assertEqual( len(crcs), 3 )
+      self.assertTrue( all(' OK, output ' in l for l in crcs) )
+      # the output CRC covers the offset corrected file
+      out = os.path.join(self.dir_, 'wav+30',
+                         os.path.basename(self.album.wavs[0]))
+      with open(out, 'rb') as fh:
+         crc = zlib.crc32(fh.read()[44:])
+      self.assertTrue( crcs[0].endswith('output %08X' % crc) )
+
+   def testAccurateRip(self):
+      """A response file of the offset corrected audio must be matched at
+      the correction value."""
+      data = self._parse()
+      ar = wav.AccurateRip( data.files )
+      sums = ar.checksums(-30)
+      ar.close()
+      f = os.path.join(self.dir_, 'dBAR-003.bin')
+      with open(f,'wb') as fh:
+         fh.write( struct.pack('<BIII', 3, 1, 2, 3) )
+         for v1,v2 in sums:
+            fh.write( struct.pack('<BII', 4, v2, 0) )
+      res = data.verifyAccurateRip(f, offset=30)
+      self.assertEqual( [r['track'] for r in res], [1, 2, 3] )
+      self.assertEqual( [(r['v1'],r['v2']) for r in res], sums )
+      self.assertTrue( all(r['matches'][0] == (30, 2, 4) for r in res) )
+
+   def testTrackStartsPregap(self):
+      """Tracks with pregap audio in the previous file must start at
+      INDEX 01."""
+      dir_ = os.path.join(self.dir_, 'gaps')
+      album = corpus.make_album( dir_, tracks=3, track_frames=300,
+                                 pregap_frames=10, wav='real' )
+      with open(album.cue) as fh:
+         data = CueParser(dir_).parse(fh)
+      self.assertEqual( data._track_starts(data._tracks),
+                        [0, 300*588, 600*588] )
+
+   def testConvertCdda(self):
+      """Files that are not CD-DA must be converted, and used in the TOC
+      and by the offset correction."""
+      data = self._parse()
+      self.assertEqual( data.nonCddaFiles(), [] )
+      f = self.album.wavs[1]
+      hdr = wav.read_header(f)
+      with open(f, 'wb') as fh:
+         fh.write( wav.wav_header(1, 2, 22050, hdr.nframes // 2) )
+         fh.write( b'\0' * hdr.nframes )
+      data = self._parse()
+      self.assertEqual( data.nonCddaFiles(), [f] )
+      data.convertCdda()
+      new = os.path.join(self.dir_, 'cdda', os.path.basename(f))
+      self.assertEqual( data.files[1], new )
+      self.assertEqual( data.nonCddaFiles(), [] )
+      self.assertEqual( wav.read_header(new).nframes, hdr.nframes )
+      data.modWavOffset(30)
+      self.assertTrue( any('cdda/wav+30' in l for l in data.getToc()) )
+
+   def testWriteImage(self):
+      """The TOC must refer to the positions of the tracks in the image."""
+      data = self._parse()
+      path = os.path.join(self.dir_, 'image.wav')
+      data.writeImage(path, 30)
+      self.assertEqual( data.files, [path] )
+      toc = [l.strip() for l in data.getToc() if 'AUDIOFILE' in l]
+      self.assertEqual( toc, [ 'AUDIOFILE "%s" %s 00:04:00' % (path, t)
+                               for t in ['00:00:00','00:04:00','00:08:00'] ] )
+      self.assertEqual( wav.read_header(path).nframes, 900*588 )
+
+   def testWriteImageFrames(self):
+      """Files that are not whole CD frames must not be joined."""
+      f = self.album.wavs[0]
+      with open(f, 'wb') as fh:
+         fh.write( wav.wav_header(2, 2, 44100, 1000) + b'\0' * 4000 )
+      data = self._parse()
+      self.assertRaises( MkTocError, data.writeImage,
+                         os.path.join(self.dir_, 'image.wav') )
+
+   def testValidate(self):
+      """Files that cdrdao can not write as they are must be reported."""
+      data = self._parse()
+      rep = data.validate()
+      self.assertTrue( rep['ok'] )
+      self.assertEqual( rep['frames'], 150 + 900 )
+      self.assertEqual( rep['capacity'], {'74':True, '80':True, '90':True} )
+      a, b, c = self.album.wavs
+      with open(a, 'wb') as fh:      # 48 kHz
+         fh.write( wav.wav_header(2, 2, 48000, 1000) + b'\0' * 4000 )
+      with open(b, 'wb') as fh:      # not whole CD frames, truncated
+         fh.write( wav.wav_header(2, 2, 44100, 1000) + b'\0' * 3000 )
+      with open(c, 'wb') as fh:      # last file, not whole CD frames
+         fh.write( wav.wav_header(2, 2, 44100, 1000) + b'\0' * 4000 )
+      rep = data.validate(workers=2)
+      self.assertFalse( rep['ok'] )
+      self.assertEqual( [f['ok'] for f in rep['files']], [False]*2 + [True] )
+      self.assertTrue( 'not CD-DA' in rep['files'][0]['errors'][0] )
+      self.assertEqual( len(rep['files'][1]['errors']), 2 )
+      self.assertEqual( len(rep['files'][2]['warnings']), 1 )
+      self.assertEqual( rep['files'][0]['format']['rate'], 48000 )
+      os.remove(a)
+      self.assertFalse( data.validate()['files'][0]['ok'] )
+
+   def testValidateCapacity(self):
+      """A disc longer than 80 minutes must need 90 minute media."""
+      data = self._parse()
+      data._tracks[0].pregap = '81:00:00'
+      rep = data.validate()
+      self.assertTrue( rep['ok'] )
+      self.assertEqual( rep['capacity'], {'74':False, '80':False, '90':True} )
+      self.assertTrue( '90 minute' in rep['warnings'][0] )
+      data._tracks[0].pregap = '91:00:00'
+      self.assertFalse( data.validate()['ok'] )
+
+   def testSplitTracks(self):
+      """An image must be cut at INDEX 01 of each track, and the pregap
+      must stay with the track in the TOC."""
+      image = os.path.join(self.dir_, 'image.wav')
+      wav.ImageWriter()(self.album.wavs, image)
+      cue = os.path.join(self.dir_, 'image.cue')
+      with open(cue, 'w') as fh:
+         fh.write( 'FILE "image.wav" WAVE\n'
+                   '  TRACK 01 AUDIO\n    INDEX 01 00:00:00\n'
+                   '  TRACK 02 AUDIO\n    INDEX 00 00:03:00\n'
+                   '    INDEX 01 00:04:00\n'
+                   '  TRACK 03 AUDIO\n    INDEX 01 00:08:00\n' )
+      with open(cue) as fh:
+         data = CueParser(self.dir_).parse(fh)
+      out = os.path.join(self.dir_, 'split')
+      data.splitTracks(out, workers=2)
+      paths = [os.path.join(out, 'track%02d.wav' % n) for n in [1,2,3]]
+      self.assertEqual( data.files, paths )
+      self.assertEqual( [wav.read_header(f).nframes // 588 for f in paths],
+                        [300, 300, 300] )
+      toc = [l.strip() for l in data.getToc()
+             if 'AUDIOFILE' in l or 'START' in l]
+      self.assertEqual( toc, [
+         'AUDIOFILE "%s" 00:00:00 00:03:00' % paths[0],
+         'AUDIOFILE "%s" 00:03:00 00:01:00' % paths[0],
+         'AUDIOFILE "%s" 00:00:00 00:04:00' % paths[1],
+         'START 00:01:00',
+         'AUDIOFILE "%s" 00:00:00 00:04:00' % paths[2]] )
+      with open(image, 'rb') as fh:
+         fh.seek(44 + 300*588*4)
+         track2 = fh.read(300*588*4)
+      with open(paths[1], 'rb') as fh:
+         self.assertEqual( fh.read()[44:], track2 )
+
+   def testEacCopyCrcs(self):
+      crcs = eac_copy_crcs(self.dir_)
+      self.assertEqual( sorted(crcs),
+                        [os.path.basename(f).lower() for f in self.album.wavs] )
+
+
 if __name__ == '__main__':
    """Execute all test cases define in this file."""
    unittest.main()
@@ -8,8 +8,80 @@
    Unit testing framework for mktoc_progress_bar module.
 """
 
+import io
+import json
 import unittest
 from mktoc.base import *
+from mktoc.progress_bar import *
+
+
+##############################################################################
+class ProgressTests(unittest.TestCase):
+   """Unit tests for the Progress counter class."""
+   def setUp(self):
+      self.events = []
+      self.now = 0.0
+      self.prog = Progress( self.events.append, interval=1.0,
+                            clock=lambda: self.now )
+
+   def testUpdatesAreThrottled(self):
+      """Updates within the interval must be coalesced into one event."""
+      self.prog.set_total(100)
+      self.prog.start_file('a.wav', 100)
+      for i in range(10):
+         self.prog.update(1, 4)
+      self.assertEqual( [e.kind for e in self.events], ['start'] )
+      self.now = 1.0
+      self.prog.update(1, 4)
+      self.assertEqual( self.events[-1].kind, 'update' )
+      self.assertEqual( self.events[-1].done, 11 )
+      self.assertEqual( self.events[-1].bytes_done, 44 )
+
+   def testFileAndFinishEvents(self):
+      """File and finish events must always be rendered."""
+      self.prog.set_total(10)
+      self.prog.start_file('a.wav', 10)
+      self.prog.update(10)
+      self.prog.end_file()
+      self.prog.finish()
+      self.assertEqual( [e.kind for e in self.events],
+                        ['start','file','finish'] )
+      self.assertEqual( self.events[1].name, 'a.wav' )
+      self.assertEqual( self.events[1].file_done, 10 )
+
+
+##############################################################################
+class RendererTests(unittest.TestCase):
+   """Unit tests for the progress renderers."""
+   def testBarFormat(self):
+      """Bar renderer must print the percent complete."""
+      event = ProgressEvent('update','a.wav',5,10,50,100,200,10.0)
+      line = BarRenderer('msg:').format(event)
+      self.assertTrue( line.startswith('msg:  50%') )
+      self.assertTrue( 'ETA [0:10]' in line )
+
+   def testJsonLines(self):
+      """JSON renderer must write one parsable object per event."""
+      out = io.StringIO()
+      render = JsonRenderer(out)
+      render( ProgressEvent('start',None,0,0,0,100,0,0) )
+      render( ProgressEvent('finish','a.wav',100,100,100,100,400,1.5) )
+      lines = [json.loads(l) for l in out.getvalue().splitlines()]
+      self.assertEqual( [l['kind'] for l in lines], ['start','finish'] )
+      self.assertEqual( lines[1]['bytes_done'], 400 )
+
+
+##############################################################################
+class DefaultRendererTests(unittest.TestCase):
+   """Unit tests for the default renderer selection."""
+   def testTerminal(self):
+      stream = io.StringIO()
+      stream.isatty = lambda: True
+      self.assertEqual(default_renderer(stream), 'bar')
+
+   def testRedirected(self):
+      """Output that is not a terminal must not get bar redraws."""
+      self.assertEqual(default_renderer(io.StringIO()), 'quiet')
 
 
 ##############################################################################
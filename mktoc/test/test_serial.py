@@ -0,0 +1,99 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   Unit testing framework for mktoc.serial module.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mktoc.base import *
+from mktoc import serial
+from mktoc import stats
+from mktoc.parser import *
+from mktoc.bench import corpus
+
+
+##############################################################################
+class SerialTests(unittest.TestCase):
+   """Unit tests of saving and loading ParseData, using a generated
+   album."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      self.album = corpus.make_album( self.dir_, tracks=4, track_frames=300,
+                                      indexes=2, pregap_frames=10,
+                                      data_track=True, eac_log=True )
+      with open(self.album.cue) as fh:
+         self.data = CueParser(self.dir_).parse(fh)
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def testRoundTrip(self):
+      """Loaded data must produce the same TOC, in both formats, without
+      reading the WAV files."""
+      toc = self.data.getToc()
+      for fmt in ('binary', 'json'):
+         path = os.path.join(self.dir_, 'album.' + fmt)
+         serial.save(self.data, path, fmt)
+         with stats.collect() as st:
+            data = serial.load(path)
+            self.assertEqual( data.getToc(), toc )
+         self.assertFalse( 'files_probed' in st.counters )
+         self.assertEqual( data.files, self.data.files )
+         self.assertTrue( data.disc.is_multisession )
+
+   def testFormat(self):
+      """The format must follow the file name, and the binary format must
+      be the smaller one."""
+      path = os.path.join(self.dir_, 'album.json')
+      serial.save(self.data, path)
+      with open(path) as fh:
+         self.assertEqual( json.load(fh)['version'], serial.FORMAT_VERSION )
+      self.assertTrue( len(serial.dumps(self.data)) <
+                       len(serial.dumps(self.data, 'json')) )
+
+   def testMetadataOnly(self):
+      """Unresolved and removed index values must be kept."""
+      with open(self.album.cue) as fh:
+         data = CueParser('/nonexistent', resolve_audio=False).parse(fh)
+      buf = serial.dumps(data)
+      self.assertEqual( serial.loads(buf, check=False).getToc(),
+                        data.getToc() )
+
+   def testStale(self):
+      """A changed WAV file must be reported."""
+      buf = serial.dumps(self.data)
+      f = self.data.files[1]
+      with open(f, 'ab') as fh:
+         fh.write(b'\0' * 4)
+      try:
+         serial.loads(buf)
+      except serial.StaleDataError as e:
+         self.assertEqual( e.files, [f] )
+      else:
+         self.fail('StaleDataError not raised')
+      self.assertTrue( serial.loads(buf, check=False) )
+
+   def testInvalid(self):
+      """Unknown, truncated or newer data must raise SerialError."""
+      buf = serial.dumps(self.data)
+      self.assertRaises( serial.SerialError, serial.loads, buf[:-3] )
+      self.assertRaises( serial.SerialError, serial.loads, b'garbage' )
+      self.assertRaises( serial.SerialError, serial.loads,
+                         buf[:4] + b'\xff\xff' + buf[6:] )
+      self.assertRaises( serial.SerialError, serial.loads,
+                         json.dumps({'version':99}).encode() )
+
+
+##############################################################################
+if __name__ == '__main__':
+   """Execute all test cases define in this file."""
+   unittest.main()
@@ -0,0 +1,118 @@
+#  Copyright (c) 2011, Patrick C. McGinty
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the Simplified BSD License.
+#
+#  See LICENSE text for more details.
+"""
+   Unit testing framework for mktoc.stats module.
+"""
+
+import concurrent.futures
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from mktoc.base import *
+from mktoc import stats
+from mktoc.parser import *
+
+
+##############################################################################
+class StatsTests(unittest.TestCase):
+   """Unit tests for the stats collection functions."""
+   def testDisabledIsNoop(self):
+      """Counters and timers must be ignored when collection is disabled."""
+      self.assertTrue( stats.disable() is None )
+      stats.incr('x')
+      with stats.timer('phase'):
+         pass
+
+   def testCollect(self):
+      """Counters and timers must be recorded inside a collect block."""
+      with stats.collect() as st:
+         stats.incr('x', 3)
+         with stats.timer('phase'):
+            pass
+      stats.incr('x')      # disabled again
+      self.assertEqual( st.counters['x'], 3 )
+      self.assertEqual( st.timers['phase'][0], 1 )
+      data = json.loads( st.to_json() )
+      self.assertEqual( data['counters'], {'x':3} )
+
+   def testHooks(self):
+      """Hooks must be called on phase enter and exit."""
+      events = []
+      st = stats.Stats()
+      st.add_hook( lambda e,p,t: events.append((e,p)) )
+      with stats.collect(st):
+         with stats.timer('parse'):
+            pass
+      self.assertEqual( events, [('enter','parse'),('exit','parse')] )
+
+   def testParserInstrumented(self):
+      """Parsing a CUE sheet must record the parse phase and regex
+      counters."""
+      cue = ['FILE "track1.wav" WAVE', 'TRACK 01 AUDIO', 'INDEX 01 00:00:00']
+      with stats.collect() as st:
+         CueParser(find_wav=False).parse(cue)
+      self.assertTrue( 'parse' in st.timers )
+      self.assertTrue( st.counters['regex_lookups'] >= 3 )
+      self.assertEqual( st.counters['lookup_cache_misses'], 1 )
+
+
+def _work(n):
+   """Function profiled in a worker thread."""
+   return sum(range(n))
+
+
+class ProfilerTests(unittest.TestCase):
+   """Unit tests for the Profiler class."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def testCpu(self):
+      """The CPU profile must include worker threads, and be written in
+      pstats format."""
+      path = os.path.join(self.dir_, 'run.prof')
+      with stats.Profiler('cpu', path) as prof:
+         with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            list(pool.map(_work, [1000]*4))
+      funcs = [f for _,_,f in pstats.Stats(path).stats]
+      self.assertTrue( '_work' in funcs )
+      self.assertTrue( 'function calls' in prof.report() )
+      self.assertTrue( stats.disable() is None )
+
+   def testMem(self):
+      """Allocations must be reported for each phase, outer phases
+      including the inner ones."""
+      with stats.collect() as st:
+         with stats.Profiler('mem') as prof:
+            with stats.timer('parse'):
+               with stats.timer('lookup'):
+                  data = [bytearray(1000) for i in range(100)]
+      self.assertTrue( stats._active is None )
+      self.assertEqual( list(prof.phases), ['lookup', 'parse'] )
+      for phase in ('lookup', 'parse'):
+         self.assertTrue( prof.phases[phase]['size'] >= 100000 )
+         self.assertTrue( prof.phases[phase]['peak'] >= 100000 )
+      line = prof.phases['lookup']['lines'].most_common(1)[0][0]
+      self.assertTrue( line.startswith(__file__.rstrip('c')) )
+      self.assertTrue( 'top allocations of lookup:' in prof.report() )
+      self.assertEqual( st.timers['parse'][0], 1 )
+
+   def testMode(self):
+      """Unknown modes must be rejected."""
+      self.assertRaises( ValueError, stats.Profiler, 'io' )
+
+
+##############################################################################
+if __name__ == '__main__':
+   """Execute all test cases define in this file."""
+   unittest.main()
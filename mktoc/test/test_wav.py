@@ -8,14 +8,25 @@
    Unit testing framework for mktoc_wav module.
 """
 
+import errno
 import os
+import shutil
+import stat
+import struct
 import sys
+import tempfile
+import threading
 import unittest
 import inspect
+import wave
+import zlib
+from mock import patch
 
 from mktoc.base import *
 from mktoc.wav  import *
 from mktoc import progress_bar as mt_pb
+from mktoc import stats
+from mktoc import wav as wav_mod
 
 
 ##############################################################################
@@ -103,13 +114,763 @@ class WavFileCacheTests(unittest.TestCase):
 
 
 ##############################################################################
-class WavOffsetWriterTest(unittest.TestCase):
+class WavScanCacheTests(unittest.TestCase):
+   """Unit tests of the directory scans shared by WavFileCache objects."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      os.mkdir( os.path.join(self.dir_, 'sub') )
+      for f in ('alpha.wav', 'beta.txt', os.path.join('sub','gamma.wav')):
+         open(os.path.join(self.dir_, f), 'wb').close()
+      self.scans = WavScanCache()
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def testShared(self):
+      """File caches of one directory, under any name, must share a single
+      scan and return paths under their own name."""
+      rel = os.path.relpath(self.dir_)
+      with stats.collect() as st:
+         a = WavFileCache(self.dir_, self.scans)
+         b = WavFileCache(rel + os.sep, self.scans)
+         self.assertEqual( a('gamma.wav'),
+                           os.path.join(self.dir_, 'sub', 'gamma.wav') )
+         self.assertEqual( b('gamma.wav'),
+                           os.path.join(rel+os.sep, 'sub', 'gamma.wav') )
+      self.assertEqual( st.counters['dirs_scanned'], 2 )
+      self.assertEqual( st.counters['scan_cache_hits'], 1 )
+
+   def testInvalidate(self):
+      """A change in a scanned directory must cause a new scan."""
+      self.assertEqual( len(self.scans(self.dir_)), 2 )
+      open(os.path.join(self.dir_, 'sub', 'delta.wav'), 'wb').close()
+      self.assertEqual( len(self.scans(self.dir_)), 3 )
+
+   def testEviction(self):
+      """The least recently used directory must be dropped first."""
+      scans = WavScanCache(max_entries=2)
+      dirs = [os.path.join(self.dir_, d) for d in ('x','y','z')]
+      for d in dirs:
+         os.mkdir(d)
+      scans(dirs[0]); scans(dirs[1]); scans(dirs[0]); scans(dirs[2])
+      self.assertEqual( len(scans), 2 )
+      self.assertEqual( list(scans._scans),
+                        [os.path.realpath(d) for d in (dirs[0],dirs[2])] )
+      scans = WavScanCache(max_bytes=1)
+      scans(self.dir_); scans(dirs[0])
+      self.assertEqual( len(scans), 1 )
+
+   def testThreads(self):
+      """Concurrent lookups of one directory must scan it once."""
+      with stats.collect() as st:
+         threads = [threading.Thread(target=self.scans, args=(self.dir_,))
+                        for i in range(8)]
+         for t in threads: t.start()
+         for t in threads: t.join()
+      self.assertEqual( st.counters['dirs_scanned'], 2 )
+
+
+class WavLengthResolverTests(unittest.TestCase):
+   """Unit tests of the stat only WAV header reads."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      self.lengths = WavLengthResolver()
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def _wav(self, name, frames, extra=b''):
+      """Write a WAV file of *frames* CD frames, with an *extra* chunk
+      before the data chunk."""
+      path = os.path.join(self.dir_, name)
+      hdr = wav_header(2, 2, 44100, frames*588)
+      if extra:
+         hdr = (hdr[:4] + struct.pack('<I', 36 + len(extra) + frames*2352) +
+                hdr[8:36] + extra + hdr[36:])
+      with open(path, 'wb') as fh:
+         fh.write(hdr)
+         fh.truncate( len(hdr) + frames*2352 )
+      return path
+
+   def _check(self, files):
+      with stats.collect() as st:
+         hdrs = self.lengths.headers(files)
+      for f in files:
+         self.assertEqual( hdrs[f], read_header(f) )
+      return st.counters
+
+   def testCanonical(self):
+      """Only the first file of a canonical directory must be read."""
+      files = [self._wav('%d.wav' % i, 75+i) for i in range(5)]
+      counters = self._check(files)
+      self.assertEqual( counters['files_probed'], 1 )
+      self.assertEqual( counters['lengths_from_size'], 4 )
+      self.assertEqual( self._check(files)['lengths_from_size'], 5 )
+
+   def testNotCanonical(self):
+      """Files with other chunks, or not whole CD frames, must be read."""
+      files = [self._wav('%d.wav' % i, 75, b'LIST\4\0\0\0abcd')
+                  for i in range(3)]
+      self.assertEqual( self._check(files)['files_probed'], 3 )
+      self.lengths.clear()
+      odd = os.path.join(self.dir_, 'odd.wav')
+      with open(odd, 'wb') as fh:
+         fh.write( wav_header(2, 2, 44100, 1000) + b'\0'*4000 )
+      files = [odd, self._wav('a.wav', 75), self._wav('b.wav', 75)]
+      counters = self._check(files)
+      self.assertEqual( counters['files_probed'], 2 )
+      self.assertEqual( counters['lengths_from_size'], 1 )
+
+   def testInvalidate(self):
+      """A directory must be checked again after it is modified."""
+      files = [self._wav('%d.wav' % i, 75) for i in range(2)]
+      self._check(files)
+      # a chunk of one CD frame keeps the size of whole CD frames
+      self._wav('0.wav', 75, b'LIST' + struct.pack('<I', 2344) + b'\0'*2344)
+      os.utime(self.dir_, ns=(0, 0))
+      self.assertEqual( self._check(files)['files_probed'], 2 )
+      self.assertEqual( self.lengths(os.path.join(self.dir_, 'x.wav')),
+                        None )
+
+
+##############################################################################
+class _WavDataTest(unittest.TestCase):
+   """Base class for tests that need a set of small WAV files. Every stereo
+   frame in the files stores its position in the whole set, so the expected
+   content of any shifted output can be computed."""
+   _LENGTHS = [1000, 10, 2500]
+
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      self.files = []
+      self.total = sum(self._LENGTHS)
+      pos = 0
+      for i,n in enumerate(self._LENGTHS):
+         f = os.path.join(self.dir_, 'track%d.wav' % i)
+         w = wave.open(f,'w')
+         w.setparams((2,2,44100,0,'NONE','not compressed'))
+         w.writeframes( self._frames(pos, pos+n) )
+         w.close()
+         self.files.append(f)
+         pos += n
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def _frames(self, start, stop):
+      """Return the PCM data of frame positions [start,stop) of the set;
+      positions outside of the set are silence."""
+      return b''.join( struct.pack('<hh', p % 32768, p // 32768)
+                       if 0 <= p < self.total else b'\x00'*4
+                       for p in range(start,stop) )
+
+   def _read(self, f):
+      w = wave.open(f)
+      data = w.readframes(w.getnframes())
+      w.close()
+      return data
+
+
+##############################################################################
+class WavHeaderTests(_WavDataTest):
+   """Unit tests for the WAV header functions."""
+   def testReadHeader(self):
+      """Header of a file written by the wave module must be read."""
+      hdr = read_header(self.files[0])
+      self.assertEqual( (hdr.nchannels, hdr.sampwidth, hdr.framerate),
+                        (2, 2, 44100) )
+      self.assertEqual( hdr.nframes, self._LENGTHS[0] )
+      self.assertEqual( hdr.data_offset, 44 )
+
+   def testHeaderRoundTrip(self):
+      """A written header must be read back with the same values."""
+      f = os.path.join(self.dir_, 'hdr.wav')
+      with open(f,'wb') as fh:
+         fh.write( wav_header(1, 2, 48000, 10) + b'\x00'*20 )
+      self.assertEqual( read_header(f), WavHeader(1, 2, 48000, 10, 44, 20) )
+      self.assertEqual( wave.open(f).getnframes(), 10 )
+
+   def testNotWav(self):
+      """A file without a RIFF header must raise an exception."""
+      f = os.path.join(self.dir_, 'bad.wav')
+      with open(f,'wb') as fh:
+         fh.write(b'x'*100)
+      self.assertRaises( MkTocError, read_header, f )
+
+   def testBadFormat(self):
+      """A short format chunk or zero channels must raise an exception."""
+      f = os.path.join(self.dir_, 'bad.wav')
+      good = wav_header(2, 2, 44100, 0)
+      for hdr in [ good[:16] + struct.pack('<I', 8) + good[20:28] +
+                     b'data' + struct.pack('<I', 0),
+                   wav_header(0, 2, 44100, 0),
+                   wav_header(2, 0, 44100, 0) ]:
+         with open(f,'wb') as fh:
+            fh.write(hdr)
+         self.assertRaises( MkTocError, read_header, f )
+
+
+##############################################################################
+class DiscStreamTests(_WavDataTest):
+   """Unit tests for the DiscStream class."""
+   def testLength(self):
+      """Stream length must be the sum of the file lengths."""
+      with DiscStream(self.files) as ds:
+         self.assertEqual( ds.nframes, self.total )
+         self.assertEqual( ds.starts, [0, 1000, 1010] )
+
+   def testReadAcrossFiles(self):
+      """A read must continue into the next files."""
+      with DiscStream(self.files) as ds:
+         ds.seek(990)
+         self.assertEqual( ds.read(100), self._frames(990,1090) )
+         self.assertEqual( ds.tell(), 1090 )
+
+   def testReadAtEnd(self):
+      """A read must stop at the end of the stream."""
+      with DiscStream(self.files) as ds:
+         ds.seek(self.total-5)
+         self.assertEqual( len(ds.read(100)), 5*4 )
+         self.assertEqual( ds.read(100), b'' )
+
+
+##############################################################################
+class IoPolicyTests(_WavDataTest):
+   """Unit tests of the IoPolicy input and output files."""
+   def testUnknownMode(self):
+      self.assertRaises(ValueError, IoPolicy, 'fast')
+
+   def testStreamRead(self):
+      """DiscStream must return the same data with each policy."""
+      for mode in IoPolicy.MODES:
+         with DiscStream(self.files, IoPolicy(mode, sync_size=1000)) as ds:
+            ds.seek(900)
+            self.assertEqual(ds.read(200), self._frames(900, 1100))
+
+   def testDirectUnalignedRead(self):
+      """Direct reads from unaligned offsets must match buffered reads."""
+      with open(self.files[2], 'rb') as fh:
+         data = fh.read()
+      try:
+         fh = IoPolicy('direct').open_input(self.files[2])
+      except OSError:
+         self.skipTest('O_DIRECT not supported')
+      try:
+         for pos,n in [(44, 5000), (4095, 3), (9000, 20000)]:
+            buf = bytearray(n)
+            fh.seek(pos)
+            got = fh.readinto(buf)
+            self.assertEqual(bytes(buf[:got]), data[pos:pos+n])
+      finally:
+         fh.close()
+
+   def testTruncatedData(self):
+      """A data chunk shorter than its header size must raise an exception
+      with every policy."""
+      with open(self.files[2], 'r+b') as fh:
+         fh.truncate(44 + 1000*4)
+      for mode in IoPolicy.MODES:
+         writer = WavOffsetWriter(5, policy=IoPolicy(mode))
+         self.assertRaises( MkTocError, writer, self.files, False )
+
+   def testNoCacheOutput(self):
+      """Output files must hold all written data after close."""
+      path = os.path.join(self.dir_, 'out.bin')
+      fh = IoPolicy('nocache', sync_size=100).open_output(path)
+      for i in range(10):
+         fh.write(b'x' * 77)
+      fh.close()
+      self.assertEqual(os.path.getsize(path), 770)
+
+
+##############################################################################
+class WavOffsetWriterTest(_WavDataTest):
    """Unit tests for the external interface of the WavOffsetWriter class."""
    def testInitClass(self):
       """WavOffsetWriter class must initialize correctly."""
-      wow = WavOffsetWriter(10, mt_pb.ProgressBar, ('test message',))
+      wow = WavOffsetWriter(10, mt_pb.Progress())
       self.assertTrue(wow)
 
+   def testPositiveOffset(self):
+      """Positive offsets must insert silence at the start of the set."""
+      self._check_offset(30)
+
+   def testNegativeOffset(self):
+      """Negative offsets must append silence at the end of the set."""
+      self._check_offset(-30)
+
+   def testOffsetLongerThanFile(self):
+      """An offset must be able to span a complete file."""
+      self._check_offset(-1200)
+
+   def testSmallCopyBuffer(self):
+      """A copy buffer smaller than the offset and the files must give the
+      same result."""
+      self._check_offset(30, 64)
+      self._check_offset(-30, 6)
+
+   def testBufferSmallerThanFrame(self):
+      """A copy buffer smaller than one frame must still copy the audio."""
+      for size in [1, 2, 3]:
+         self._check_offset(10, size)
+         shutil.rmtree(os.path.join(self.dir_, 'wav+10'))
+
+   def testFifo(self):
+      """FIFO mode must stream the shifted audio, and resend a file after a
+      reader closed it early."""
+      writer = WavOffsetWriter(-30, fifo=True)
+      out = writer(self.files, False)
+      self.assertTrue( all(stat.S_ISFIFO(os.stat(f).st_mode) for f in out) )
+      server = threading.Thread(target=writer.serve)
+      server.start()
+      # read only the header of the last file, like a header probe
+      with open(out[-1], 'rb') as fh:
+         fh.read(44)
+      pos = 30
+      for f,n in zip(out, self._LENGTHS):
+         with open(f, 'rb') as fh:
+            data = fh.read()
+         self.assertEqual( data[44:], self._frames(pos, pos+n) )
+         pos += n
+      server.join(10)
+      self.assertFalse( server.is_alive() )
+      self.assertFalse( any(map(os.path.exists, out)) )
+
+   def testResumeSkipsDoneOutputs(self):
+      """A second run must only write missing or changed outputs."""
+      self._check_offset(30)
+      out_dir = os.path.join(self.dir_, 'wav+30')
+      os.remove( os.path.join(out_dir, 'track1.wav') )
+      with stats.collect() as st:
+         self._check_offset(30)
+      self.assertEqual( st.counters['outputs_skipped'], 2 )
+      self.assertFalse( [f for f in os.listdir(out_dir)
+                           if f.endswith('.part')] )
+
+   def testChangedInputRewrites(self):
+      """A changed input must make all outputs stale."""
+      self._check_offset(30, hash_inputs=True)
+      st = os.stat(self.files[1])
+      with open(self.files[1], 'r+b') as fh:
+         fh.seek(50)
+         fh.write(b'\x01')
+      os.utime(self.files[1], ns=(st.st_atime_ns, st.st_mtime_ns))
+      with stats.collect() as st:
+         out = WavOffsetWriter(30, hash_inputs=True)(self.files, False)
+      self.assertEqual( st.counters['outputs_skipped'], 0 )
+
+   def testChecksums(self):
+      """CRCs of the inputs and outputs must be computed in the copy loop."""
+      for offset in [30, -30]:
+         writer = WavOffsetWriter(offset, checksum=True)
+         out = writer(self.files, True)
+         expect = [ (zlib.crc32(self._read(a)), zlib.crc32(self._read(b)))
+                    for a,b in zip(self.files, out) ]
+         self.assertEqual( writer.checksums, expect )
+         shutil.rmtree(os.path.dirname(out[0]))
+
+   def testNoFiles(self):
+      """An empty file list must return an empty list."""
+      self.assertEqual( WavOffsetWriter(10)([], False), [] )
+
+   def testIoPolicies(self):
+      """All page cache policies must give the same result."""
+      for mode in IoPolicy.MODES:
+         self._check_offset(30, 64, IoPolicy(mode, sync_size=1000))
+         shutil.rmtree(os.path.join(self.dir_, 'wav+30'))
+
+   def _check_offset(self, offset, buf_size=None, policy=None, **kwargs):
+      out = WavOffsetWriter( offset, buf_size=buf_size, policy=policy,
+                             **kwargs )(self.files, False)
+      self.assertEqual( os.path.dirname(out[0]),
+                        os.path.join(self.dir_, 'wav%+d' % offset) )
+      pos = -offset
+      for f,n in zip(out, self._LENGTHS):
+         self.assertEqual( self._read(f), self._frames(pos, pos+n) )
+         pos += n
+
+
+##############################################################################
+class InPlaceOffsetWriterTest(_WavDataTest):
+   """Unit tests for the InPlaceOffsetWriter class."""
+   def testPositiveOffset(self):
+      self._check_offset(30)
+
+   def testNegativeOffset(self):
+      self._check_offset(-30)
+
+   def testOffsetLongerThanFile(self):
+      self._check_offset(-1200, 64)
+      self.tearDown()
+      self.setUp()
+      self._check_offset(1200, 64)
+
+   def testResume(self):
+      """A run interrupted inside of a chunk write must be resumed."""
+      for offset in [30, -30]:
+         self._crash(offset, 20)
+         self.assertTrue( os.path.exists(self._journal()) )
+         self._check_offset(offset, 64)
+         self.tearDown()
+         self.setUp()
+
+   def testRollback(self):
+      """An interrupted run must be rolled back to the original data."""
+      for offset in [30, -30, 1200]:
+         orig = list(map(self._read, self.files))
+         self._crash(offset, 20)
+         InPlaceOffsetWriter(offset, buf_size=64).rollback(self.files)
+         self.assertEqual( list(map(self._read, self.files)), orig )
+         self.assertFalse( os.path.exists(self._journal()) )
+
+   def testOtherOffsetJournal(self):
+      """A journal of a different offset must not be resumed."""
+      self._crash(30, 5)
+      self.assertRaises( MkTocError, InPlaceOffsetWriter(-30), self.files )
+
+   def _journal(self):
+      return os.path.join(self.dir_, InPlaceOffsetWriter.JOURNAL)
+
+   def _crash(self, offset, count):
+      """Run the writer, and write half of chunk number 'count' before an
+      exception is raised."""
+      write = wav_mod._DiscFile.write
+      calls = []
+      def crash(disc, pos, data):
+         calls.append(pos)
+         if len(calls) == count:
+            write(disc, pos, b'\xff' * (len(data) // 8 * 4))
+            raise KeyboardInterrupt
+         write(disc, pos, data)
+      with patch.object(wav_mod._DiscFile, 'write', crash):
+         self.assertRaises( KeyboardInterrupt,
+                            InPlaceOffsetWriter(offset, buf_size=64),
+                            self.files )
+
+   def _check_offset(self, offset, buf_size=None):
+      out = InPlaceOffsetWriter(offset, buf_size=buf_size)(self.files)
+      self.assertEqual( out, self.files )
+      pos = -offset
+      for f,n in zip(out, self._LENGTHS):
+         self.assertEqual( self._read(f), self._frames(pos, pos+n) )
+         pos += n
+      self.assertFalse( os.path.exists(self._journal()) )
+
+
+##############################################################################
+class ImageWriterTests(_WavDataTest):
+   """Unit tests for the ImageWriter class."""
+   def testImage(self):
+      """The image must hold the shifted audio of all files."""
+      for offset in [0, 30, -30, -1500, 5000]:
+         self._check_image(offset)
+
+   def testFallback(self):
+      """Without copy_file_range support the data must be copied."""
+      err = OSError(errno.EXDEV, 'cross-device link')
+      with patch.object(os, 'copy_file_range', side_effect=err, create=True):
+         self._check_image(7)
+
+   def testTruncated(self):
+      """Data missing from a truncated file must be silence."""
+      with open(self.files[2], 'r+b') as fh:
+         fh.truncate(44 + 4*100)
+      path = os.path.join(self.dir_, 'image.wav')
+      ImageWriter()(self.files, path)
+      self.assertEqual( self._read(path),
+                        self._frames(0, 1110) + b'\x00'*4*2400 )
+
+   def _check_image(self, offset):
+      path = os.path.join(self.dir_, 'image.wav')
+      starts = ImageWriter(offset, buf_size=64)(self.files, path)
+      self.assertEqual( starts, [0, 1000, 1010] )
+      self.assertEqual( self._read(path),
+                        self._frames(-offset, self.total - offset) )
+      self.assertFalse( os.path.exists(path + '.part') )
+
+
+##############################################################################
+class TrackSplitterTests(_WavDataTest):
+   """Unit tests for the TrackSplitter class."""
+   def testSplit(self):
+      """Each output must hold its range of the stream, also across the
+      input files."""
+      ranges = [(0, 600), (600, 1005), (1005, 1400), (1400, self.total)]
+      paths = [os.path.join(self.dir_, 'out%d.wav' % i) for i in range(4)]
+      TrackSplitter(buf_size=64, workers=2)(self.files, ranges, paths)
+      for (start,end),path in zip(ranges, paths):
+         self.assertEqual( self._read(path), self._frames(start, end) )
+         self.assertFalse( os.path.exists(path + '.part') )
+
+
+##############################################################################
+class MappedWavTests(_WavDataTest):
+   """Unit tests for the MappedWav class."""
+   _LENGTHS = [588*3 + 100, 10]
+
+   def testSamples(self):
+      """The sample view must hold the audio data of the file."""
+      with MappedWav(self.files[0]) as mw:
+         self.assertEqual( mw.nframes, self._LENGTHS[0] )
+         self.assertEqual( mw.samples.shape, (self._LENGTHS[0], 2) )
+         self.assertEqual( bytes(mw.data), self._frames(0, self._LENGTHS[0]) )
+         self.assertEqual( mw.samples[5:7].tobytes(), self._frames(5, 7) )
+
+   def testFrames(self):
+      """CD frame slices must cover 588 samples each, and the last frame
+      can be partial."""
+      with MappedWav(self.files[0]) as mw:
+         self.assertEqual( len(mw.frames), 4 )
+         self.assertEqual( mw.frames[1:3].tobytes(),
+                           self._frames(588, 588*3) )
+         self.assertEqual( len(mw.frames[-1]), 100 )
+         self.assertEqual( len(mw.frames[2:]), 688 )
+         self.assertRaises( IndexError, mw.frames.__getitem__, 4 )
+
+   def testZeroCopy(self):
+      """Views must share the memory of the map."""
+      with MappedWav(self.files[0]) as mw:
+         view = mw.frames[0:1]
+         self.assertFalse( view.flags.owndata )
+         self.assertFalse( view.flags.writeable )
+         del view
+
+   def testViewAfterClose(self):
+      """Closing with a view in use must not fail, and the view must stay
+      valid."""
+      mw = MappedWav(self.files[0])
+      view = mw.samples[:10]
+      mw.close()
+      self.assertEqual( view.tobytes(), self._frames(0, 10) )
+
+   def testTruncated(self):
+      """A truncated file must only expose the complete frames."""
+      with open(self.files[1], 'r+b') as fh:
+         fh.truncate(44 + 4*6 + 2)
+      with MappedWav(self.files[1]) as mw:
+         self.assertEqual( mw.nframes, 6 )
+         self.assertEqual( len(mw.samples), 6 )
+
+
+##############################################################################
+class AccurateRipTests(_WavDataTest):
+   """Unit tests for the AccurateRip class, compared to a sample by sample
+   computation of the checksums."""
+   _LENGTHS = [7000, 300, 9000]
+
+   def _frames(self, start, stop):
+      """Return frames with all 32 bits in use, so the v1 and v2 checksums
+      differ."""
+      return b''.join( struct.pack('<I', p * 2654435761 & 0xFFFFFFFF)
+                       if 0 <= p < self.total else b'\x00'*4
+                       for p in range(start,stop) )
+
+   def _reference(self, tracks, offset):
+      """Return the (v1,v2) checksums of each track, a sample at a time."""
+      out = []
+      for num,(start,end) in enumerate(tracks):
+         data = self._frames(start + offset, end + offset)
+         v1 = v2 = 0
+         for i,(s,) in enumerate(struct.iter_unpack('<I', data)):
+            mult = i + 1
+            if num == 0 and mult < 2940: continue
+            if num == len(tracks)-1 and mult > end - start - 2940: continue
+            prod = s * mult
+            v1 += prod & 0xFFFFFFFF
+            v2 += (prod & 0xFFFFFFFF) + (prod >> 32)
+         out.append( (v1 & 0xFFFFFFFF, v2 & 0xFFFFFFFF) )
+      return out
+
+   def testChecksums(self):
+      """Checksums at several read offsets must match the reference."""
+      ar = AccurateRip(self.files)
+      self.assertEqual( ar.tracks, [(0,7000), (7000,7300), (7300,16300)] )
+      for offset in [0, 7, -300, 2941]:
+         self.assertEqual( ar.checksums(offset),
+                           self._reference(ar.tracks, offset) )
+      ar.close()
+
+   def testScan(self):
+      """The batched offset scan must match the v1 checksum at each
+      offset, also for a track shorter than the window."""
+      ar = AccurateRip(self.files)
+      scan = ar.scan(400)
+      for offset in [-400, -151, 0, 1, 399, 400]:
+         self.assertEqual( [trk[offset+400] for trk in scan],
+                           [v1 for v1,v2 in ar.checksums(offset)] )
+      ar.close()
+
+   def testVerify(self):
+      """A response file must be matched at the read offset of its
+      checksums."""
+      ar = AccurateRip(self.files, starts=[0, 5000])
+      v1 = [a for a,b in ar.checksums(-20)]
+      v2 = [b for a,b in ar.checksums(0)]
+      f = os.path.join(self.dir_, 'dBAR-002.bin')
+      with open(f,'wb') as fh:
+         for conf,crcs in [(5,v1), (9,v2)]:
+            fh.write( struct.pack('<BIII', 2, 1, 2, 3) )
+            for crc in crcs:
+               fh.write( struct.pack('<BII', conf, crc, 0) )
+      entries = read_accuraterip(f)
+      self.assertEqual( [e.tracks[0][0] for e in entries], [5, 9] )
+      res = ar.verify(entries, window=50)
+      ar.close()
+      self.assertEqual( [r['matches'] for r in res],
+                        [[(0, 2, 9), (-20, 1, 5)]] * 2 )
+
+   def testTruncatedResponse(self):
+      """A truncated response file must raise an exception."""
+      f = os.path.join(self.dir_, 'dBAR-bad.bin')
+      with open(f,'wb') as fh:
+         fh.write( struct.pack('<BIII', 2, 1, 2, 3) + b'\x00'*9 )
+      self.assertRaises( MkTocError, read_accuraterip, f )
+
+   def testFormat(self):
+      """Audio that is not 16-bit stereo must raise an exception."""
+      f = os.path.join(self.dir_, 'mono.wav')
+      with open(f,'wb') as fh:
+         fh.write( wav_header(1, 2, 44100, 10) + b'\x00'*20 )
+      self.assertRaises( MkTocError, AccurateRip, [f] )
+
+
+##############################################################################
+class FindSilenceTests(unittest.TestCase):
+   """Unit tests for the find_silence function."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def _wav(self, data, channels=2, width=2):
+      f = os.path.join(self.dir_, 'sil.wav')
+      with open(f,'wb') as fh:
+         n = len(data) // (channels * width)
+         fh.write( wav_header(channels, width, 44100, n) + data )
+      return f
+
+   def testSilence(self):
+      """Silence must be rounded down to whole CD frames; one channel with
+      sound is not silent."""
+      data = b'\x00'*4*(3*588 + 10) + b'\x00\x00\x01\x00' + \
+             b'\x00'*4*(2*588 - 1)
+      self.assertEqual( find_silence(self._wav(data)), (3, 1) )
+
+   def testThreshold(self):
+      """Samples within the threshold must be silence."""
+      low = struct.pack('<hh', -3, 3) * 588
+      data = low * 4 + struct.pack('<hh', -4, 0) + low * 2
+      self.assertEqual( find_silence(self._wav(data)), (0, 0) )
+      self.assertEqual( find_silence(self._wav(data), threshold=3), (4, 2) )
+
+   def testLongSilence(self):
+      """Silence longer than the first scan blocks must be found."""
+      data = b'\x00'*4*(588*300) + b'\x01\x00'*2 + b'\x00'*4*588
+      self.assertEqual( find_silence(self._wav(data)), (300, 1) )
+
+   def testAllSilent(self):
+      """A silent or empty file must have no leading or trailing silence."""
+      self.assertEqual( find_silence(self._wav(b'\x00'*4*588*3)), (0, 0) )
+      self.assertEqual( find_silence(self._wav(b'')), (0, 0) )
+
+   def testFormat(self):
+      """Audio that is not 16-bit must raise an exception."""
+      f = self._wav(b'\x00'*6*10, width=3)
+      self.assertRaises( MkTocError, find_silence, f )
+
+
+##############################################################################
+class CddaConverterTests(unittest.TestCase):
+   """Unit tests for the CddaConverter class."""
+   def setUp(self):
+      self.dir_ = tempfile.mkdtemp(prefix='mktoc-test.')
+      self.np = wav_mod._numpy()
+
+   def tearDown(self):
+      shutil.rmtree(self.dir_)
+
+   def _sine(self, name, rate, width, channels, nframes, freq=1000.0):
+      """Write a half scale sine wave in all channels."""
+      np = self.np
+      t = np.arange(nframes) / float(rate)
+      full = 2 ** (width*8 - 1) - 1
+      val = np.rint(0.5 * full * np.sin(2 * np.pi * freq * t))
+      val = np.repeat(val[:,None], channels, axis=1).astype('<i4')
+      if width == 1:
+         data = (val + 128).astype('u1').tobytes()
+      elif width == 2:
+         data = val.astype('<i2').tobytes()
+      elif width == 3:
+         data = val.view(np.uint8).reshape(-1, channels, 4)[...,:3].tobytes()
+      else:
+         data = val.tobytes()
+      f = os.path.join(self.dir_, name)
+      with open(f,'wb') as fh:
+         fh.write( wav_header(channels, width, rate, nframes) + data )
+      return f
+
+   def _error(self, f, freq=1000.0):
+      """Return the RMS difference in dB between the left channel of 'f' and
+      the expected sine wave, without the filter edges."""
+      np = self.np
+      with MappedWav(f) as mw:
+         x = mw.samples[:,0] / 32768.0
+      ref = 0.5 * np.sin(2 * np.pi * freq * np.arange(len(x)) / 44100.0)
+      err = (x - ref)[100:-100]
+      return 20 * np.log10(np.sqrt(np.mean(err ** 2)))
+
+   def testCddaNotCopied(self):
+      """CD-DA files must not be converted."""
+      f = self._sine('cd.wav', 44100, 2, 2, 1000)
+      self.assertEqual( CddaConverter()([f]), [f] )
+      self.assertFalse( os.path.exists(os.path.join(self.dir_, 'cdda')) )
+
+   def testResample(self):
+      """Resampled audio must keep its timing, with an error close to the
+      16-bit noise floor, and the duration must be kept."""
+      files = [ self._sine('a.wav', 96000, 3, 2, 96000),
+                self._sine('b.wav', 48000, 2, 2, 24000),
+                self._sine('c.wav', 88200, 4, 2, 44100) ]
+      out = CddaConverter(workers=2)(files)
+      self.assertEqual( out, [os.path.join(self.dir_, 'cdda', n)
+                              for n in ['a.wav', 'b.wav', 'c.wav']] )
+      for f,n in zip(out, [44100, 22050, 22050]):
+         hdr = read_header(f)
+         self.assertTrue( CddaConverter.is_cdda(hdr) )
+         self.assertEqual( hdr.nframes, n )
+         self.assertTrue( self._error(f) < -85 )
+
+   def testChannels(self):
+      """Mono audio must be copied to both channels, and multichannel audio
+      must keep the first two channels."""
+      mono = self._sine('mono.wav', 44100, 2, 1, 1000)
+      six = self._sine('six.wav', 44100, 2, 6, 1000)
+      out = CddaConverter()([mono, six])
+      for f,src in zip(out, [mono, six]):
+         with MappedWav(f) as cd, MappedWav(src) as mw:
+            self.assertEqual( cd.samples[:,0].tobytes(),
+                              mw.samples[:,0].tobytes() )
+            self.assertEqual( cd.samples[:,1].tobytes(),
+                              mw.samples[:,1 % mw.header.nchannels].tobytes() )
+
+   def testBitDepth(self):
+      """8-bit audio must be converted exactly, and 24-bit audio must be
+      dithered to 16 bits."""
+      f8 = self._sine('a.wav', 44100, 1, 2, 1000)
+      f24 = self._sine('b.wav', 44100, 3, 2, 44100)
+      out = CddaConverter(workers=1)([f8, f24])
+      with MappedWav(out[0]) as cd, MappedWav(f8) as mw:
+         self.assertEqual( cd.samples.tobytes(),
+               ((mw.samples.astype('<i2') - 128) * 256).tobytes() )
+      self.assertTrue( self._error(out[1]) < -90 )
+      # the dither is repeatable
+      with open(out[1],'rb') as fh:
+         first = fh.read()
+      CddaConverter(workers=1)([f24])
+      with open(out[1],'rb') as fh:
+         self.assertEqual( fh.read(), first )
+
 
 ##############################################################################
 if __name__ == '__main__':
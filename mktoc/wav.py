@@ -13,24 +13,55 @@
    The following are a list of the classes provided in this module:
 
    * :class:`WavFileCache`
+   * :class:`WavScanCache`
+   * :class:`WavHeader`
+   * :class:`WavLengthResolver`
+   * :class:`IoPolicy`
+   * :class:`DiscStream`
+   * :class:`CopyEngine`
    * :class:`WavOffsetWriter`
+   * :class:`InPlaceOffsetWriter`
+   * :class:`ImageWriter`
+   * :class:`TrackSplitter`
+   * :class:`MappedWav`
+   * :class:`CddaConverter`
+   * :class:`AccurateRip`
 """
 
+import bisect
+import collections
+import errno
+import functools
+import json
+import math
+import mmap
 import os
 import sys
 import re
-import wave
+import select
+import struct
 import tempfile
+import threading
+import zlib
 import logging
 import itertools as itr
 import operator as op
 
 from mktoc.base import *
+from mktoc import progress_bar as mt_pb
+from mktoc import stats
 
-__all__ = ['WavFileCache', 'WavOffsetWriter']
+__all__ = ['WavFileCache', 'WavScanCache', 'WavHeader', 'WavLengthResolver',
+           'IoPolicy', 'DiscStream', 'CopyEngine', 'WavOffsetWriter',
+           'InPlaceOffsetWriter', 'ImageWriter', 'TrackSplitter', 'MappedWav',
+           'CddaConverter', 'AccurateRip', 'AccurateRipEntry', 'find_silence',
+           'read_header', 'wav_header', 'read_accuraterip']
 
 log = logging.getLogger('mktoc.wav')
 
+# RIFF format tags of PCM audio
+_WAVE_FORMAT_PCM, _WAVE_FORMAT_EXT = 0x0001, 0xFFFE
+
 
 ##############################################################################
 class WavFileCache(object):
@@ -41,8 +72,14 @@ class WavFileCache(object):
    that the specified file can not be found. The files system is only scanned
    once, and all lookups after the initial test come from the cache. The cache
    size is limited to prevent over aggressive file system access.
+
+   Directory scans are shared through a :class:`WavScanCache`, so parsers of
+   several CUE files in one directory only scan it once.
    """
 
+   #: Process wide :class:`WavScanCache` used by default.
+   scans = None
+
    # list of WAV files found in the local file system.
    _data = None
 
@@ -53,7 +90,7 @@ class WavFileCache(object):
    # with the '.wav' extension.
    _WAV_REGEX = re.compile(r'\.wav$', re.IGNORECASE)
 
-   def __init__(self, _dir=os.curdir):
+   def __init__(self, _dir=os.curdir, scans=None):
       """
       Initialize the class instance with the input :attr:`_dir` argument. If no
       argument is supplied it defaults to the current working dir.
@@ -61,11 +98,17 @@ class WavFileCache(object):
       :param _dir:   Base path location to perform the WAV file search.
       :type _dir:    str
 
+      :param scans:  Cache of directory scans, default is the shared
+                     :attr:`scans` cache.
+      :type  scans:  :class:`WavScanCache`
+
       .. Docuemnt private members
       .. automethod:: __call__
       """
       assert(_dir)
       self._src_dir = _dir
+      if scans is not None:
+         self.scans = scans
 
    def __call__(self, file_):
       """
@@ -73,6 +116,23 @@ class WavFileCache(object):
       :attr:`file_` parameter. This method will always return the exact file
       name if it exists before attempting fuzzy matches.
 
+      :param file_:  File name to search for.
+      :type file_:   str
+      """
+      matches = self.candidates(file_)
+      if len(matches) == 1:   # success if ONE match is found
+         return matches[0]
+      elif len(matches) == 0:
+         raise FileNotFoundError(file_) # zero or multiple matches is an error
+      else:
+         raise TooManyFilesMatchError(file_, matches)
+
+   @stats.timed('lookup')
+   def candidates(self, file_):
+      """
+      Return all files that match the file name in :attr:`file_`, see
+      :meth:`__call__`. The list has only :attr:`file_` if it exists.
+
       :param file_:  File name to search for.
       :type file_:   str
       """
@@ -83,7 +143,7 @@ class WavFileCache(object):
       # base case: file exists, and is has a 'WAV' extension
       if self._WAV_REGEX.search(tmp_name) and os.path.exists(tmp_name):
          log.debug('-> FOUND\n'+'-'*5)
-         return file_       # return match
+         return [file_]     # return match
       # case 2: file is locatable in path by stripping directories
       fn = os.path.basename(tmp_name)     # strip leading path
       fn = os.path.splitext(fn)[0]        # strip extension
@@ -103,18 +163,16 @@ class WavFileCache(object):
       fn_pat = sep + '.*' + re.escape(fn_us) + '.*'
       fn_pats.append( fn_pat )
       file_regex = re.compile( '|'.join(set(fn_pats)), re.IGNORECASE)
-      # search all WAV files using pattern 'file_regex'
-      matchi = map( file_regex.search, self._get_cache() )
-      # create tuple with input file and search results
-      matches = zip( self._get_cache(), matchi )
-      matches = list(filter( op.itemgetter(1), matches ))
-      if len(matches) == 1:   # success if ONE match is found
-         log.debug("--> FOUND '%s'" % matches[0][0])
-         return matches[0][0]
-      elif len(matches) == 0:
-         raise FileNotFoundError(file_) # zero or multiple matches is an error
-      else:
-         raise TooManyFilesMatchError(file_, [m[0] for m in matches])
+      # search all WAV files using pattern 'file_regex', only files that
+      # contain one of the names can match
+      stats.incr('regex_lookups', len(self._get_cache()))
+      keys = set(n.lower() for n in (fn, fn.replace(' ','_'),
+                                     fn.replace('_',' ')))
+      matches = [f for f in self._get_cache()
+                     if any(k in f.lower() for k in keys)
+                        and file_regex.search(f)]
+      log.debug("--> FOUND %s" % matches)
+      return matches
 
    def _get_cache(self):
       """
@@ -130,21 +188,932 @@ class WavFileCache(object):
       Create a list of WAV files in the vicinity of the current working dir.
       The list is store in the object member '_data'.
       """
-      self._data = []
-      fc = 0
       log.debug("Initializing file cache @ '%s'", self._src_dir)
-      for root, dirs, files in os.walk(self._src_dir):
-         if fc > 1000: break     # only cache first n files
-         fc += len(files)
-         f_tup = list(zip( [root]*len(files), files ))
-         wav_files = [os.path.join(r,f) for r,f in f_tup \
-                           if self._WAV_REGEX.search(f)]
-         self._data.extend( wav_files )
-      self._is_init = True
+      self._data = self.scans(self._src_dir)
       log.debug('-> Found %d files:' % len(self._data) )
       list(map( lambda f: log.debug('--> %s' % f), self._data ))
 
 
+##############################################################################
+class WavScanCache(object):
+   """
+   Thread-safe cache of the WAV files found below a directory, shared by
+   :class:`WavFileCache` objects.
+
+   Scans are keyed by the resolved directory path, and checked against the
+   modification times of the scanned directories before they are reused.
+   The least recently used scans are dropped when the cache holds more than
+   *max_entries* directories, or more than *max_bytes* of file names.
+   Concurrent requests for the same directory wait for one scan.
+   """
+
+   #: Maximum number of files scanned below one directory.
+   MAX_FILES = 1000
+
+   def __init__(self, max_entries=64, max_bytes=8<<20):
+      """
+      :param max_entries:  Maximum number of cached directories.
+      :type  max_entries:  int
+
+      :param max_bytes:    Maximum total size of the cached file names.
+      :type  max_bytes:    int
+
+      .. Document private members
+      .. automethod:: __call__
+      """
+      self.max_entries = max_entries
+      self.max_bytes = max_bytes
+      self._lock = threading.Lock()
+      # resolved dir -> (signature, [(sub dir, [file, ...]), ...], bytes)
+      self._scans = collections.OrderedDict()
+      self._dir_locks = {}    # resolved dir -> lock held while scanning
+      self._bytes = 0
+
+   def __call__(self, dir_):
+      """
+      Return the WAV files below *dir_*, as paths joined to *dir_*.
+
+      :param dir_:   Directory to search.
+      :type  dir_:   str
+      """
+      key = os.path.realpath(dir_)
+      with self._lock:
+         dir_lock = self._dir_locks.setdefault(key, threading.Lock())
+      with dir_lock:
+         with self._lock:
+            entry = self._scans.get(key)
+         if entry and self._is_current(key, entry[0]):
+            stats.incr('scan_cache_hits')
+            with self._lock:
+               if key in self._scans:
+                  self._scans.move_to_end(key)
+         else:
+            entry = self._scan(key)
+            self._store(key, entry)
+      return [os.path.join(dir_, sub, f) for sub,files in entry[1]
+                                         for f in files]
+
+   def clear(self):
+      """Remove all cached scans."""
+      with self._lock:
+         self._scans.clear()
+         self._bytes = 0
+
+   def __len__(self):
+      return len(self._scans)
+
+   def _is_current(self, key, signature):
+      """Return :data:`True` if no scanned directory was changed."""
+      try:
+         return all( os.stat(os.path.join(key,sub)).st_mtime_ns == mtime
+                        for sub,mtime in signature )
+      except OSError:
+         return False
+
+   @stats.timed('scan')
+   def _scan(self, key):
+      """Walk *key* and return a new cache entry."""
+      signature, found, size, fc = [], [], 0, 0
+      for root, dirs, files in os.walk(key):
+         if fc > self.MAX_FILES: break     # only cache first n files
+         stats.incr('dirs_scanned')
+         fc += len(files)
+         sub = root[len(key):].lstrip(os.sep)
+         try:
+            signature.append( (sub, os.stat(root).st_mtime_ns) )
+         except OSError:
+            continue
+         wav_files = [f for f in files if WavFileCache._WAV_REGEX.search(f)]
+         found.append( (sub, wav_files) )
+         size += len(sub) + sum(map(len, wav_files))
+      return (signature, found, size)
+
+   def _store(self, key, entry):
+      """Add *entry* and drop the least recently used scans."""
+      with self._lock:
+         old = self._scans.pop(key, None)
+         if old:
+            self._bytes -= old[2]
+         self._scans[key] = entry
+         self._bytes += entry[2]
+         while len(self._scans) > 1 and (len(self._scans) > self.max_entries
+                                          or self._bytes > self.max_bytes):
+            k,old = self._scans.popitem(last=False)
+            self._bytes -= old[2]
+            self._dir_locks.pop(k, None)
+            stats.incr('scan_cache_evictions')
+
+WavFileCache.scans = WavScanCache()
+
+
+##############################################################################
+class WavHeader(collections.namedtuple( 'WavHeader',
+      'nchannels sampwidth framerate nframes data_offset data_size' )):
+   """
+   Audio format and data chunk location of a PCM WAV file, as returned by
+   :func:`read_header`. The *nframes* value is calculated from the size of
+   the data chunk.
+   """
+   __slots__ = ()
+
+   @property
+   def frame_size(self):
+      """Number of bytes in one audio frame."""
+      return self.nchannels * self.sampwidth
+
+
+def read_header(file_):
+   """
+   Read the RIFF header of a PCM WAV file.
+
+   :param file_:  Path of a WAV file, or a binary file object positioned at
+                  the start of the file.
+   :type  file_:  str, :data:`file`
+
+   :rtype: :class:`WavHeader`
+   """
+   if isinstance(file_, str):
+      with open(file_,'rb') as fh:
+         return read_header(fh)
+   fh = file_
+   riff = fh.read(12)
+   if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:] != b'WAVE':
+      raise MkTocError('not a WAV file: %s' % getattr(fh,'name',''))
+   fmt = None
+   pos = 12
+   while True:
+      chunk = fh.read(8)
+      if len(chunk) < 8:
+         raise MkTocError('WAV data chunk not found: %s'
+                           % getattr(fh,'name',''))
+      name,size = struct.unpack('<4sI', chunk)
+      pos += 8
+      if name == b'fmt ':
+         if size < 16:
+            raise MkTocError('WAV format chunk is too short: %s'
+                              % getattr(fh,'name',''))
+         fmt = struct.unpack('<HHIIHH', fh.read(16))
+         fh.seek(pos + size + (size & 1))
+      elif name == b'data':
+         break
+      else:
+         fh.seek(pos + size + (size & 1))
+      pos += size + (size & 1)
+   if fmt is None or fmt[0] not in (_WAVE_FORMAT_PCM, _WAVE_FORMAT_EXT):
+      raise MkTocError('WAV file is not PCM audio: %s'
+                        % getattr(fh,'name',''))
+   tag,channels,rate,byte_rate,align,bits = fmt
+   if not (channels and bits and rate):
+      raise MkTocError('WAV file has an invalid sample format: %s'
+                        % getattr(fh,'name',''))
+   width = (bits + 7) // 8
+   return WavHeader( channels, width, rate, size // (channels*width),
+                     pos, size )
+
+
+def wav_header(nchannels, sampwidth, framerate, nframes):
+   """
+   Return a canonical 44 byte PCM WAV header.
+
+   :rtype: :class:`bytes`
+   """
+   align = nchannels * sampwidth
+   size = nframes * align
+   return struct.pack( '<4sI4s4sIHHIIHH4sI', b'RIFF', 36+size, b'WAVE',
+                       b'fmt ', 16, _WAVE_FORMAT_PCM, nchannels, framerate,
+                       framerate*align, align, sampwidth*8, b'data', size )
+
+
+class WavLengthResolver(object):
+   """
+   Thread-safe reader of WAV headers, that avoids opening the files of
+   directories ripped with canonical headers.
+
+   Most rippers write the canonical 44 byte CD-DA header of
+   :func:`wav_header`, with no other chunks. When the first file read in a
+   directory has this header, the directory is marked as canonical, and the
+   header of the other files in it is computed from their size, without
+   opening them. A file whose data size is not a whole number of CD frames
+   is read as usual, as are all files of other directories. A mark is
+   dropped when its directory is modified.
+   """
+
+   # bytes 8 to 36 of a canonical CD-DA header: WAVE format chunk
+   _FMT = wav_header(2, 2, 44100, 0)[8:36]
+   # size of a canonical header, and of one CD frame of audio
+   _HEAD_SIZE, _FRAME_SIZE = 44, 2352
+
+   def __init__(self, max_entries=1024):
+      """
+      :param max_entries:  Maximum number of directories remembered.
+      :type  max_entries:  int
+      """
+      self.max_entries = max_entries
+      self._lock = threading.Lock()
+      # abs dir -> (dir mtime_ns, True if canonical)
+      self._dirs = collections.OrderedDict()
+
+   def __call__(self, file_):
+      """
+      Return the :class:`WavHeader` of *file_*, or :data:`None` if the file
+      does not exist.
+      """
+      return self.headers([file_])[file_]
+
+   def headers(self, files):
+      """
+      Return a :class:`dict` of the :class:`WavHeader` of each file in
+      *files*, :data:`None` if the file does not exist. Each directory is
+      checked once.
+
+      :param files:  WAV file names.
+      :type  files:  iterable
+      """
+      by_dir = collections.OrderedDict()
+      for f in files:
+         by_dir.setdefault( os.path.dirname(f), [] ).append(f)
+      out = {}
+      for dir_,names in by_dir.items():
+         key = os.path.abspath(dir_ or os.curdir)
+         try:
+            mtime = os.stat(key).st_mtime_ns
+         except OSError:
+            mtime = None
+         with self._lock:
+            mark = self._dirs.get(key)
+         canonical = mark[1] if mark and mark[0] == mtime else None
+         for f in names:
+            try:
+               size = os.stat(f).st_size
+            except OSError:
+               out[f] = None
+               continue
+            if canonical and self._fits(size):
+               stats.incr('lengths_from_size')
+               out[f] = self._header(size)
+               continue
+            stats.incr('files_probed')
+            with open(f,'rb') as fh:
+               # decide from the first file of whole CD frames
+               if (canonical is None and mtime is not None and
+                     self._fits(size)):
+                  canonical = self._is_canonical(fh.read(44), size)
+                  self._mark(key, mtime, canonical)
+                  if canonical:
+                     out[f] = self._header(size)
+                     continue
+                  fh.seek(0)
+               out[f] = read_header(fh)
+      return out
+
+   def clear(self):
+      """Forget all directory marks."""
+      with self._lock:
+         self._dirs.clear()
+
+   def __len__(self):
+      return len(self._dirs)
+
+   def _fits(self, size):
+      """Return :data:`True` if *size* is a canonical file of whole CD
+      frames."""
+      return (size >= self._HEAD_SIZE and
+              (size - self._HEAD_SIZE) % self._FRAME_SIZE == 0)
+
+   def _is_canonical(self, head, size):
+      """Return :data:`True` if *head* is the canonical header of a file of
+      *size* bytes."""
+      return ( self._fits(size) and len(head) == self._HEAD_SIZE and
+               head[:4] == b'RIFF' and head[8:36] == self._FMT and
+               head[36:40] == b'data' and
+               struct.unpack_from('<I', head, 4)[0] == size - 8 and
+               struct.unpack_from('<I', head, 40)[0] ==
+                  size - self._HEAD_SIZE )
+
+   def _header(self, size):
+      """Return the :class:`WavHeader` of a canonical file of *size*
+      bytes."""
+      data = size - self._HEAD_SIZE
+      return WavHeader(2, 2, 44100, data // 4, self._HEAD_SIZE, data)
+
+   def _mark(self, key, mtime, canonical):
+      """Remember if the directory *key* is canonical."""
+      with self._lock:
+         self._dirs[key] = (mtime, canonical)
+         self._dirs.move_to_end(key)
+         while len(self._dirs) > self.max_entries:
+            self._dirs.popitem(last=False)
+
+
+##############################################################################
+class IoPolicy(object):
+   """
+   Page cache policy for the files read and written by the WAV classes.
+
+   The policy opens the input and output files, and gives the kernel hints
+   about how the data is used. The modes are:
+
+   ``default``
+      Inputs are opened with sequential read-ahead hints.
+
+   ``nocache``
+      As ``default``, and input pages are dropped from the page cache after
+      they are read. Outputs are written back in the background every
+      :attr:`sync_size` bytes, and dropped from the cache once on disk, so a
+      full disc copy does not leave gigabytes of dirty pages.
+
+   ``direct``
+      Inputs are read with ``O_DIRECT`` through an aligned buffer, and never
+      enter the page cache. Outputs are handled as in ``nocache``. If the
+      file system does not support ``O_DIRECT``, inputs fall back to
+      ``nocache``.
+
+   The hint and sync calls are recorded by the :mod:`~mktoc.stats` counters
+   ``fadvise_calls``, ``sync_calls`` and ``direct_reads``.
+   """
+
+   #: Names of the supported modes.
+   MODES = ('default', 'nocache', 'direct')
+
+   #: Number of bytes between two background write-backs of an output, or
+   #: two page drops of an input.
+   sync_size = 16*1024*1024
+
+   def __init__(self, mode='default', sync_size=None):
+      """
+      :param mode:   One of :attr:`MODES`.
+      :type  mode:   str
+
+      :param sync_size: Override the default :attr:`sync_size`.
+      :type  sync_size: int
+      """
+      if mode not in self.MODES:
+         raise ValueError('unknown I/O policy: %s' % mode)
+      self.mode = mode
+      if sync_size:
+         self.sync_size = sync_size
+
+   def open_input(self, path):
+      """
+      Open the file *path* for unbuffered binary reads.
+
+      :returns: File object with ``seek``, ``readinto`` and ``close``
+                methods.
+      """
+      if self.mode == 'direct':
+         try:
+            return _DirectInput(path)
+         except OSError as e:
+            log.debug("O_DIRECT not available for '%s': %s", path, e)
+      if self.mode == 'default':
+         fh = open(path, 'rb', buffering=0)
+         _fadvise(fh.fileno(), 0, 0, 'POSIX_FADV_SEQUENTIAL')
+         _fadvise(fh.fileno(), 0, 0, 'POSIX_FADV_WILLNEED')
+         return fh
+      return _NoCacheInput(path, self.sync_size)
+
+   def open_output(self, path):
+      """
+      Create the file *path* for unbuffered binary writes.
+
+      :returns: File object with ``write``, ``fileno`` and ``close``
+                methods.
+      """
+      if self.mode == 'default':
+         return open(path, 'wb', buffering=0)
+      return _NoCacheOutput(path, self.sync_size)
+
+
+def _fadvise(fd, offset, length, advice):
+   """Call :func:`os.posix_fadvise` if the platform supports it."""
+   advice = getattr(os, advice, None)
+   if advice is None or not hasattr(os, 'posix_fadvise'):
+      return
+   try:
+      os.posix_fadvise(fd, offset, length, advice)
+      stats.incr('fadvise_calls')
+   except OSError as e:
+      log.debug('posix_fadvise failed: %s', e)
+
+
+# sync_file_range() flags, from <fcntl.h>
+_SYNC_WAIT_BEFORE, _SYNC_WRITE, _SYNC_WAIT_AFTER = 1, 2, 4
+# libc sync_file_range function; None if not loaded, False if not available
+_sync_file_range_fn = None
+
+def _sync_file_range(fd, offset, nbytes, flags):
+   """Call the Linux sync_file_range(2) function. Other platforms fall back
+   to :func:`os.fdatasync` when asked to wait for the data."""
+   global _sync_file_range_fn
+   if _sync_file_range_fn is None:
+      _sync_file_range_fn = False
+      try:
+         import ctypes
+         libc = ctypes.CDLL(None, use_errno=True)
+         fn = libc.sync_file_range
+         fn.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64,
+                        ctypes.c_uint]
+         _sync_file_range_fn = fn
+      except (ImportError, OSError, AttributeError):
+         pass
+   stats.incr('sync_calls')
+   if _sync_file_range_fn:
+      if _sync_file_range_fn(fd, offset, nbytes, flags) == 0:
+         return
+   if flags & _SYNC_WAIT_AFTER:
+      os.fdatasync(fd)
+
+
+class _NoCacheInput(object):
+   """Input file that drops the pages it has read from the page cache."""
+   def __init__(self, path, sync_size):
+      self._fh = open(path, 'rb', buffering=0)
+      self._sync_size = sync_size
+      self._dropped = 0    # pages before this offset were dropped
+      fd = self._fh.fileno()
+      _fadvise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+      _fadvise(fd, 0, 0, 'POSIX_FADV_WILLNEED')
+
+   def seek(self, pos):
+      return self._fh.seek(pos)
+
+   def readinto(self, buf):
+      n = self._fh.readinto(buf)
+      pos = self._fh.tell()
+      if pos - self._dropped >= self._sync_size:
+         self._drop(pos)
+      return n
+
+   def close(self):
+      self._drop(self._fh.tell())
+      self._fh.close()
+
+   def _drop(self, pos):
+      if pos > self._dropped:
+         _fadvise( self._fh.fileno(), self._dropped, pos - self._dropped,
+                   'POSIX_FADV_DONTNEED' )
+      self._dropped = pos
+
+
+class _NoCacheOutput(object):
+   """Output file that starts write-back every 'sync_size' bytes, and drops
+   the pages from the page cache once they are on disk."""
+   def __init__(self, path, sync_size):
+      self._fh = open(path, 'wb', buffering=0)
+      self._sync_size = sync_size
+      self._pos = 0        # bytes written
+      self._synced = 0     # write-back was started before this offset
+      self._dropped = 0    # pages before this offset are on disk and dropped
+      self.name = path
+
+   def fileno(self):
+      return self._fh.fileno()
+
+   def write(self, data):
+      n = self._fh.write(data)
+      self._pos += n
+      if self._pos - self._synced >= self._sync_size:
+         fd = self._fh.fileno()
+         # start write-back of the new window, then wait for the previous
+         # window and drop it from the cache
+         _sync_file_range(fd, self._synced, self._pos - self._synced,
+                          _SYNC_WRITE)
+         self._flush(self._synced)
+         self._synced = self._pos
+      return n
+
+   def close(self):
+      self._flush(self._pos)
+      self._fh.close()
+
+   def _flush(self, pos):
+      """Wait for the data before 'pos' to be written, and drop it."""
+      if pos > self._dropped:
+         fd = self._fh.fileno()
+         _sync_file_range( fd, self._dropped, pos - self._dropped,
+                           _SYNC_WAIT_BEFORE|_SYNC_WRITE|_SYNC_WAIT_AFTER )
+         _fadvise(fd, self._dropped, pos - self._dropped,
+                  'POSIX_FADV_DONTNEED')
+         self._dropped = pos
+
+
+class _DirectInput(object):
+   """Input file read with O_DIRECT. Reads are made at block aligned offsets
+   into a page aligned buffer, and copied out to the caller."""
+
+   # alignment of the O_DIRECT offsets and sizes
+   _BLOCK = 4096
+   # size of the aligned read buffer
+   _SIZE = 1024*1024
+
+   def __init__(self, path):
+      if not hasattr(os, 'O_DIRECT'):
+         raise OSError('O_DIRECT is not supported')
+      self._fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+      self._buf = mmap.mmap(-1, self._SIZE)    # page aligned memory
+      self._view = memoryview(self._buf)
+      self._pos = 0
+      self._win = (0, 0)   # file range held in the buffer
+      try:
+         self._fill(0)     # verify that the file system accepts O_DIRECT
+      except OSError:
+         self.close()
+         raise
+
+   def seek(self, pos):
+      self._pos = pos
+      return pos
+
+   def tell(self):
+      return self._pos
+
+   def readinto(self, buf):
+      mv = memoryview(buf).cast('B')
+      done = 0
+      while done < len(mv):
+         start,end = self._win
+         if not start <= self._pos < end:
+            self._fill(self._pos - self._pos % self._BLOCK)
+            if self._pos >= self._win[1]:
+               break       # end of file
+            continue
+         n = min(len(mv) - done, end - self._pos)
+         off = self._pos - start
+         mv[done:done+n] = self._view[off:off+n]
+         done += n
+         self._pos += n
+      return done
+
+   def close(self):
+      if self._fd is not None:
+         os.close(self._fd)
+         self._fd = None
+      self._view.release()
+      self._buf.close()
+
+   def _fill(self, offset):
+      """Read the buffer at aligned 'offset', returns the byte count."""
+      n = os.preadv(self._fd, [self._buf], offset)
+      stats.incr('direct_reads')
+      self._win = (offset, offset + n)
+      return n
+
+
+##############################################################################
+class DiscStream(object):
+   """
+   Presents an ordered list of WAV files as one seekable stream of PCM frames.
+
+   The stream position is counted in audio frames (one sample of every
+   channel) from the start of the first file. Reads that cross the end of a
+   file continue at the start of the next file, so sequential reads touch
+   every input byte exactly once. Only one input file is open at a time.
+
+   All files must have the same frame size.
+   """
+   def __init__(self, files, policy=None, checksum=False):
+      """
+      :param files:  In-order list of WAV files.
+      :type  files:  list
+
+      :param policy: Opens the input files, default is an :class:`IoPolicy`
+                     in ``default`` mode.
+      :type  policy: :class:`IoPolicy`
+
+      :param checksum:  Compute the CRC32 of the data of each file while it
+                        is read, see :meth:`crc`.
+      :type  checksum:  bool
+      """
+      self.files = list(files)
+      self._policy = policy or IoPolicy()
+      self._checksum = checksum
+      #: :class:`WavHeader` of each file.
+      self.headers = list(map(read_header, self.files))
+      stats.incr('files_probed', len(self.files))
+      #: Frame count of each file.
+      self.lengths = [h.nframes for h in self.headers]
+      sizes = set( h.frame_size for h in self.headers )
+      if len(sizes) > 1:
+         raise MkTocError('WAV files do not share the same sample format')
+      #: Number of bytes in one audio frame.
+      self.frame_size = sizes.pop() if sizes else 0
+      #: Start frame of each file in the stream.
+      self.starts = [0]
+      for n in self.lengths:
+         self.starts.append( self.starts[-1] + n )
+      #: Total number of frames in the stream.
+      self.nframes = self.starts.pop()
+      self._bpos = 0       # stream position in bytes
+      self._idx = None     # index of the open file
+      self._fh  = None     # open input file
+      # running CRC32 of each file, and the number of bytes it covers
+      self._crcs = [0] * len(self.files)
+      self._crc_len = [0] * len(self.files)
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      self.close()
+
+   def close(self):
+      """Close the open input file."""
+      if self._fh:
+         self._fh.close()
+      self._fh = self._idx = None
+
+   def tell(self):
+      """Return the current frame position of the stream."""
+      return self._bpos // self.frame_size
+
+   def seek(self, pos):
+      """
+      Move the stream to frame position *pos*. The file is only reopened if
+      the new position is in a different file.
+
+      :param pos: Frame position, ``0 <= pos <= nframes``.
+      :type  pos: int
+      """
+      if not 0 <= pos <= self.nframes:
+         raise ValueError('seek position out of range: %d' % pos)
+      self._bpos = pos * self.frame_size
+      idx = self._file_index(pos)
+      if idx != self._idx:
+         self.close()
+      if idx is not None:
+         self._open(idx)
+         self._fh.seek( self.headers[idx].data_offset +
+                        (pos - self.starts[idx]) * self.frame_size )
+
+   def read(self, nframes):
+      """
+      Read up to *nframes* frames from the stream. Fewer frames are only
+      returned at the end of the stream.
+
+      :param nframes:   Maximum number of frames to read.
+      :type  nframes:   int
+
+      :rtype: :class:`bytes`
+      """
+      buf = bytearray(nframes * self.frame_size)
+      return bytes( buf[:self.readinto(buf)] )
+
+   def readinto(self, buf):
+      """
+      Read whole frames from the stream into the writable buffer *buf*,
+      without any intermediate copies. Fewer bytes than the buffer size are
+      only returned at the end of the stream.
+
+      :param buf: Writable buffer, for example a :class:`bytearray` or
+                  :class:`memoryview`.
+
+      :returns: Number of bytes stored in *buf*.
+      """
+      mv = memoryview(buf).cast('B')
+      limit = len(mv) - len(mv) % self.frame_size
+      end = self.nframes * self.frame_size
+      done = 0
+      while done < limit and self._bpos < end:
+         idx = self._file_index(self._bpos // self.frame_size)
+         if idx != self._idx:
+            self.close()
+            self._open(idx)
+         file_end = (self.starts[idx] + self.lengths[idx]) * self.frame_size
+         want = min(limit - done, file_end - self._bpos)
+         n = self._fh.readinto( mv[done:done+want] )
+         if not n:
+            raise MkTocError('unexpected end of WAV data: %s'
+                              % self.files[idx])
+         offset = self._bpos - self.starts[idx] * self.frame_size
+         if self._checksum and self._crc_len[idx] == offset:
+            # only data read in order from the start of the file is counted
+            self._crcs[idx] = zlib.crc32( mv[done:done+n], self._crcs[idx] )
+            self._crc_len[idx] += n
+         done += n
+         self._bpos += n
+      stats.incr('bytes_read', done)
+      return done
+
+   def crc(self, idx):
+      """
+      Return the CRC32 of the PCM data of file *idx*, the same value as the
+      ExactAudioCopy copy CRC. :data:`None` is returned if checksums are not
+      enabled, or if the data of the file was not read in order from start
+      to end.
+      """
+      if self._checksum and \
+            self._crc_len[idx] == self.lengths[idx] * self.frame_size:
+         return self._crcs[idx]
+      return None
+
+   def _file_index(self, pos):
+      """Return the index of the file that contains frame *pos*, or
+      :data:`None` at the end of the stream."""
+      if pos >= self.nframes:
+         return None
+      return bisect.bisect_right(self.starts, pos) - 1
+
+   def _open(self, idx):
+      """Open file *idx* for reading, positioned at its first frame."""
+      if self._idx != idx:
+         self._fh = self._policy.open_input(self.files[idx])
+         self._fh.seek( self.headers[idx].data_offset )
+         self._idx = idx
+
+
+##############################################################################
+class CopyEngine(object):
+   """
+   Copies PCM data from a :class:`DiscStream` to output files through one
+   preallocated buffer.
+
+   Data is read with :meth:`DiscStream.readinto` and written as
+   :class:`memoryview` slices of the same buffer, so the number of
+   allocations and the memory use do not depend on the size of the audio.
+   """
+
+   #: Limits of the default buffer size, in bytes.
+   MIN_SIZE, MAX_SIZE = 256*1024, 4*1024*1024
+
+   def __init__(self, size=None, path=os.curdir):
+      """
+      :param size:   Buffer size in bytes. By default the size is selected
+                     by :meth:`default_size`.
+      :type  size:   int
+
+      :param path:   Location used to select the default buffer size.
+      :type  path:   str
+      """
+      #: Buffer size in bytes.
+      self.size = size or self.default_size(path)
+      #: Running CRC32 of the written data, or :data:`None` to disable it.
+      self.crc = None
+      self._buf = bytearray(self.size)
+      self._view = memoryview(self._buf)
+      self._zeros = None
+
+   @classmethod
+   def default_size(cls, path=os.curdir):
+      """
+      Return a buffer size suited to the storage at *path*. The size is a
+      multiple of the preferred I/O block size of the file system, limited to
+      the range :attr:`MIN_SIZE` to :attr:`MAX_SIZE`.
+      """
+      try:
+         blksize = os.stat(path).st_blksize
+      except (OSError, AttributeError):
+         blksize = 4096
+      return min(max(blksize * 256, cls.MIN_SIZE), cls.MAX_SIZE)
+
+   def copy(self, stream, fh, nbytes, callback=None):
+      """
+      Copy *nbytes* from *stream* to the file *fh*. At the end of the stream
+      the output is padded with silence. A buffer smaller than one frame of
+      *stream* is enlarged to one frame.
+
+      :param stream:    Input stream.
+      :type  stream:    :class:`DiscStream`
+
+      :param fh:        Output file opened in binary mode.
+      :type  fh:        :data:`file`
+
+      :param nbytes:    Number of bytes to write.
+      :type  nbytes:    int
+
+      :param callback:  Called with the byte count after each write.
+      :type  callback:  callable
+      """
+      if self.size < stream.frame_size:
+         self._resize(stream.frame_size)
+      view = self._view
+      chunk = self.size - self.size % stream.frame_size
+      while nbytes:
+         n = stream.readinto( view[:min(nbytes, chunk)] )
+         if not n:
+            return self.fill(fh, nbytes, callback)
+         self._write(fh, view[:n], callback)
+         nbytes -= n
+
+   def skip(self, stream, nbytes):
+      """Read and drop up to *nbytes* from *stream*, so that the input
+      checksums include the data."""
+      if self.size < stream.frame_size:
+         self._resize(stream.frame_size)
+      chunk = self.size - self.size % stream.frame_size
+      while nbytes > 0:
+         n = stream.readinto( self._view[:min(nbytes, chunk)] )
+         if not n:
+            break
+         nbytes -= n
+
+   def fill(self, fh, nbytes, callback=None):
+      """Write *nbytes* of silence to the file *fh*."""
+      if self._zeros is None:
+         self._zeros = memoryview(bytearray(self.size))
+      while nbytes:
+         n = min(nbytes, self.size)
+         self._write(fh, self._zeros[:n], callback)
+         nbytes -= n
+
+   def write(self, fh, data, callback=None):
+      """Write the bytes-like *data* to the file *fh*, with the same
+      counters and checksum as :meth:`copy`."""
+      self._write(fh, memoryview(data).cast('B'), callback)
+
+   def _resize(self, size):
+      """Replace the buffer with one of 'size' bytes."""
+      self.size = size
+      self._buf = bytearray(size)
+      self._view = memoryview(self._buf)
+      self._zeros = None
+
+   def _write(self, fh, data, callback):
+      """Write all of 'data' to 'fh'."""
+      done = 0
+      while done < len(data):
+         done += fh.write( data[done:] )
+      if self.crc is not None:
+         self.crc = zlib.crc32(data, self.crc)
+      stats.incr('bytes_written', done)
+      if callback:
+         callback(done)
+
+
+class _Manifest(object):
+   """Record of the completed outputs of a :class:`WavOffsetWriter`. The
+   record is only valid for the same offset and unchanged input files."""
+
+   # manifest file format version
+   _VERSION = 1
+
+   def __init__(self, path, offset, files, hash_inputs):
+      self._path = path
+      self._key = { 'version':self._VERSION, 'offset':offset,
+                    'inputs':[_file_id(f, hash_inputs) for f in files] }
+      self._outputs = {}
+      try:
+         with open(path) as fh:
+            data = json.load(fh)
+      except (IOError, ValueError):
+         return
+      if all( data.get(k) == v for k,v in self._key.items() ):
+         self._outputs = data.get('outputs', {})
+      else:
+         log.debug("manifest '%s' is stale", path)
+
+   def is_done(self, fn):
+      """Returns :data:`True` if 'fn' is recorded and was not changed."""
+      rec = self._outputs.get( os.path.basename(fn) )
+      return rec is not None and os.path.exists(fn) and rec == _file_id(fn)
+
+   def add(self, fn):
+      """Record the completed output 'fn'."""
+      self._outputs[os.path.basename(fn)] = _file_id(fn)
+      data = dict(self._key, outputs=self._outputs)
+      tmp = self._path + '.tmp'
+      with open(tmp, 'w') as fh:
+         json.dump(data, fh, indent=1, sort_keys=True)
+      os.replace(tmp, self._path)
+
+
+def _file_id(path, crc=False):
+   """Return the identity of a file: name, size, modification time and
+   optionally the CRC32 of the contents."""
+   st = os.stat(path)
+   out = { 'name':os.path.basename(path), 'size':st.st_size,
+           'mtime_ns':st.st_mtime_ns }
+   if crc:
+      value = 0
+      with open(path, 'rb') as fh:
+         for block in iter(functools.partial(fh.read, 1024*1024), b''):
+            value = zlib.crc32(block, value)
+      out['crc32'] = value
+   return out
+
+
+def _pipe_drained(fd):
+   """Wait until the reader of the pipe 'fd' has read all of the written data.
+   Returns False if the reader closed the pipe first. Without FIONREAD
+   support, the data is assumed to be read."""
+   try:
+      import fcntl
+      import termios
+   except ImportError:
+      return True
+   poller = select.poll()
+   poller.register(fd, select.POLLERR)
+   buf = bytearray(4)
+   while True:
+      try:
+         fcntl.ioctl(fd, termios.FIONREAD, buf)
+      except OSError:
+         return True
+      if not struct.unpack('i', buf)[0]:
+         return True
+      if poller.poll(100):
+         return False
+
+
 ##############################################################################
 class WavOffsetWriter(object):
    """
@@ -157,51 +1126,93 @@ class WavOffsetWriter(object):
    audio sample data to be taken from either a previous or next WAV file. The
    shift in sample data will cause either the first or last WAV file to contain
    'sample count' of NULL samples.
-   """
 
-   # number of samples to copy for each cycle. This value affects the memory
-   # required by this class and the frequency the progress bar is update.
-   _COPY_SIZE = 256*1024
+   The input files are read as a single :class:`DiscStream` in one sequential
+   pass, and the output is split at the shifted file boundaries. All data is
+   moved through one :class:`CopyEngine` buffer.
+   """
 
    # sample shift offset value.
    _offset = None
 
-   # reference to a :class:`ProgressBar` instance to provide progress updates.
-   _pb = None
+   # reference to a :class:`~mktoc.progress_bar.Progress` instance that
+   # receives the frame counters.
+   _progress = None
 
    # string of the program name (i.e. mktoc) used when creating directories in
    # /tm.
    _progName = None
 
-   def __init__(self, offset_samples, pb_class, pb_args):
+   # (input files, output FIFO names) waiting for :meth:`serve`.
+   _pending = None
+
+   #: Name of the manifest file of the completed outputs.
+   MANIFEST = '.mktoc-manifest'
+
+   def __init__(self, offset_samples, progress=None, buf_size=None,
+                policy=None, fifo=False, hash_inputs=False, checksum=False):
       """
       :param offset_samples:  Sample shift value
       :type offset_samples:   int
 
-      :param pb_class:  outputs status updates to the user. First argument of
-                        the class init routine specifies the maximum value of
-                        the progress bar and is calulated by this class.
-      :type pb_class:   :class:`ProgressBar`
+      :param progress:  receives frame and byte counters while the files are
+                        written. The total frame count is calculated by this
+                        class.
+      :type progress:   :class:`~mktoc.progress_bar.Progress`
 
-      :param pb_args:   Argument list used to initialize progress bar. However,
-                        the first argument of the progress bar init routine is
-                        calculated by this class.
-      :type pb_args:    list
+      :param buf_size:  Size of the copy buffer in bytes. By default the size
+                        is selected by :meth:`CopyEngine.default_size` for
+                        the output location.
+      :type  buf_size:  int
+
+      :param policy:    Page cache policy of the input and output files.
+      :type  policy:    :class:`IoPolicy`
+
+      :param fifo:      Create named pipes instead of output files. The
+                        shifted audio is written to the pipes by
+                        :meth:`serve`.
+      :type  fifo:      bool
+
+      :param hash_inputs:  Also record the CRC32 of each input file in the
+                           output manifest, so a changed input is found even
+                           if its size and time stamp did not change.
+      :type  hash_inputs:  bool
+
+      :param checksum:  Compute the CRC32 of each input and output file in
+                        the copy loop, see :attr:`checksums`. Not supported
+                        in FIFO mode.
+      :type  checksum:  bool
 
       .. Document private members
       .. automethod:: __call__
       """
       self._offset  = offset_samples
-      self._pb_class = pb_class
-      self._pb_args  = pb_args
+      self._progress = progress or mt_pb.Progress()
+      self._buf_size = buf_size
+      self._policy = policy or IoPolicy()
+      self._fifo = fifo
+      self._hash_inputs = hash_inputs
+      self._checksum = checksum and not fifo
+      self._lock = threading.Lock()
+      #: After a run with *checksum* enabled, a list with an
+      #: ``(input CRC32, output CRC32)`` tuple for each file. A value is
+      #: :data:`None` if it was not computed, for example for an output that
+      #: was not written again.
+      self.checksums = []
       self._progName = os.path.basename( sys.argv[0] )
 
+   @stats.timed('offset')
    def __call__(self, files, use_tmp_dir):
       """
       Initiate the WAV offsetting algorithm.
 
       New output files are written to either :file:`wav[+,-]n/` or
-      :file:`/tmp/mktoc.[random]/`
+      :file:`/tmp/mktoc.[random]/`. The completed outputs are recorded in a
+      :attr:`MANIFEST` file in the output directory, with the offset and the
+      size and time stamp of the inputs. When the writer runs again, outputs
+      that are recorded and unchanged are not written again. In FIFO mode, named pipes are created
+      with the same names, and no audio is written until :meth:`serve` is
+      called.
 
       :param files:  WAV files read to apply the sample shifting process to.
       :type files:   list
@@ -210,76 +1221,140 @@ class WavOffsetWriter(object):
                            :file:`/tmp`.
       :type use_tmp_dir:   bool
       """
-      # initialize the progress bar class, set the maximum progress bar value
-      self._pb = self._pb_class( bar_max=self._get_total_samp(files),
-                                 *self._pb_args)
       # set the dir name generation function, and create out_file list
       if not use_tmp_dir: outdir = self._get_new_name
       else              : outdir = self._get_tmp_name
+      if not files:
+         return []
       out_files = list(map( outdir, files ))
+      if self._fifo:
+         for fn in out_files:
+            if os.path.lexists(fn):
+               os.remove(fn)
+            os.mkfifo(fn)
+         self._pending = (list(files), out_files)
+         return out_files
+      out_dir = os.path.dirname(out_files[0]) or os.curdir
+      manifest = _Manifest( os.path.join(out_dir, self.MANIFEST),
+                            self._offset, files, self._hash_inputs )
+      todo = [i for i,fn in enumerate(out_files) if not manifest.is_done(fn)]
+      stats.incr('outputs_skipped', len(files) - len(todo))
+      engine = CopyEngine( self._buf_size, out_dir )
 
-      # positive offset correction, insert silence in first track,
-      # all other tracks insert end data of previous track
-      if self._offset > 0:
-         offsetter_fnct = self._insert_prv_end
-         # create a list of 'previous' file names
-         f2_list = [None] + files[:-1]
-      # negative offset correction, append silence to end of last track,
-      # all other tracks append start data of next track
-      elif self._offset < 0:
-         offsetter_fnct = self._append_nxt_start
-         # create a list of 'next' file names
-         f2_list = files[1:] + [None]
-
-      list(map( offsetter_fnct, out_files, files, f2_list ))
+      with DiscStream(files, self._policy, self._checksum) as stream:
+         self._progress.set_total( sum(stream.lengths[i] for i in todo) )
+         out_crcs = [None] * len(files)
+         if self._checksum:
+            # the frames dropped by a negative offset are also read
+            engine.skip( stream, min(max(-self._offset,0), stream.nframes)
+                                    * stream.frame_size )
+         for i in todo:
+            engine.crc = 0 if self._checksum else None
+            # write to a temp name, so a partial file is never taken for a
+            # complete one
+            part_fn = out_files[i] + '.part'
+            fh = self._policy.open_output(part_fn)
+            try:
+               self._write_file( fh, out_files[i], stream, engine, i )
+            finally:
+               fh.close()
+            os.replace(part_fn, out_files[i])
+            manifest.add(out_files[i])
+            out_crcs[i] = engine.crc
+         if self._checksum:
+            # read the frames dropped by a positive offset
+            engine.skip( stream, (stream.nframes - stream.tell())
+                                    * stream.frame_size )
+            self.checksums = [ (stream.crc(i), out_crcs[i])
+                               for i in range(len(files)) ]
+      self._progress.finish()
       # return a list of the new files names
       return out_files
 
-   def _append_nxt_start(self, out_fn, fn, nxt_fn):
-      """Negative offset correction algorithm for a single WAV file.
-      Copies the current WAV file data and then appends start of the
-      next files WAV data into a new WAV file. The basic steps are:
-         1) perform a positive 'n' sample seek into input WAV file.
-         2) copy data from location to start of new WAV file until EOF
-            of input.
-         3) Either,
-            a) open 'nxt_fn' WAV file and finish writing the last 'n'
-               samples.
-            b) pad the new WAV file with n samples of NULL data.
-
-      Parameters:
-         out_fn   : String of output WAV file name.
-
-         fn       : String of intput WAV file name.
-
-         nxt_fn   : String of N+1 input WAV file name."""
-      wav_out = wave.open(out_fn, 'w')
-      wav_in = wave.open(fn)
-      # setup the output parameters
-      bytes_p_samp = wav_in.getsampwidth() * wav_in.getnchannels()
-      offset_bytes = abs(self._offset) * bytes_p_samp
-      wav_out.setparams( wav_in.getparams() )
-      # seek ahead sample offset amount
-      wav_in.setpos( abs(self._offset) )
-      # copy all frame date from 1st file into new file
-      while True:
-         data = wav_in.readframes(self._COPY_SIZE)
-         if len(data) == 0: break
-         self._write_frames(wav_out, data, bytes_p_samp)
-      wav_in.close()
-      # finally copy the remaining data from the next track, or silence
-      if nxt_fn:
-         # copy offset frame date from next file into new file
-         wav_in = wave.open(nxt_fn)
-         data = wav_in.readframes( abs(self._offset) )
-         assert len(data) == offset_bytes
-         self._write_frames(wav_out, data, bytes_p_samp)
-      else:
-         # write silence to end of last track
-         self._write_frames(wav_out, '\x00'*offset_bytes, bytes_p_samp)
-      # print the progress bar
-      wav_in.close()
-      wav_out.close()
+   @stats.timed('offset')
+   def serve(self):
+      """
+      Write the shifted audio to the named pipes made by :meth:`__call__` in
+      FIFO mode, and remove the pipes when done.
+
+      Every pipe is served by its own thread, so a reader may open the pipes
+      in any order. A reader may also close a pipe early, for example after
+      it read the WAV header; the file is sent again from the start on the
+      next open. The method returns after every pipe was read to the end
+      once.
+      """
+      files,out_files = self._pending
+      with DiscStream(files) as stream:
+         self._progress.set_total( stream.nframes )
+      errors = []
+      def worker(idx):
+         try:
+            self._serve_fifo(files, out_files[idx], idx)
+         except Exception as e:
+            errors.append(e)
+      try:
+         threads = [ threading.Thread(target=worker, args=(i,))
+                     for i in range(len(out_files)) ]
+         for t in threads:
+            t.daemon = True
+            t.start()
+         for t in threads:
+            while t.is_alive():
+               t.join(0.5)
+      finally:
+         for fn in out_files:
+            if os.path.exists(fn):
+               os.remove(fn)
+         self._pending = None
+         self._progress.finish()
+      if errors:
+         raise errors[0]
+
+   def _serve_fifo(self, files, out_fn, idx):
+      """Write output file 'idx' to the named pipe 'out_fn' until it is read
+      to the end."""
+      engine = CopyEngine( self._buf_size )
+      with DiscStream(files, self._policy) as stream:
+         while True:
+            fh = open(out_fn, 'wb', buffering=0)     # blocks for a reader
+            try:
+               self._write_file( fh, out_fn, stream, engine, idx )
+               if _pipe_drained(fh.fileno()):
+                  return
+               log.debug("reader closed '%s', waiting to resend", out_fn)
+            except BrokenPipeError:
+               log.debug("reader closed '%s', waiting to resend", out_fn)
+            finally:
+               try:
+                  fh.close()
+               except BrokenPipeError:
+                  pass
+
+   def _write_file(self, fh, out_fn, stream, engine, idx):
+      """Write output file 'idx' to 'fh' with the same format and frame count
+      as input file 'idx'.
+
+      Positive offset correction inserts silence at the start of the first
+      track, and drops the end of the last track. Negative offset correction
+      skips the start of the first track and appends silence to the end of
+      the last track. Output 'idx' therefore holds the stream frames from
+      the start of file 'idx' minus the offset, with silence outside of the
+      stream."""
+      bps = stream.frame_size
+      hdr = stream.headers[idx]
+      need = hdr.nframes
+      begin = stream.starts[idx] - self._offset
+      lead = min(max(-begin, 0), need)
+      stream.seek( min(max(begin, 0), stream.nframes) )
+      update = functools.partial( self._update, bps )
+      if not self._fifo:
+         self._progress.start_file( out_fn, need )
+      fh.write( wav_header( hdr.nchannels, hdr.sampwidth, hdr.framerate,
+                            need ))
+      engine.fill( fh, lead*bps, update )
+      engine.copy( stream, fh, (need-lead)*bps, update )
+      if not self._fifo:
+         self._progress.end_file()
 
    def _get_new_name(self, f):
       """Generates a new name a location to write 'wav[+,-]n/' WAV
@@ -290,14 +1365,6 @@ class WavOffsetWriter(object):
          os.mkdir( new_dir )
       return os.path.join( new_dir, name)
 
-   def _get_total_samp(self, files):
-      """Helper function to return the total sample count of a list of
-      WAV files. Used to set the ProgressBar 'max' value.
-
-      Parameter:
-         files : List of WAV files to read."""
-      return sum(map( lambda f: wave.open(f).getnframes(), files))
-
    def _get_tmp_name(self, f):
       """Generates a new name a location to write
       '/tmp/mktoc.[random]/' WAV files."""
@@ -305,57 +1372,1093 @@ class WavOffsetWriter(object):
          self._tmp_dir = tempfile.mkdtemp( prefix=self._progName+'.' )
       return os.path.join( self._tmp_dir, os.path.basename(f) )
 
-   def _insert_prv_end(self, out_fn, fn, prv_fn):
-      """Positive offset correction algorithm for a single WAV file.
-      Inserts the end of the previous files WAV data and then copies
-      the current WAV files data into a new WAV file. The basic steps
-      are:
-         1) Either,
-            a) perform a positive (EOF - 'n') sample seek into
-               'prv_fn' WAV file.
-            b) if no 'prv_fn' use NULL data
-         2) copy n samples of data to start of new WAV file.
-         3) Open 'fn' WAV file and copy the full WAV file - 'n'
-            samples to the output WAV.
-
-      Parameters:
-         out_fn   : String of output WAV file name.
-
-         fn       : String of intput WAV file name.
-
-         prv_fn   : String of N-1 input WAV file name."""
-      wav_out = wave.open(out_fn, 'w')
-      wav_in = wave.open(fn)
-      # setup the output parameters
-      bytes_p_samp = wav_in.getsampwidth() * wav_in.getnchannels()
-      offset_bytes = self._offset * bytes_p_samp
-      wav_out.setparams( wav_in.getparams() )
-      wav_in.close()
-      # if previous file exists, insert end of stream to new file
-      if prv_fn:
-         wav_in = wave.open(prv_fn)
-         pos = wav_in.getnframes() - self._offset   # seek position
-         wav_in.setpos( pos ) # seek to EOF - offset
-         data = wav_in.readframes( self._offset )
-         assert len(data) == offset_bytes
-         self._write_frames(wav_out, data ,bytes_p_samp)
-         wav_in.close()
-      else:    # insert silence if no previous file
-         self._write_frames(wav_out ,'\x00'*offset_bytes, bytes_p_samp)
-      # add original file data to output stream
-      wav_in = wave.open( fn )
-      samples = wav_in.getnframes() - self._offset
-      while samples:
-         data = wav_in.readframes( min(samples,self._COPY_SIZE) )
-         samples -= len(data) / bytes_p_samp
-         self._write_frames(wav_out, data, bytes_p_samp)
-      wav_in.close()
-      wav_out.close()
-
-   def _write_frames(self, fh, data,bps):
-      """Wrapper for writing data wav files. A secondary side effect
-      is that each call udpates the progress bar."""
-      fh.writeframes(data)
-      self._pb += len(data) / bps      # update progress bar
-      sys.stderr.write(str(self._pb))  # print the progress bar
+   def _update(self, frame_size, nbytes):
+      """Copy engine callback, updates the progress counters."""
+      if self._fifo:
+         with self._lock:
+            self._progress.update( nbytes // frame_size, nbytes )
+      else:
+         self._progress.update( nbytes // frame_size, nbytes )
+
+
+##############################################################################
+class InPlaceOffsetWriter(object):
+   """
+   Shift the audio data in a set of WAV files by a sample offset, by
+   rewriting the data of the files in place.
+
+   The result is the same as :class:`WavOffsetWriter`, but no second copy of
+   the audio is made. The frame count of every file is kept, so only the
+   data region of each file is rewritten; the RIFF headers stay valid. The
+   files are processed in one forward pass. A positive offset moves the
+   data towards the end of the set, and the last ``offset`` frames that were
+   read but not yet written are held in a carry buffer. A negative offset
+   reads ahead of the write position and needs no carry.
+
+   Before each chunk is written, the chunk and the carry buffer are saved to
+   a journal file. The journal is replaced atomically, so after a crash or
+   an interrupt the run can be resumed (calling the writer again with the
+   same arguments) or undone with :meth:`rollback`. The journal also holds
+   the frames dropped from the start of the set by a negative offset. Disk
+   use is the size of one chunk plus the offset, instead of the size of the
+   disc.
+   """
+
+   #: Default journal file name, created next to the first WAV file.
+   JOURNAL = '.mktoc-journal'
+
+   # journal file format version
+   _VERSION = 1
+
+   def __init__(self, offset_samples, progress=None, buf_size=None,
+                journal=None):
+      """
+      :param offset_samples:  Sample shift value
+      :type offset_samples:   int
+
+      :param progress:  receives frame and byte counters while the files are
+                        rewritten.
+      :type progress:   :class:`~mktoc.progress_bar.Progress`
+
+      :param buf_size:  Size of each rewritten chunk in bytes. By default the
+                        size is selected by :meth:`CopyEngine.default_size`.
+      :type  buf_size:  int
+
+      :param journal:   Path of the journal file, default is :attr:`JOURNAL`
+                        in the directory of the first WAV file.
+      :type  journal:   str
+
+      .. Document private members
+      .. automethod:: __call__
+      """
+      self._offset = offset_samples
+      self._progress = progress or mt_pb.Progress()
+      self._buf_size = buf_size
+      self._journal = journal
+
+   @stats.timed('offset')
+   def __call__(self, files):
+      """
+      Shift the audio data of *files*. An interrupted run of the same offset
+      over the same files is resumed from its journal.
+
+      :param files:  WAV files to modify.
+      :type  files:  list
+
+      :returns: *files*, the names do not change.
+      """
+      if not files:
+         return []
+      path = self._journal_path(files)
+      with _DiscFile(files) as disc:
+         state = self._load(path, disc)
+         if state is None:
+            state = self._new_job(disc)
+         elif state['kind'] != 'shift' or state['offset'] != self._offset:
+            raise MkTocError( "an interrupted in-place correction must be "
+                              "rolled back first: %s" % path )
+         self._run(disc, path, state)
+      return files
+
+   @stats.timed('offset')
+   def rollback(self, files):
+      """
+      Restore the original audio data of *files* after an interrupted run,
+      using the journal. An interrupted rollback is continued.
+
+      :param files:  WAV files that were being modified.
+      :type  files:  list
+      """
+      path = self._journal_path(files)
+      with _DiscFile(files) as disc:
+         state = self._load(path, disc)
+         if state is None:
+            raise MkTocError('no in-place correction journal found: %s'
+                              % path)
+         if state['kind'] == 'shift':
+            # finish the interrupted chunk, then all frames before 'pos' are
+            # shifted, and all frames after it are original
+            disc.write( state['pos'], state['payload'] )
+            end = state['pos'] + len(state['payload']) // disc.frame_size
+            off = state['offset']
+            if off > 0:
+               # original data is read back from the shifted position; the
+               # carry holds the last frames before 'end'
+               state = self._job('rollback', disc, -off, end,
+                                 tail=state['carry'])
+            else:
+               # the saved start of the set is the head of the shift
+               state = self._job('rollback', disc, -off, end,
+                                 head=state['edge'])
+         self._run(disc, path, state)
+
+   def _journal_path(self, files):
+      return self._journal or os.path.join(
+            os.path.dirname(files[0]) or os.curdir, self.JOURNAL )
+
+   def _new_job(self, disc):
+      """Return the initial state of an offset shift of the whole set."""
+      off = self._offset
+      edge = disc.read(0, min(-off, disc.nframes)) if off < 0 else b''
+      return self._job('shift', disc, off, disc.nframes, edge=edge)
+
+   def _job(self, kind, disc, offset, limit, head=None, tail=None, edge=b''):
+      """
+      Return the state of a job that shifts the frames before 'limit' by
+      'offset'. Frames shifted in from before the start of the set are taken
+      from 'head', and frames from 'limit' onwards from 'tail'; both default
+      to silence.
+      """
+      fs = disc.frame_size
+      k = abs(offset) * fs
+      return { 'kind':kind, 'offset':offset, 'limit':limit, 'pos':0,
+               'payload':b'',
+               'carry': ((head or b'') + bytes(k))[:k] if offset > 0 else b'',
+               'tail': tail if tail is not None else b'',
+               'edge': edge }
+
+   def _run(self, disc, path, state):
+      """Execute the job 'state', and remove the journal at the end."""
+      fs = disc.frame_size
+      off,limit = state['offset'],state['limit']
+      size = self._buf_size or CopyEngine.default_size( os.path.dirname(path)
+                                                         or os.curdir )
+      chunk = max(size // fs, 1)
+      self._progress.set_total(limit)
+      # redo the chunk of an interrupted run
+      disc.write( state['pos'], state['payload'] )
+      pos = state['pos'] + len(state['payload']) // fs
+      carry = state['carry']
+      while pos < limit:
+         n = min(chunk, limit - pos)
+         if off > 0:
+            data = carry + disc.read(pos, n)
+            payload,carry = data[:n*fs], data[n*fs:]
+         else:
+            payload = self._read_ahead(disc, pos - off, n, limit, state)
+         state.update( pos=pos, payload=payload, carry=carry )
+         self._save(path, disc, state)
+         disc.write(pos, payload)
+         disc.sync()
+         pos += n
+         self._progress.update(n, n*fs)
+      os.remove(path)
+      self._progress.finish()
+
+   @staticmethod
+   def _read_ahead(disc, pos, n, limit, state):
+      """Read 'n' frames at 'pos', where the frames from 'limit' onwards are
+      taken from the job tail, then silence."""
+      fs = disc.frame_size
+      have = max(min(n, limit - pos), 0)
+      data = disc.read(pos, have)
+      skip = max(pos - limit, 0) * fs
+      tail = state['tail'][skip:skip + (n-have)*fs]
+      return data + tail + bytes((n-have)*fs - len(tail))
+
+   def _save(self, path, disc, state):
+      """Atomically replace the journal with 'state'."""
+      blobs = ('payload', 'carry', 'tail', 'edge')
+      meta = dict( (k,v) for k,v in state.items() if k not in blobs )
+      meta.update( version=self._VERSION, files=disc.files,
+                   frame_size=disc.frame_size,
+                   sizes=[len(state[k]) for k in blobs] )
+      tmp = path + '.tmp'
+      with open(tmp, 'wb') as fh:
+         fh.write( json.dumps(meta, sort_keys=True).encode('utf-8') + b'\n' )
+         for k in blobs:
+            fh.write( state[k] )
+         fh.flush()
+         os.fsync( fh.fileno() )
+      os.replace(tmp, path)
+      _fsync_dir( os.path.dirname(path) or os.curdir )
+      stats.incr('journal_writes')
+
+   def _load(self, path, disc):
+      """Return the journal state, or :data:`None` if there is no journal."""
+      if not os.path.exists(path):
+         return None
+      with open(path, 'rb') as fh:
+         try:
+            meta = json.loads( fh.readline().decode('utf-8') )
+            sizes = meta.pop('sizes')
+         except (ValueError, KeyError):
+            raise MkTocError('corrupt in-place correction journal: %s' % path)
+         for k in ('payload', 'carry', 'tail', 'edge'):
+            meta[k] = fh.read( sizes.pop(0) )
+      if meta.pop('version') != self._VERSION or \
+            meta.pop('files') != disc.files or \
+            meta.pop('frame_size') != disc.frame_size:
+         raise MkTocError( 'in-place correction journal does not match the '
+                           'WAV files: %s' % path )
+      return meta
+
+
+def _fsync_dir(path):
+   """Flush a directory entry change to disk, where supported."""
+   try:
+      fd = os.open(path, os.O_RDONLY)
+   except OSError:
+      return
+   try:
+      os.fsync(fd)
+   except OSError:
+      pass
+   finally:
+      os.close(fd)
+
+
+class _DiscFile(object):
+   """Random read and write access to the PCM frames of a set of WAV files,
+   addressed by frame position in the whole set."""
+   def __init__(self, files):
+      with DiscStream(files) as stream:
+         self.files = [os.path.abspath(f) for f in stream.files]
+         self.headers = stream.headers
+         self.starts = stream.starts
+         self.frame_size = stream.frame_size
+         self.nframes = stream.nframes
+      self._fds = [os.open(f, os.O_RDWR) for f in self.files]
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      for fd in self._fds:
+         os.close(fd)
+      self._fds = []
+
+   def _parts(self, pos, n):
+      """Yield (fd, file offset, byte count) of the parts of the frames
+      [pos,pos+n) that are inside of the set."""
+      fs = self.frame_size
+      end = min(pos + n, self.nframes)
+      while pos < end:
+         idx = bisect.bisect_right(self.starts, pos) - 1
+         hdr = self.headers[idx]
+         count = min(end, self.starts[idx] + hdr.nframes) - pos
+         yield ( self._fds[idx],
+                 hdr.data_offset + (pos - self.starts[idx]) * fs,
+                 count * fs )
+         pos += count
+
+   def read(self, pos, n):
+      out = []
+      for fd,offset,size in self._parts(pos, n):
+         data = os.pread(fd, size, offset)
+         if len(data) != size:
+            raise MkTocError('unexpected end of WAV data')
+         out.append(data)
+      stats.incr('bytes_read', sum(map(len, out)))
+      return b''.join(out)
+
+   def write(self, pos, data):
+      done = 0
+      for fd,offset,size in self._parts(pos, len(data) // self.frame_size):
+         while size:
+            n = os.pwrite(fd, data[done:done+size], offset)
+            done += n
+            offset += n
+            size -= n
+      stats.incr('bytes_written', done)
+
+   def sync(self):
+      for fd in self._fds:
+         os.fdatasync(fd)
+
+
+##############################################################################
+class ImageWriter(object):
+   """
+   Joins a set of WAV files into one WAV image of the whole disc, optionally
+   shifted by a sample offset in the same way as :class:`WavOffsetWriter`.
+
+   The PCM data of each input is copied with :func:`os.copy_file_range`, so
+   the data stays in the kernel (or is shared by the file system). Silence
+   added by the offset, and file systems that do not support the call, go
+   through a :class:`CopyEngine`.
+   """
+   def __init__(self, offset_samples=0, progress=None, buf_size=None):
+      """
+      :param offset_samples:  Sample shift value.
+      :type offset_samples:   int
+
+      :param progress:  Receives frame and byte counters while the image is
+                        written.
+      :type progress:   :class:`~mktoc.progress_bar.Progress`
+
+      :param buf_size:  Size of the copy buffer in bytes.
+      :type  buf_size:  int
+
+      .. Document private members
+      .. automethod:: __call__
+      """
+      self._offset = offset_samples
+      self._progress = progress or mt_pb.Progress()
+      self._buf_size = buf_size
+
+   @stats.timed('image')
+   def __call__(self, files, path):
+      """
+      Write the image of *files* to *path*. The image is written to a
+      ``.part`` file, and renamed when complete.
+
+      :param files:  In-order list of WAV files.
+      :type  files:  list
+
+      :param path:   Name of the WAV image.
+      :type  path:   str
+
+      :returns: :class:`list` with the start frame of each input file in
+                the image.
+      """
+      stream = DiscStream(files)
+      bps = stream.frame_size
+      hdr = stream.headers[0]
+      total = stream.nframes
+      # positive offsets add silence at the start, negative at the end
+      lead = min(max(self._offset, 0), total)
+      begin = min(max(-self._offset, 0), total)
+      count = total - lead - min(max(-self._offset, 0), total - lead)
+      engine = CopyEngine( self._buf_size,
+                           os.path.dirname(path) or os.curdir )
+      update = lambda nbytes: self._progress.update( nbytes // bps, nbytes )
+      self._progress.set_total(total)
+      tmp = path + '.part'
+      with open(tmp, 'wb', buffering=0) as fh:
+         fh.write( wav_header( hdr.nchannels, hdr.sampwidth, hdr.framerate,
+                               total ))
+         engine.fill( fh, lead*bps, update )
+         for f,h,start,n in zip(files, stream.headers, stream.starts,
+                                stream.lengths):
+            lo,hi = max(begin, start), min(begin + count, start + n)
+            if lo < hi:
+               _copy_range( f, h.data_offset + (lo-start)*bps, fh,
+                            (hi-lo)*bps, engine, update )
+         engine.fill( fh, (total - lead - count)*bps, update )
+      os.replace(tmp, path)
+      self._progress.finish()
+      return list(stream.starts)
+
+
+##############################################################################
+class TrackSplitter(object):
+   """
+   Cuts a set of WAV files, for example a single WAV image of a disc, into
+   new WAV files of the given frame ranges.
+
+   Each output file gets a new WAV header and the PCM data is copied with
+   :func:`os.copy_file_range`, as in :class:`ImageWriter`. The files are
+   written in parallel threads.
+   """
+   def __init__(self, progress=None, buf_size=None, workers=None):
+      """
+      :param progress:  Receives frame and byte counters while the files are
+                        written.
+      :type  progress:  :class:`~mktoc.progress_bar.Progress`
+
+      :param buf_size:  Size of the copy buffer of each thread in bytes.
+      :type  buf_size:  int
+
+      :param workers:   Number of files written at the same time, by default
+                        the number of CPUs.
+      :type  workers:   int
+
+      .. Document private members
+      .. automethod:: __call__
+      """
+      self._progress = progress or mt_pb.Progress()
+      self._buf_size = buf_size
+      self._workers = workers or os.cpu_count() or 1
+
+   @stats.timed('split')
+   def __call__(self, files, ranges, paths):
+      """
+      Write frames ``[start,end)`` of the stream of *files* to each output.
+
+      :param files:  In-order list of input WAV files.
+      :type  files:  list
+
+      :param ranges: ``(start, end)`` frame positions of each output file.
+      :type  ranges: list
+
+      :param paths:  Name of each output file.
+      :type  paths:  list
+      """
+      import concurrent.futures
+      stream = DiscStream(files)
+      self._progress.set_total( sum(end - start for start,end in ranges) )
+      with concurrent.futures.ThreadPoolExecutor(self._workers) as pool:
+         jobs = [ pool.submit(self._write, stream, start, end, path)
+                  for (start,end),path in zip(ranges, paths) ]
+         for job in jobs:
+            job.result()
+      self._progress.finish()
+
+   def _write(self, stream, start, end, path):
+      """Write frames [start,end) of 'stream' to 'path'."""
+      bps = stream.frame_size
+      hdr = stream.headers[0]
+      engine = CopyEngine( self._buf_size, os.path.dirname(path) or os.curdir )
+      update = lambda nbytes: self._progress.update( nbytes // bps, nbytes )
+      tmp = path + '.part'
+      with open(tmp, 'wb', buffering=0) as fh:
+         fh.write( wav_header( hdr.nchannels, hdr.sampwidth, hdr.framerate,
+                               end - start ))
+         for f,h,pos,n in zip(stream.files, stream.headers, stream.starts,
+                              stream.lengths):
+            lo,hi = max(start, pos), min(end, pos + n)
+            if lo < hi:
+               _copy_range( f, h.data_offset + (lo-pos)*bps, fh,
+                            (hi-lo)*bps, engine, update )
+      os.replace(tmp, path)
+
+
+def _copy_range(src, offset, fh, nbytes, engine, update):
+   """Copy 'nbytes' at 'offset' of file 'src' to the end of 'fh', which is
+   an unbuffered file. Data missing from a truncated file is written as
+   silence."""
+   with open(src, 'rb') as fin:
+      fd = fin.fileno()
+      try:
+         while nbytes:
+            n = os.copy_file_range(fd, fh.fileno(), nbytes, offset)
+            if not n:
+               break
+            stats.incr('bytes_read', n)
+            stats.incr('bytes_written', n)
+            update(n)
+            offset += n
+            nbytes -= n
+      except (AttributeError, OSError) as e:
+         # no kernel support, or a copy between file systems
+         if isinstance(e, OSError) and e.errno not in (errno.EXDEV,
+               errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+            raise
+         while nbytes:
+            data = os.pread(fd, min(nbytes, engine.size), offset)
+            if not data:
+               break
+            stats.incr('bytes_read', len(data))
+            engine.write(fh, data, update)
+            offset += len(data)
+            nbytes -= len(data)
+   engine.fill(fh, nbytes, update)
+
+##############################################################################
+#: One entry of an AccurateRip response file. *tracks* is a list of
+#: ``(confidence, crc, frame450_crc)`` tuples.
+AccurateRipEntry = collections.namedtuple( 'AccurateRipEntry',
+      'track_count disc_id1 disc_id2 cddb_id tracks' )
+
+
+def read_accuraterip(path):
+   """
+   Read an AccurateRip response file (:file:`dBAR-*.bin`).
+
+   :param path:   Path of the response file.
+   :type  path:   str
+
+   :returns: :class:`list` of :class:`AccurateRipEntry`, one for each
+             pressing in the file.
+   """
+   with open(path, 'rb') as fh:
+      data = fh.read()
+   entries = []
+   pos = 0
+   while pos < len(data):
+      if pos + 13 > len(data):
+         raise MkTocError('truncated AccurateRip file: %s' % path)
+      count,id1,id2,cddb = struct.unpack_from('<BIII', data, pos)
+      pos += 13
+      if pos + count*9 > len(data):
+         raise MkTocError('truncated AccurateRip file: %s' % path)
+      tracks = [ struct.unpack_from('<BII', data, pos + i*9)
+                 for i in range(count) ]
+      pos += count * 9
+      entries.append( AccurateRipEntry(count, id1, id2, cddb, tracks) )
+   return entries
+
+
+def _numpy():
+   """Import NumPy on first use."""
+   try:
+      import numpy
+   except ImportError:
+      raise MkTocError('this feature requires the NumPy package')
+   return numpy
+
+
+class MappedWav(object):
+   """
+   Memory mapped PCM WAV file, with zero-copy access to the audio data.
+
+   :attr:`data` is a :class:`memoryview` of the data chunk. With NumPy,
+   :attr:`samples` is an array view of the samples, with one row for each
+   sample frame and one column for each channel, and :attr:`frames` is
+   sliced in CD frames (1/75 s)::
+
+      with MappedWav('track01.wav') as mw:
+         second = mw.frames[75:150]
+
+   Views must not be used after :meth:`close`; the file stays mapped until
+   the last view is released.
+   """
+
+   # NumPy type of each supported sample width
+   _DTYPES = {1:'u1', 2:'<i2', 4:'<i4'}
+
+   def __init__(self, path):
+      """
+      :param path:   WAV file name.
+      :type  path:   str
+      """
+      self.path = path
+      #: :class:`WavHeader` of the file.
+      self.header = read_header(path)
+      #: Number of sample frames in one CD frame.
+      self.frame_samples = self.header.framerate // 75
+      with open(path, 'rb') as fh:
+         size = os.fstat(fh.fileno()).st_size
+         self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+      # a truncated file has fewer frames than the header
+      bps = self.header.frame_size
+      #: Number of complete sample frames in the file.
+      self.nframes = min( self.header.nframes,
+                          max(size - self.header.data_offset, 0) // bps )
+      off = self.header.data_offset
+      #: :class:`memoryview` of the audio data.
+      self.data = memoryview(self._mm)[off:off + self.nframes*bps]
+      self._samples = None
+      stats.incr('files_probed')
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      self.close()
+
+   @property
+   def samples(self):
+      """NumPy array view of the samples, one row for each sample frame."""
+      if self._samples is None:
+         np = _numpy()
+         hdr = self.header
+         if hdr.sampwidth not in self._DTYPES:
+            raise MkTocError( '%d-bit audio is not supported: %s' %
+                              (hdr.sampwidth*8, self.path) )
+         self._samples = np.frombuffer( self.data,
+               dtype=self._DTYPES[hdr.sampwidth] ).reshape(-1, hdr.nchannels)
+      return self._samples
+
+   @property
+   def frames(self):
+      """View of :attr:`samples` that is sliced in CD frames. The last CD
+      frame can be partial."""
+      return _CdFrames(self)
+
+   def close(self):
+      """Unmap the file."""
+      if self._mm is None:
+         return
+      self._samples = None
+      try:
+         self.data.release()
+         self._mm.close()
+      except BufferError:
+         pass     # a view is in use, the map is closed when it is released
+      self.data = self._mm = None
+
+
+class _CdFrames(object):
+   """Slices the samples of a :class:`MappedWav` in CD frames."""
+   def __init__(self, mw):
+      self._mw = mw
+
+   def __len__(self):
+      n = self._mw.frame_samples
+      return (self._mw.nframes + n - 1) // n
+
+   def __getitem__(self, key):
+      n = self._mw.frame_samples
+      if isinstance(key, slice):
+         start,stop,step = key.indices(len(self))
+         if step != 1:
+            raise ValueError('CD frames can not be sliced with a step')
+         return self._mw.samples[start*n : stop*n]
+      if key < 0:
+         key += len(self)
+      if not 0 <= key < len(self):
+         raise IndexError('CD frame index out of range')
+      return self._mw.samples[key*n : (key+1)*n]
+
+
+def find_silence(path, threshold=0):
+   """
+   Return the length of the digital silence at the start and at the end of
+   the audio in a 16-bit WAV file, in whole CD frames (1/75 s).
+
+   The file is read through a :class:`MappedWav`, and is scanned from both
+   ends with NumPy, in blocks that grow while they are silent, so only the
+   silence and one block of sound are read.
+
+   :param path:      WAV file name.
+   :type  path:      str
+
+   :param threshold: Largest sample value, positive or negative, that is
+                     silence.
+   :type  threshold: int
+
+   :returns: :class:`tuple` ``(lead, trail)``; both are 0 for a file that
+             is silent from start to end.
+   """
+   np = _numpy()
+   with MappedWav(path) as mw:
+      if mw.header.sampwidth != 2:
+         raise MkTocError( 'silence detection requires 16-bit audio: %s' %
+                           path )
+      frames = mw.samples
+      lead = _silent_run(np, frames, threshold)
+      if lead == len(frames):
+         return 0, 0
+      trail = _silent_run(np, frames[::-1], threshold)
+      frames = None
+   return lead // mw.frame_samples, trail // mw.frame_samples
+
+
+def _silent_run(np, frames, threshold):
+   """Return the number of silent frames at the start of 'frames'."""
+   pos,step = 0,4096
+   while pos < len(frames):
+      blk = frames[pos:pos+step]
+      loud = ((blk > threshold) | (blk < -threshold)).any(axis=1)
+      hits = np.flatnonzero(loud)
+      if hits.size:
+         return pos + int(hits[0])
+      pos += len(blk)
+      step = min(step * 2, 1 << 20)
+   return len(frames)
+
+
+class AccurateRip(object):
+   """
+   Computes the AccurateRip v1 and v2 checksums of the tracks of a disc, from
+   CD-DA (16-bit, 44.1 kHz, stereo) WAV files.
+
+   A checksum is the sum of each 32-bit stereo sample multiplied by its
+   position in the track, starting at 1. The v1 checksum keeps the low 32
+   bits of each product; the v2 checksum adds the high 32 bits too. The
+   first 5 CD frames of the first track, and the last 5 CD frames of the
+   last track, are not included.
+
+   The work is done with NumPy on blocks of samples, and NumPy is imported
+   on first use. :meth:`scan` computes the v1 checksum of every track for a
+   window of read offsets in one pass: the sums over the part of the track
+   that is shared by all offsets are computed once, and only the two edges
+   of the window are computed for each offset.
+   """
+
+   #: Number of samples not included at the start of the first track and
+   #: the end of the last track (5 CD frames).
+   SKIP = 5 * 588
+
+   # number of samples processed per block
+   _BLOCK = 1024 * 1024
+
+   def __init__(self, files, starts=None):
+      """
+      :param files:  In-order list of the WAV files of the disc.
+      :type  files:  list
+
+      :param starts: Start sample of each track in the WAV data, the last
+                     track ends at the end of the data. By default each file
+                     is one track.
+      :type  starts: list
+      """
+      self._maps = []
+      self._starts = []    # sample position of each file
+      pos = 0
+      try:
+         for f in files:
+            mw = MappedWav(f)
+            self._maps.append(mw)
+            if not CddaConverter.is_cdda(mw.header):
+               raise MkTocError( 'AccurateRip requires CD-DA audio: %s' % f )
+            self._starts.append(pos)
+            pos += mw.nframes
+      except:
+         self.close()
+         raise
+      self._nframes = pos
+      bounds = list(starts if starts is not None else self._starts)
+      bounds.append(pos)
+      #: ``(start, end)`` sample positions of each track.
+      self.tracks = list(zip(bounds[:-1], bounds[1:]))
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      self.close()
+
+   def close(self):
+      """Unmap the WAV files."""
+      for mw in self._maps:
+         mw.close()
+
+   def checksums(self, offset=0):
+      """
+      Return the ``(v1, v2)`` checksums of each track, with the audio read
+      *offset* samples later than the track positions (the correction of a
+      drive with a read offset of ``-offset``).
+      """
+      np = _numpy()
+      out = []
+      for num,(lo,hi) in enumerate(self._ranges()):
+         base = self.tracks[num][0] + offset
+         v1 = v2 = 0
+         for pos in range(lo + offset, hi + offset, self._BLOCK):
+            end = min(pos + self._BLOCK, hi + offset)
+            mult = np.arange(pos - base + 1, end - base + 1, dtype=np.uint64)
+            prod = self._samples(pos, end) * mult
+            low = int( (prod & 0xFFFFFFFF).sum() )
+            v1 += low
+            v2 += low + int( (prod >> 32).sum() )
+         out.append( (v1 & 0xFFFFFFFF, v2 & 0xFFFFFFFF) )
+      return out
+
+   def scan(self, window):
+      """
+      Return the v1 checksums of each track for every read offset from
+      *-window* to *window* samples.
+
+      :returns: :class:`list` with a :class:`list` of ``2*window+1``
+                checksums for each track; item ``window+d`` is the checksum
+                at offset ``d``.
+      """
+      np = _numpy()
+      w = window
+      out = []
+      for num,(lo,hi) in enumerate(self._ranges()):
+         base = self.tracks[num][0]
+         # the checksum at offset 'd' is A - (base+d) * B, where A is the
+         # sum of (i+1)*s[i] and B the sum of s[i] over [lo+d, hi+d).
+         d = np.arange(-w, w+1)
+         if hi - lo > 2*w:
+            core_a,core_b = self._sums(lo + w, hi - w)
+            fa,fb = self._prefix(lo - w, lo + w)
+            ka,kb = self._prefix(hi - w, hi + w)
+            sum_a = (fa[-1] - fa[d+w]) + core_a + ka[d+w]
+            sum_b = (fb[-1] - fb[d+w]) + core_b + kb[d+w]
+         else:
+            pa,pb = self._prefix(lo - w, hi + w)
+            sum_a = pa[hi - lo + d + w] - pa[d + w]
+            sum_b = pb[hi - lo + d + w] - pb[d + w]
+         mult = (base + d).astype(np.uint64)
+         out.append( [ int(x) & 0xFFFFFFFF
+                       for x in sum_a - mult * sum_b ] )
+      return out
+
+   def verify(self, entries, window=SKIP, offset=0):
+      """
+      Compare the checksums of each track with an AccurateRip response.
+
+      :param entries:   Pressings read by :func:`read_accuraterip`.
+      :type  entries:   list
+
+      :param window:    Read offsets from *-window* to *window* samples are
+                        searched with the v1 checksums.
+      :type  window:    int
+
+      :param offset:    Read offset of the v2 checksums.
+      :type  offset:    int
+
+      :returns: :class:`list` with a :class:`dict` for each track, with the
+                keys ``v1``, ``v2`` (checksums at *offset*) and ``matches``
+                (a list of ``(offset, version, confidence)`` tuples).
+      """
+      sums = self.checksums(offset)
+      scan = self.scan(window)
+      out = []
+      for num,(v1,v2) in enumerate(sums):
+         matches = set()
+         for entry in entries:
+            if num >= len(entry.tracks):
+               continue
+            conf,crc,crc450 = entry.tracks[num]
+            if crc == v2:
+               matches.add( (offset, 2, conf) )
+            for d,value in enumerate(scan[num]):
+               if value == crc:
+                  matches.add( (d - window, 1, conf) )
+         matches = sorted(matches, key=lambda m: (m[0] != offset,
+                          abs(m[0]), -m[1], -m[2]))
+         out.append( {'v1':v1, 'v2':v2, 'matches':matches} )
+      return out
+
+   def _ranges(self):
+      """Return the [lo,hi) sample range of each track that is included in
+      the checksum."""
+      out = []
+      for num,(start,end) in enumerate(self.tracks):
+         lo = start + (self.SKIP - 1 if num == 0 else 0)
+         hi = end - (self.SKIP if num == len(self.tracks)-1 else 0)
+         out.append( (lo, max(hi, lo)) )
+      return out
+
+   def _samples(self, start, end):
+      """Return the samples [start,end) as an uint64 array; samples outside
+      of the disc are silence."""
+      np = _numpy()
+      out = np.zeros(end - start, dtype=np.uint64)
+      for mw,pos in zip(self._maps, self._starts):
+         lo,hi = max(start, pos), min(end, pos + mw.nframes)
+         if lo < hi:
+            # each stereo sample is one 32-bit value
+            view = mw.samples.view('<u4')[lo-pos:hi-pos, 0]
+            out[lo-start:hi-start] = view
+      return out
+
+   def _sums(self, start, end):
+      """Return the sums of (i+1)*s[i] and s[i] over [start,end), modulo
+      2**64."""
+      np = _numpy()
+      sum_a = sum_b = np.zeros(1, dtype=np.uint64)
+      for pos in range(start, end, self._BLOCK):
+         stop = min(pos + self._BLOCK, end)
+         s = self._samples(pos, stop)
+         i = np.arange(pos + 1, stop + 1, dtype=np.uint64)
+         sum_a = sum_a + (s * i).sum(keepdims=True)
+         sum_b = sum_b + s.sum(keepdims=True)
+      return sum_a, sum_b
+
+   def _prefix(self, start, end):
+      """Return the prefix sums of (i+1)*s[i] and s[i] over [start,end), as
+      arrays of length end-start+1 that start at 0."""
+      np = _numpy()
+      s = self._samples(start, end)
+      i = (np.arange(start + 1, end + 1)).astype(np.uint64)
+      zero = np.zeros(1, dtype=np.uint64)
+      return ( np.concatenate([zero, np.cumsum(s * i, dtype=np.uint64)]),
+               np.concatenate([zero, np.cumsum(s, dtype=np.uint64)]) )
+
+
+##############################################################################
+class CddaConverter(object):
+   """
+   Converts WAV files to the CD-DA format (16-bit, 44.1 kHz, stereo) that is
+   required by cdrdao.
+
+   The sample rate is changed by a polyphase FIR resampler, and samples are
+   reduced to 16 bits with TPDF (triangular) dither. Mono audio is copied to
+   both channels, and only the first two channels (front left and right) of
+   multichannel audio are kept. The audio is converted with NumPy in blocks
+   read from a :class:`MappedWav`, and written through a
+   :class:`CopyEngine`. Files are converted in parallel threads; files that
+   are already CD-DA are not copied.
+
+   The output length is the input duration rounded down to a whole sample,
+   so the CD frame lengths of the TOC do not change.
+   """
+
+   #: Sample rate of CD-DA audio.
+   RATE = 44100
+
+   # number of output samples converted per block
+   _BLOCK = 128 * 1024
+
+   # zero crossings of the resampler filter on each side of its center
+   _ZEROS = 16
+
+   def __init__(self, progress=None, buf_size=None, workers=None):
+      """
+      :param progress:  Receives frame and byte counters while the files are
+                        written.
+      :type  progress:  :class:`~mktoc.progress_bar.Progress`
+
+      :param buf_size:  Size of the copy buffer of each thread in bytes.
+      :type  buf_size:  int
+
+      :param workers:   Number of files converted at the same time, by
+                        default the number of CPUs.
+      :type  workers:   int
+
+      .. Document private members
+      .. automethod:: __call__
+      """
+      self._progress = progress or mt_pb.Progress()
+      self._buf_size = buf_size
+      self._workers = workers or os.cpu_count() or 1
+      self._lock = threading.Lock()
+      self._progName = os.path.basename( sys.argv[0] )
+
+   @staticmethod
+   def is_cdda(header):
+      """Return :data:`True` if the :class:`WavHeader` *header* is CD-DA
+      audio."""
+      return (header.nchannels, header.sampwidth, header.framerate) == \
+             (2, 2, CddaConverter.RATE)
+
+   @stats.timed('convert')
+   def __call__(self, files, use_tmp_dir=False):
+      """
+      Convert the WAV files that are not CD-DA audio. The new files are
+      written in a :file:`cdda` directory next to each file, or in a
+      directory in :file:`/tmp`.
+
+      :param files:        WAV files to convert.
+      :type  files:        list
+
+      :param use_tmp_dir:  :data:`True` to write the new files to
+                           :file:`/tmp`.
+      :type  use_tmp_dir:  bool
+
+      :returns: :class:`list` of the WAV files in CD-DA format, with the
+                input file names of the files that were not converted.
+      """
+      out = list(files)
+      todo = []
+      total = 0
+      for i,f in enumerate(files):
+         hdr = read_header(f)
+         if not self.is_cdda(hdr):
+            if hdr.nchannels > 2:
+               log.warning( "only the first 2 channels of '%s' are kept", f )
+            n = hdr.nframes * self.RATE // hdr.framerate
+            new = self._get_tmp_name(f) if use_tmp_dir else \
+                  self._get_new_name(f)
+            todo.append( (f, new, n) )
+            out[i] = new
+            total += n
+      if not todo:
+         return out
+      import concurrent.futures
+      self._progress.set_total(total)
+      with concurrent.futures.ThreadPoolExecutor(self._workers) as pool:
+         for job in [pool.submit(self._convert, *args) for args in todo]:
+            job.result()
+      self._progress.finish()
+      return out
+
+   def _convert(self, src, dst, nframes):
+      """Write file 'src' in CD-DA format to 'dst'."""
+      np = _numpy()
+      engine = CopyEngine( self._buf_size, os.path.dirname(dst) or os.curdir )
+      update = lambda nbytes: self._progress.update( nbytes // 4, nbytes )
+      # the dither is repeatable for each file name
+      rng = np.random.default_rng( zlib.crc32(os.path.basename(src).encode()) )
+      tmp = dst + '.part'
+      with MappedWav(src) as mw:
+         hdr = mw.header
+         read = functools.partial( _read_float, np, mw )
+         dither = hdr.sampwidth > 2 or hdr.framerate != self.RATE
+         if hdr.framerate != self.RATE:
+            resample = _Resampler(np, hdr.framerate, self.RATE, self._ZEROS)
+         else:
+            resample = None
+         with open(tmp, 'wb') as fh:
+            fh.write( wav_header(2, 2, self.RATE, nframes) )
+            for k0 in range(0, nframes, self._BLOCK):
+               k1 = min(k0 + self._BLOCK, nframes)
+               if resample:
+                  y = resample(read, k0, k1)
+               else:
+                  y = read(k0, k1)
+               engine.write( fh, _quantize(np, y, rng, dither), update )
+      os.replace(tmp, dst)
+
+   def _get_new_name(self, f):
+      """Generates a new name in a 'cdda/' directory next to 'f'."""
+      dir_,name = os.path.split(f)
+      new_dir = os.path.join(dir_, 'cdda')
+      with self._lock:
+         if not os.path.exists(new_dir):
+            os.mkdir( new_dir )
+      return os.path.join( new_dir, name)
+
+   def _get_tmp_name(self, f):
+      """Generates a new name in a '/tmp/mktoc.[random]/' directory."""
+      if not hasattr(self, '_tmp_dir'):
+         self._tmp_dir = tempfile.mkdtemp( prefix=self._progName+'.' )
+      return os.path.join( self._tmp_dir, os.path.basename(f) )
+
+
+def _read_float(np, mw, start, stop):
+   """Return sample frames [start,stop) of the MappedWav 'mw' as a float32
+   stereo array in the range [-1,1); frames outside of the file are
+   silence."""
+   hdr = mw.header
+   out = np.zeros((stop - start, hdr.nchannels), dtype=np.float32)
+   lo,hi = max(start, 0), min(stop, mw.nframes)
+   if lo < hi:
+      if hdr.sampwidth == 3:
+         raw = np.frombuffer(mw.data, dtype=np.uint8)
+         raw = raw[lo*hdr.frame_size:hi*hdr.frame_size]
+         raw = raw.reshape(-1, hdr.nchannels, 3).astype(np.int32)
+         val = raw[...,0] | (raw[...,1] << 8) | (raw[...,2] << 16)
+         val = (val ^ 0x800000) - 0x800000         # sign extend
+         out[lo-start:hi-start] = val * (1.0 / (1 << 23))
+      else:
+         val = mw.samples[lo:hi]
+         if hdr.sampwidth == 1:
+            out[lo-start:hi-start] = (val - 128.0) * (1.0 / 128)
+         else:
+            out[lo-start:hi-start] = val * (1.0 / (1 << (hdr.sampwidth*8-1)))
+   if hdr.nchannels == 1:
+      return np.repeat(out, 2, axis=1)
+   return out[:,:2]
+
+
+def _quantize(np, y, rng, dither):
+   """Return the float samples 'y' as 16-bit PCM data, with TPDF dither of
+   +/-1 LSB if 'dither' is set."""
+   y = y * 32768.0
+   if dither:
+      y += rng.random(y.shape, dtype=np.float32)
+      y -= rng.random(y.shape, dtype=np.float32)
+   return np.clip(np.rint(y), -32768, 32767).astype('<i2')
+
+
+class _Resampler(object):
+   """Polyphase FIR sample rate converter from 'rate_in' to 'rate_out',
+   with a Kaiser windowed sinc low-pass filter."""
+   def __init__(self, np, rate_in, rate_out, zeros):
+      self._np = np
+      g = math.gcd(rate_in, rate_out)
+      self.up, self.down = L,M = rate_out // g, rate_in // g
+      # the filter runs at the up-sampled rate, the cut-off is just below
+      # the Nyquist frequency of the lower rate
+      R = max(L, M)
+      n = 2 * zeros * R + 1
+      self._center = zeros * R
+      t = np.arange(n) - self._center
+      cut = 0.97 / (2 * R)
+      h = 2 * cut * np.sinc(2 * cut * t) * np.kaiser(n, 8.0) * L
+      #: taps of each of the L phases
+      self.taps = T = -(-n // L)
+      h = np.concatenate([h, np.zeros(T*L - n)])
+      # phase 'p' filters x[i], x[i-1], ... with h[p], h[p+L], ...; the
+      # taps are stored in reverse to match an ascending window of x
+      self._phases = h.reshape(T, L).T[:, ::-1].astype(np.float32)
 
+   def __call__(self, read, k0, k1):
+      """Return output samples [k0,k1); 'read(start,stop)' returns input
+      sample frames."""
+      np = self._np
+      L,M,T = self.up, self.down, self.taps
+      pos = np.arange(k0, k1) * M + self._center
+      base = pos // L      # newest input sample of each output
+      first = int(base[0]) - T + 1
+      x = read(first, int(base[-1]) + 1)
+      y = np.empty((k1 - k0, x.shape[1]), dtype=np.float32)
+      for ch in range(x.shape[1]):
+         # a window view of one channel has contiguous rows, for BLAS
+         win = np.lib.stride_tricks.sliding_window_view(
+                  np.ascontiguousarray(x[:,ch]), T )
+         # outputs L apart use the same phase, and inputs M apart
+         for r in range(min(L, k1 - k0)):
+            phase = self._phases[ int(pos[r] % L) ]
+            rows = win[ int(base[r]) - T + 1 - first :: M ]
+            out = y[r::L, ch]
+            out[:] = rows[:len(out)] @ phase
+      return y
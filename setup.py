@@ -29,7 +29,7 @@ setup(
    download_url=(
       'https://github.com/cmcginty/mktoc/raw/master/dist/mktoc-%s.tar.gz'
       % (VERSION,)),
-   packages=['mktoc'],
+   packages=['mktoc', 'mktoc.bench'],
    entry_points = {
       'console_scripts': ['mktoc = mktoc.cmdline:main',],
    },